@@ -0,0 +1,201 @@
+"""
+Teste de carga: gunicorn com workers síncronos (WSGI) x workers uvicorn (ASGI
+com as views async) com o mesmo número de workers.
+
+Cria um banco de teste temporário, popula rachas/partidas/registros, sobe
+cada servidor apontando para esse banco e dispara GETs concorrentes nas
+leituras atendidas pelas views async (usuarios/me, rachas/meus_rachas,
+detalhe de partida e os três rankings). Mostra requests/s e latência p50/p99.
+
+Uso:
+    python benchmarks/bench_asgi.py [--workers 4] [--concorrencia 64] [--duracao 20]
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+DIRETORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRETORIO)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from rachas.models import (  # noqa: E402
+    User, Racha, JogadoresRacha, Premio, Partida, JogadorPartida, RegistroPartida, PremioPartida
+)
+
+
+def preparar_dados(total_usuarios, total_rachas, partidas_por_racha):
+    """Cria os dados e retorna [(token, [urls])] por usuário"""
+    usuarios = User.objects.bulk_create([
+        User(username=f'bench{i}', email=f'bench{i}@test.com', first_name='Bench', last_name=str(i), posicao='MEIA')
+        for i in range(total_usuarios)
+    ])
+    rachas = Racha.objects.bulk_create([
+        Racha(nome=f'Racha {i}', codigo_convite=f'B{i:04d}', ponto_gol=3, ponto_assistencia=2, ponto_presenca=1)
+        for i in range(total_rachas)
+    ])
+    for racha in rachas:
+        racha.administrador.add(usuarios[0])
+    JogadoresRacha.objects.bulk_create([
+        JogadoresRacha(racha=racha, jogador=user) for racha in rachas for user in usuarios
+    ])
+    premios = Premio.objects.bulk_create([Premio(racha=racha, nome='Craque', valor_pontos=5) for racha in rachas])
+    partidas = Partida.objects.bulk_create([
+        Partida(racha=racha) for racha in rachas for _ in range(partidas_por_racha)
+    ])
+    premio_do_racha = {p.racha_id: p for p in premios}
+    JogadorPartida.objects.bulk_create([
+        JogadorPartida(partida=partida, jogador=user, presente=True) for partida in partidas for user in usuarios
+    ])
+    RegistroPartida.objects.bulk_create([
+        RegistroPartida(
+            partida=partida,
+            jogador_gol=usuarios[i % len(usuarios)],
+            jogador_assistencia=usuarios[(i + 1) % len(usuarios)]
+        )
+        for partida in partidas for i in range(6)
+    ])
+    PremioPartida.objects.bulk_create([
+        PremioPartida(partida=partida, premio=premio_do_racha[partida.racha_id], jogador=usuarios[0])
+        for partida in partidas
+    ])
+
+    urls = ['/api/v1/usuarios/me/', '/api/v1/rachas/meus_rachas/']
+    for racha in rachas:
+        urls += [
+            f'/api/v1/rachas/{racha.id}/ranking/',
+            f'/api/v1/rachas/{racha.id}/ranking_artilheiros/',
+            f'/api/v1/rachas/{racha.id}/ranking_assistencias/',
+        ]
+    urls += [f'/api/v1/partidas/{partida.id}/' for partida in partidas]
+    return [(str(AccessToken.for_user(user)), urls) for user in usuarios]
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_servidor(asgi, workers, porta):
+    env = dict(os.environ, RACHAS_ASGI=str(asgi), DB_NAME=connection.settings_dict['NAME'], DEBUG='False')
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{porta}', '--workers', str(workers),
+         '--log-level', 'warning'],
+        cwd=DIRETORIO,
+        env=env,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite and processo.poll() is None:
+        try:
+            with socket.create_connection(('127.0.0.1', porta), timeout=1):
+                return processo
+        except OSError:
+            time.sleep(0.2)
+    processo.terminate()
+    raise RuntimeError('Servidor não iniciou')
+
+
+def carga(porta, clientes, concorrencia, duracao):
+    """Cada thread mantém uma conexão keep-alive e percorre as URLs de um usuário"""
+    latencias = []
+    erros = []
+    lock = threading.Lock()
+    fim = time.monotonic() + duracao
+
+    def cliente(indice):
+        token, urls = clientes[indice % len(clientes)]
+        headers = {'Authorization': f'Bearer {token}'}
+        conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+        locais = []
+        falhas = 0
+        i = indice
+        while time.monotonic() < fim:
+            url = urls[i % len(urls)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                conexao.request('GET', url, headers=headers)
+                resposta = conexao.getresponse()
+                resposta.read()
+                if resposta.status != 200:
+                    falhas += 1
+            except (OSError, http.client.HTTPException):
+                falhas += 1
+                conexao.close()
+                conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+                continue
+            locais.append(time.perf_counter() - inicio)
+        conexao.close()
+        with lock:
+            latencias.extend(locais)
+            erros.append(falhas)
+
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(concorrencia)]
+    inicio = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    decorrido = time.monotonic() - inicio
+
+    latencias.sort()
+    total = len(latencias)
+    return {
+        'rps': total / decorrido,
+        'p50_ms': latencias[total // 2] * 1000 if total else 0,
+        'p99_ms': latencias[max(int(total * 0.99) - 1, 0)] * 1000 if total else 0,
+        'erros': sum(erros),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concorrencia', type=int, default=64)
+    parser.add_argument('--duracao', type=float, default=20)
+    parser.add_argument('--aquecimento', type=float, default=3)
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--rachas', type=int, default=5)
+    parser.add_argument('--partidas', type=int, default=10, help='partidas por racha')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    nome_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        clientes = preparar_dados(args.usuarios, args.rachas, args.partidas)
+        # Os servidores abrem suas próprias conexões com o banco de teste
+        connection.close()
+
+        for nome, asgi in (('WSGI (sync)', False), ('ASGI (uvicorn + async)', True)):
+            porta = porta_livre()
+            servidor = iniciar_servidor(asgi, args.workers, porta)
+            try:
+                carga(porta, clientes, args.concorrencia, args.aquecimento)
+                r = carga(porta, clientes, args.concorrencia, args.duracao)
+            finally:
+                servidor.terminate()
+                servidor.wait()
+            print(
+                f"{nome:<24} {args.workers} workers | {r['rps']:8.1f} req/s | "
+                f"p50 {r['p50_ms']:7.1f} ms | p99 {r['p99_ms']:7.1f} ms | {r['erros']} erros"
+            )
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Custo de inicialização de um worker (gunicorn/manage.py): tempo de import
+e RSS ocioso com a pilha de imagens carregada sob demanda (rachas.imagens)
+x importada no topo de rachas/views.py, como antes.
+
+Cada cenário roda em subprocessos novos (o import só custa na primeira
+vez) e mostra a mediana das repetições:
+
+    django          django.setup()
+    urls            django.setup() + config.urls (todas as views)
+    urls_eager      urls + import rembg / PIL, o que o views.py fazia no topo
+    urls_sessao     urls + sessão rembg carregada (só workers de imagem;
+                    precisa do modelo em ~/.u2net)
+
+Uso:
+    python benchmarks/bench_imports.py [--repeticoes 5]
+        [--cenarios django,urls,urls_eager,urls_sessao]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import statistics
+import subprocess
+
+DIRETORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRETORIO)
+
+CENARIOS = ('django', 'urls', 'urls_eager', 'urls_sessao')
+PESADOS = ('rembg', 'onnxruntime', 'numpy', 'PIL')
+
+
+def rss_atual_mb():
+    with open('/proc/self/statm') as f:
+        paginas = int(f.read().split()[1])
+    return paginas * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def rss_pico_mb():
+    # ru_maxrss em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def executar_cenario(cenario):
+    """Roda dentro do subprocesso e imprime o resultado em JSON"""
+    inicio = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    django.setup()
+    if cenario != 'django':
+        import config.urls  # noqa: F401
+    if cenario == 'urls_eager':
+        import rembg  # noqa: F401
+        from PIL import Image  # noqa: F401
+    if cenario == 'urls_sessao':
+        from rachas.imagens import sessao_rembg
+        sessao_rembg()
+    duracao = time.perf_counter() - inicio
+
+    print(json.dumps({
+        'import_ms': duracao * 1000,
+        'rss_mb': rss_atual_mb(),
+        'rss_pico_mb': rss_pico_mb(),
+        'modulos': len(sys.modules),
+        'pesados': [nome for nome in PESADOS if nome in sys.modules],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--cenarios', default=','.join(CENARIOS))
+    parser.add_argument('--cenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cenario:
+        executar_cenario(args.cenario)
+        return
+
+    base = None
+    for cenario in args.cenarios.split(','):
+        resultados = []
+        for _ in range(args.repeticoes):
+            comando = [sys.executable, os.path.abspath(__file__), '--cenario', cenario]
+            saida = subprocess.run(comando, cwd=DIRETORIO, capture_output=True, text=True)
+            if saida.returncode != 0:
+                print(f'{cenario} falhou:\n{saida.stderr.strip().splitlines()[-1]}')
+                break
+            resultados.append(json.loads(saida.stdout.strip().splitlines()[-1]))
+        if not resultados:
+            continue
+
+        import_ms = statistics.median(r['import_ms'] for r in resultados)
+        rss_mb = statistics.median(r['rss_mb'] for r in resultados)
+        if cenario == 'urls':
+            base = (import_ms, rss_mb)
+        diferenca = ''
+        if base and cenario != 'urls':
+            diferenca = f" | vs urls {import_ms - base[0]:+7.0f} ms {rss_mb - base[1]:+6.0f} MB"
+        print(
+            f"{cenario:<12} | import {import_ms:7.0f} ms | RSS {rss_mb:6.0f} MB "
+            f"| {resultados[-1]['modulos']:5d} módulos | {','.join(resultados[-1]['pesados']) or '-'}"
+            f"{diferenca}"
+        )
+
+
+if __name__ == '__main__':
+    main()
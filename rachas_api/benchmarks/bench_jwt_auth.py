@@ -0,0 +1,98 @@
+"""
+Benchmark: JWTAuthentication x JWTUsuarioLeveAuthentication em leituras simples.
+
+Executa GET /rachas/meus_rachas/ (que só usa request.user.id) com cada classe
+de autenticação e mede a latência média, o p99 e as consultas por request.
+Usa um banco de teste temporário criado a partir das configurações atuais.
+
+Uso:
+    python benchmarks/bench_jwt_auth.py [--requests 500] [--rachas 10]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment, CaptureQueriesContext  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from rest_framework_simplejwt.authentication import JWTAuthentication  # noqa: E402
+
+from rachas.authentication import JWTUsuarioLeveAuthentication  # noqa: E402
+from rachas.models import User, Racha, JogadoresRacha  # noqa: E402
+from rachas.serializers import RachaTokenObtainPairSerializer  # noqa: E402
+from rachas.views import RachaViewSet  # noqa: E402
+
+
+def preparar_dados(total_rachas):
+    user = User.objects.create_user(
+        username='bench', email='bench@test.com', password='bench123', posicao='MEIA'
+    )
+    for i in range(total_rachas):
+        racha = Racha.objects.create(nome=f'Racha {i}')
+        JogadoresRacha.objects.create(racha=racha, jogador=user)
+        racha.administrador.add(user)
+    return user
+
+
+def medir(auth_class, access, total_requests):
+    view = RachaViewSet.as_view({'get': 'meus_rachas'}, authentication_classes=[auth_class])
+    factory = APIRequestFactory()
+    tempos = []
+    consultas = 0
+    for _ in range(total_requests):
+        request = factory.get('/api/v1/rachas/meus_rachas/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        with CaptureQueriesContext(connection) as ctx:
+            inicio = time.perf_counter()
+            response = view(request)
+            response.render()
+            tempos.append(time.perf_counter() - inicio)
+        assert response.status_code == 200, response.status_code
+        consultas += len(ctx.captured_queries)
+    tempos.sort()
+    return {
+        'media_ms': statistics.mean(tempos) * 1000,
+        'p99_ms': tempos[int(len(tempos) * 0.99) - 1] * 1000,
+        'consultas_por_request': consultas / total_requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rachas', type=int, default=10)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    nome_original = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        user = preparar_dados(args.rachas)
+        access = str(RachaTokenObtainPairSerializer.get_token(user).access_token)
+
+        # Aquecimento (imports, caches de URL/serializers)
+        medir(JWTAuthentication, access, 10)
+
+        for nome, classe in (
+            ('JWTAuthentication', JWTAuthentication),
+            ('JWTUsuarioLeveAuthentication', JWTUsuarioLeveAuthentication),
+        ):
+            r = medir(classe, access, args.requests)
+            print(
+                f"{nome:<30} média {r['media_ms']:.3f} ms | p99 {r['p99_ms']:.3f} ms | "
+                f"{r['consultas_por_request']:.1f} consultas/request"
+            )
+    finally:
+        connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Latência e memória da remoção de fundo: sessão nova a cada imagem (o que
+rembg.remove faz quando não recebe session) x sessão compartilhada do
+processo (rachas.imagens.sessao_rembg), para cada modelo.
+
+Cada modo roda em um subprocesso próprio para que a memória de um não
+contamine o outro. Mostra a latência da primeira imagem, a média das
+seguintes e o RSS (atual e pico) ao final.
+
+Uso:
+    python benchmarks/bench_rembg.py [--imagem foto.jpg] [--repeticoes 10]
+        [--modelos u2net,u2netp] [--threads 0]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+from io import BytesIO
+
+DIRETORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRETORIO)
+
+
+def rss_atual_mb():
+    with open('/proc/self/statm') as f:
+        paginas = int(f.read().split()[1])
+    return paginas * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def rss_pico_mb():
+    # ru_maxrss em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def imagem_teste(caminho):
+    if caminho:
+        with open(caminho, 'rb') as f:
+            return f.read()
+    from PIL import Image, ImageDraw
+    imagem = Image.new('RGB', (1024, 1024), (90, 140, 200))
+    desenho = ImageDraw.Draw(imagem)
+    desenho.ellipse((312, 160, 712, 560), fill=(230, 190, 160))
+    desenho.rectangle((262, 560, 762, 1024), fill=(200, 30, 30))
+    buffer = BytesIO()
+    imagem.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def executar_modo(modo, modelo, threads, repeticoes, caminho):
+    """Roda dentro do subprocesso e imprime o resultado em JSON"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    settings.RACHAS_REMBG_MODELO = modelo
+    settings.RACHAS_REMBG_THREADS_INTRA = threads
+
+    import rembg
+    from PIL import Image
+    from rachas import imagens
+
+    dados = imagem_teste(caminho)
+    rss_inicial = rss_atual_mb()
+    latencias = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        if modo == 'sessao_por_imagem':
+            rembg.remove(Image.open(BytesIO(dados)), session=rembg.new_session(modelo))
+        else:
+            imagens.remover_fundo(BytesIO(dados))
+        latencias.append(time.perf_counter() - inicio)
+
+    seguintes = latencias[1:] or latencias
+    print(json.dumps({
+        'primeira_ms': latencias[0] * 1000,
+        'media_ms': sum(seguintes) / len(seguintes) * 1000,
+        'rss_inicial_mb': rss_inicial,
+        'rss_final_mb': rss_atual_mb(),
+        'rss_pico_mb': rss_pico_mb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--imagem', help='arquivo de imagem (padrão: imagem sintética 1024x1024)')
+    parser.add_argument('--repeticoes', type=int, default=10)
+    parser.add_argument('--modelos', default='u2net,u2netp')
+    parser.add_argument('--threads', type=int, default=0, help='intra_op_num_threads (0 = padrão)')
+    parser.add_argument('--modo', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        modelo = args.modelos.split(',')[0]
+        executar_modo(args.modo, modelo, args.threads, args.repeticoes, args.imagem)
+        return
+
+    for modelo in args.modelos.split(','):
+        for modo in ('sessao_por_imagem', 'sessao_compartilhada'):
+            comando = [
+                sys.executable, os.path.abspath(__file__), '--modo', modo, '--modelos', modelo,
+                '--threads', str(args.threads), '--repeticoes', str(args.repeticoes),
+            ]
+            if args.imagem:
+                comando += ['--imagem', args.imagem]
+            saida = subprocess.run(comando, cwd=DIRETORIO, capture_output=True, text=True)
+            if saida.returncode != 0:
+                print(f'{modo} ({modelo}) falhou:\n{saida.stderr}')
+                continue
+            r = json.loads(saida.stdout.strip().splitlines()[-1])
+            print(
+                f"{modo:<22} {modelo:<8} | 1ª {r['primeira_ms']:8.0f} ms | "
+                f"média {r['media_ms']:7.0f} ms | RSS {r['rss_final_mb']:6.0f} MB "
+                f"(pico {r['rss_pico_mb']:6.0f} MB)"
+            )
+
+
+if __name__ == '__main__':
+    main()
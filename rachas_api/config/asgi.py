@@ -3,6 +3,14 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Needed for the live match stream (SSE) at /api/v1/partidas/<id>/eventos/,
+which keeps one connection open per client; under the sync gunicorn
+workers each client would hold a whole worker. With RACHAS_ASGI=True the
+async read views (rachas/views_async.py) are routed as well, and
+gunicorn.conf.py picks this module with uvicorn workers:
+
+    RACHAS_ASGI=True gunicorn --workers 4
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,7 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
-from decouple import config
+from decouple import config, Csv
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -168,9 +169,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'rachas.User'
 
+# Autenticação JWT sem buscar o User no banco a cada request
+# (ver rachas.authentication.JWTUsuarioLeveAuthentication)
+RACHAS_JWT_STATELESS = config('RACHAS_JWT_STATELESS', default=False, cast=bool)
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rachas.authentication.JWTUsuarioLeveAuthentication'
+        if RACHAS_JWT_STATELESS
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
     # 'DEFAULT_PERMISSION_CLASSES': [
     #     'rest_framework.permissions.IsAuthenticated',
@@ -184,11 +191,108 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=24),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    'TOKEN_OBTAIN_SERIALIZER': 'rachas.serializers.RachaTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'rachas.serializers.RachaTokenRefreshSerializer',
 }
 
+# Embute os ids dos rachas (admin/membro) no access token para autorizar
+# leituras sem consultar o banco. Tokens com versão de papéis desatualizada
+# voltam a consultar o banco.
+RACHAS_JWT_PAPEIS = config('RACHAS_JWT_PAPEIS', default=False, cast=bool)
+# Acima deste número de rachas os papéis não são embutidos (token muito grande)
+RACHAS_JWT_PAPEIS_MAX = config('RACHAS_JWT_PAPEIS_MAX', default=50, cast=int)
+# Tempo (s) em cache da versão de papéis lida no modo stateless. Com cache
+# local por processo é também o atraso máximo para revogar papéis; use um
+# cache compartilhado (CACHES) em produção com vários workers.
+RACHAS_PAPEIS_VERSAO_CACHE_TTL = config('RACHAS_PAPEIS_VERSAO_CACHE_TTL', default=30, cast=int)
+
 # Permitir todas as origens em desenvolvimento para evitar problemas de CORS
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+
+# Distribuição dos eventos ao vivo das partidas (SSE):
+# 'local' (um único processo) ou 'postgres' (LISTEN/NOTIFY entre workers)
+RACHAS_EVENTOS_BROKER = config('RACHAS_EVENTOS_BROKER', default='local')
+
+# Tempo (s) de cache da resolução código de convite -> racha
+RACHAS_CONVITE_CACHE_TTL = config('RACHAS_CONVITE_CACHE_TTL', default=60 * 60, cast=int)
+
+# Cache compartilhado entre os workers (Redis, ex: redis://host:6379/0).
+# Sem ele cada processo usa o próprio LocMemCache
+RACHAS_CACHE_URL = config('RACHAS_CACHE_URL', default='')
+if RACHAS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': RACHAS_CACHE_URL,
+        }
+    }
+
+# Contadores de solicitações pendentes por admin mantidos no cache. Exige o
+# cache compartilhado: com um LocMemCache por worker, cada processo teria a
+# sua contagem. Desligado, a contagem é feita no banco a cada leitura
+RACHAS_PENDENTES_CACHE = config('RACHAS_PENDENTES_CACHE', default=bool(RACHAS_CACHE_URL), cast=bool)
+# Tempo (s) de vida dos contadores de solicitações pendentes por admin
+RACHAS_PENDENTES_CACHE_TTL = config('RACHAS_PENDENTES_CACHE_TTL', default=5 * 60, cast=int)
+
+# Chave da permutação que gera os códigos de convite a partir da sequência
+# do banco. Não alterar depois que houver rachas: códigos novos poderiam
+# coincidir com os já emitidos
+RACHAS_CODIGO_CONVITE_CHAVE = config('RACHAS_CODIGO_CONVITE_CHAVE', default='rachas-codigo-convite')
+
+# Jobs em segundo plano (tabela jobs + manage.py run_worker)
+RACHAS_JOBS_CONCORRENCIA = config('RACHAS_JOBS_CONCORRENCIA', default=2, cast=int)
+RACHAS_JOBS_MAX_TENTATIVAS = config('RACHAS_JOBS_MAX_TENTATIVAS', default=5, cast=int)
+# Backoff entre tentativas: base * 2^(n-1) segundos, até o máximo
+RACHAS_JOBS_BACKOFF_BASE = config('RACHAS_JOBS_BACKOFF_BASE', default=10, cast=int)
+RACHAS_JOBS_BACKOFF_MAX = config('RACHAS_JOBS_BACKOFF_MAX', default=60 * 60, cast=int)
+# Reserva (s) de um job em execução. O worker a renova a cada terço desse
+# tempo enquanto o job roda; reserva vencida (worker encerrado ou travado)
+# devolve o job à fila
+RACHAS_JOBS_RESERVA = config('RACHAS_JOBS_RESERVA', default=60, cast=int)
+RACHAS_JOBS_RETENCAO = config('RACHAS_JOBS_RETENCAO', default=7 * 24 * 60 * 60, cast=int)
+
+# Remoção de fundo (rembg): modelo da sessão compartilhada do processo,
+# ex: 'u2net' (mais preciso) ou 'u2netp' (menor e mais rápido)
+RACHAS_REMBG_MODELO = config('RACHAS_REMBG_MODELO', default='u2net')
+# Threads do ONNX Runtime por sessão (0 = padrão do ONNX Runtime, todos os núcleos)
+RACHAS_REMBG_THREADS_INTRA = config('RACHAS_REMBG_THREADS_INTRA', default=0, cast=int)
+RACHAS_REMBG_THREADS_INTER = config('RACHAS_REMBG_THREADS_INTER', default=0, cast=int)
+# Carrega o modelo ao iniciar o worker em vez de no primeiro job
+RACHAS_REMBG_PRECARREGAR = config('RACHAS_REMBG_PRECARREGAR', default=True, cast=bool)
+# Maior lado (px) da imagem de perfil sem fundo gravada
+RACHAS_IMAGEM_PERFIL_LADO_MAX = config('RACHAS_IMAGEM_PERFIL_LADO_MAX', default=1024, cast=int)
+# Maior lado (px) da cópia usada na segmentação; a máscara é ampliada para a saída
+RACHAS_REMBG_LADO_INFERENCIA = config('RACHAS_REMBG_LADO_INFERENCIA', default=640, cast=int)
+# Variantes WebP geradas para cada imagem de perfil (maior lado em px)
+RACHAS_IMAGEM_VARIANTES = config('RACHAS_IMAGEM_VARIANTES', default='64,128,256,512', cast=Csv(int))
+RACHAS_IMAGEM_VARIANTES_QUALIDADE = config('RACHAS_IMAGEM_VARIANTES_QUALIDADE', default=80, cast=int)
+
+# Proxy de imagens (usuarios/proxy_image): timeouts (s) e pool de conexões com as origens
+RACHAS_PROXY_TIMEOUT_CONEXAO = config('RACHAS_PROXY_TIMEOUT_CONEXAO', default=3.05, cast=float)
+RACHAS_PROXY_TIMEOUT_LEITURA = config('RACHAS_PROXY_TIMEOUT_LEITURA', default=10, cast=float)
+RACHAS_PROXY_HOSTS = config('RACHAS_PROXY_HOSTS', default=10, cast=int)
+RACHAS_PROXY_CONEXOES = config('RACHAS_PROXY_CONEXOES', default=20, cast=int)
+# Cache LRU em disco das imagens: diretório, tamanho total e por imagem (bytes)
+RACHAS_PROXY_CACHE_DIR = config('RACHAS_PROXY_CACHE_DIR', default=str(BASE_DIR / '.cache' / 'proxy_imagens'))
+RACHAS_PROXY_CACHE_MAX_BYTES = config('RACHAS_PROXY_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+RACHAS_PROXY_CACHE_MAX_OBJETO = config('RACHAS_PROXY_CACHE_MAX_OBJETO', default=10 * 1024 * 1024, cast=int)
+# Intervalo mínimo (s) entre varreduras do diretório do cache para remover as entradas menos usadas
+RACHAS_PROXY_CACHE_INTERVALO_LIMPEZA = config('RACHAS_PROXY_CACHE_INTERVALO_LIMPEZA', default=60, cast=int)
+# Validade (s) quando a origem não informa Cache-Control max-age
+RACHAS_PROXY_CACHE_TTL = config('RACHAS_PROXY_CACHE_TTL', default=60 * 60, cast=int)
+
+# Upload direto ao bucket (URL PUT assinada): validade (s) e tamanho máximo aceito (assinado no PUT)
+RACHAS_UPLOAD_EXPIRACAO = config('RACHAS_UPLOAD_EXPIRACAO', default=10 * 60, cast=int)
+RACHAS_UPLOAD_MAX_BYTES = config('RACHAS_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+
+# Servidor ASGI (gunicorn + uvicorn workers, ver gunicorn.conf.py): também
+# ativa as views async das leituras mais acessadas (rachas/views_async.py)
+RACHAS_ASGI = config('RACHAS_ASGI', default=False, cast=bool)
+
+# Tempo (s) que uma Idempotency-Key continua válida para repetições
+RACHAS_IDEMPOTENCIA_TTL = config('RACHAS_IDEMPOTENCIA_TTL', default=24 * 60 * 60, cast=int)
 
 # -------------------------------------
 # ☁️ Cloudflare R2 Storage
@@ -255,10 +359,16 @@ CLOUDFLARE_R2_CONFIG_OPTIONS = {
 
 STATIC_URL = 'static/'
 
+# Domínio público das imagens (r2.dev, domínio próprio ou CDN). Se definido, a
+# URL guardada junto à imagem é esse prefixo + nome do arquivo; sem ele nada é
+# guardado para o bucket (o endpoint S3 do R2 só aceita URLs assinadas)
+RACHAS_MEDIA_URL_PUBLICA = config('RACHAS_MEDIA_URL_PUBLICA', default='')
+
 # Introduced in Django 4.2
 STORAGES = {
+    # Mídia com nomes pelo hash do conteúdo (deduplicada, Cache-Control immutable)
     "default": {
-        "BACKEND": "storages.backends.s3.S3Storage",
+        "BACKEND": "rachas.storage.S3ConteudoStorage",
         "OPTIONS": CLOUDFLARE_R2_CONFIG_OPTIONS,
     },
     "staticfiles": {
@@ -280,4 +390,5 @@ ACCOUNT_EMAIL_VERIFICATION = 'optional'
 
 
 BASE_URL_SYSTEM = os.environ.get('BASE_URL_SYSTEM', 'http://127.0.0.1:8000')
-# BASE_URL_IMAGES = MEDIA_URL if 'AWS_ACCESS_KEY_ID' in os.environ else f'{BASE_URL_SYSTEM}{MEDIA_URL}'
+# Prefixo das imagens quando o storage devolve caminhos relativos (storage local)
+BASE_URL_IMAGES = config('BASE_URL_IMAGES', default=f'{BASE_URL_SYSTEM}/media/')
@@ -0,0 +1,17 @@
+"""
+Configuração do gunicorn (lida automaticamente do diretório atual).
+
+RACHAS_ASGI=True serve o projeto por config.asgi com workers uvicorn (views
+async e stream SSE); caso contrário, config.wsgi com workers síncronos.
+O número de workers continua vindo de --workers / WEB_CONCURRENCY.
+"""
+import decouple
+
+# Nomes globais deste arquivo viram configurações do gunicorn (inclusive
+# "config"), por isso o decouple não é importado pelo nome da função
+if decouple.config('RACHAS_ASGI', default=False, cast=bool):
+    wsgi_app = 'config.asgi:application'
+    # Pacote uvicorn-worker (uvicorn.workers está obsoleto desde o uvicorn 0.30)
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi:application'
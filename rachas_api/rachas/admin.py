@@ -1,8 +1,10 @@
 from django.contrib import admin
 from .models import (
     User, Racha, JogadoresRacha, Premio, Partida,
-    JogadorPartida, RegistroPartida, PremioPartida, SolicitacaoRacha
+    JogadorPartida, RegistroPartida, PremioPartida, SolicitacaoRacha, Job
 )
+from .roles import incrementar_versao_papeis
+from .solicitacoes import decidir_em_lote, esquecer_pendentes_dos_rachas
 
 
 @admin.register(User)
@@ -55,6 +57,14 @@ class JogadoresRachaAdmin(admin.ModelAdmin):
     list_filter = ('ativo', 'racha', 'data_entrada')
     search_fields = ('jogador__username', 'racha__nome')
     readonly_fields = ('id', 'data_entrada')
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        incrementar_versao_papeis(obj.jogador_id)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        incrementar_versao_papeis(obj.jogador_id)
 
 
 @admin.register(Premio)
@@ -106,19 +116,47 @@ class SolicitacaoRachaAdmin(admin.ModelAdmin):
     
     actions = ['aprovar_solicitacoes', 'negar_solicitacoes']
     
+    def _decidir(self, queryset, novo_status):
+        # Superusuário decide por qualquer racha das solicitações selecionadas
+        selecionadas = list(queryset.values_list('id', 'racha_id'))
+        return decidir_em_lote(
+            [id_ for id_, _ in selecionadas],
+            novo_status,
+            {racha_id for _, racha_id in selecionadas}
+        )
+    
     def aprovar_solicitacoes(self, request, queryset):
-        for solicitacao in queryset.filter(status='PENDENTE'):
-            JogadoresRacha.objects.get_or_create(
-                racha=solicitacao.racha,
-                jogador=solicitacao.jogador
-            )
-            solicitacao.status = 'ACEITO'
-            solicitacao.save()
-        self.message_user(request, f"{queryset.count()} solicitações aprovadas.")
+        decididas = self._decidir(queryset, 'ACEITO')
+        self.message_user(request, f"{len(decididas)} solicitações aprovadas.")
     
     def negar_solicitacoes(self, request, queryset):
-        queryset.filter(status='PENDENTE').update(status='NEGADO')
-        self.message_user(request, f"{queryset.count()} solicitações negadas.")
+        decididas = self._decidir(queryset, 'NEGADO')
+        self.message_user(request, f"{len(decididas)} solicitações negadas.")
     
     aprovar_solicitacoes.short_description = "Aprovar solicitações selecionadas"
     negar_solicitacoes.short_description = "Negar solicitações selecionadas"
+    
+    # Edições e exclusões pelo admin: os contadores são recontados
+    def save_model(self, request, obj, form, change):
+        rachas = {obj.racha_id}
+        if change and 'racha' in form.changed_data:
+            rachas.add(form.initial.get('racha'))
+        super().save_model(request, obj, form, change)
+        esquecer_pendentes_dos_rachas(*rachas)
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        esquecer_pendentes_dos_rachas(obj.racha_id)
+    
+    def delete_queryset(self, request, queryset):
+        rachas = set(queryset.values_list('racha_id', flat=True))
+        super().delete_queryset(request, queryset)
+        esquecer_pendentes_dos_rachas(*rachas)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('tipo', 'status', 'tentativas', 'executar_em', 'concluido_em')
+    list_filter = ('status', 'tipo')
+    search_fields = ('tipo', 'id')
+    readonly_fields = ('id', 'criado_em', 'iniciado_em', 'reservado_ate', 'concluido_em', 'erro', 'resultado')
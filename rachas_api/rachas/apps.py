@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
 
 
 class RachasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rachas'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Registra as tarefas de segundo plano (módulos tarefas.py dos apps)
+        autodiscover_modules('tarefas')
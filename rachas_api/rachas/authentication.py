@@ -0,0 +1,99 @@
+import uuid
+from django.conf import settings
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+
+# Claims copiados do token para o usuário leve (claim -> campo do User)
+CLAIMS_USUARIO = {
+    'username': 'username',
+}
+
+
+def usuario_do_token(validated_token):
+    """
+    Monta um User a partir dos claims do token, sem consultar o banco.
+
+    Os campos ausentes no token ficam adiados (deferred): o primeiro acesso a
+    qualquer um deles carrega o restante do registro em uma única consulta
+    (ver User.refresh_from_db).
+    """
+    try:
+        user_id = uuid.UUID(str(validated_token[api_settings.USER_ID_CLAIM]))
+    except KeyError as e:
+        raise InvalidToken(_("Token contained no recognizable user identification")) from e
+    except ValueError as e:
+        raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    campos = {'id': user_id}
+    for claim, campo in CLAIMS_USUARIO.items():
+        if claim in validated_token:
+            campos[campo] = validated_token[claim]
+
+    # from_db espera os valores na ordem dos campos do modelo
+    nomes = [f.attname for f in User._meta.concrete_fields if f.attname in campos]
+    user = User.from_db(
+        router.db_for_read(User),
+        nomes,
+        [campos[nome] for nome in nomes],
+    )
+    user._carregar_tudo_ao_acessar = True
+    return user
+
+
+class JWTUsuarioLeveAuthentication(JWTAuthentication):
+    """
+    Autenticação JWT que não busca o User no banco a cada request.
+
+    O request.user é uma instância real de User (funciona em filtros como
+    jogador=request.user) montada com os claims do token; o banco só é
+    consultado se o código acessar um campo que não veio no token.
+
+    Como o registro não é lido na autenticação, usuários desativados só
+    perdem o acesso quando o access token expira.
+    """
+
+    def get_user(self, validated_token):
+        return usuario_do_token(validated_token)
+
+
+def usuario_do_request(request, token_na_query=False):
+    """
+    Autentica um HttpRequest puro (views async fora do DRF) pelo access token.
+
+    Retorna o usuário leve (ver usuario_do_token) ou None se não houver token;
+    levanta InvalidToken se o token for inválido ou expirado. Com
+    token_na_query, aceita também ?token= (EventSource não envia headers).
+    """
+    autenticacao = JWTAuthentication()
+    token = request.GET.get('token') if token_na_query else None
+    if not token:
+        header = autenticacao.get_header(request)
+        token = autenticacao.get_raw_token(header) if header else None
+    if not token:
+        return None
+    return usuario_do_token(autenticacao.get_validated_token(token))
+
+
+async def ausuario_do_request(request, token_na_query=False):
+    """
+    usuario_do_request para as views async, com a mesma regra do DRF: fora do
+    modo RACHAS_JWT_STATELESS o User é lido do banco e usuários inativos ou
+    removidos são recusados (AuthenticationFailed), como em
+    JWTAuthentication.get_user.
+    """
+    user = usuario_do_request(request, token_na_query=token_na_query)
+    if user is None or getattr(settings, 'RACHAS_JWT_STATELESS', False):
+        return user
+    registro = await User.objects.filter(pk=user.pk).afirst()
+    if registro is None:
+        raise AuthenticationFailed(_("User not found"), code="user_not_found")
+    if api_settings.CHECK_USER_IS_ACTIVE and not registro.is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    return registro
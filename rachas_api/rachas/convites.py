@@ -0,0 +1,85 @@
+import random
+import string
+import hashlib
+from django.conf import settings
+from django.db import connection
+
+
+ALFABETO_CONVITE = string.ascii_uppercase + string.digits
+TAMANHO_CONVITE = 5
+# Total de códigos possíveis (36^5)
+TOTAL_CODIGOS = len(ALFABETO_CONVITE) ** TAMANHO_CONVITE
+
+# Sequência do Postgres que numera os códigos (criada na migração 0011)
+SEQUENCIA_CONVITE = 'rachas_codigo_convite_seq'
+
+# Rede de Feistel sobre 26 bits (2^26 >= 36^5), em duas metades de 13 bits
+_BITS_METADE = 13
+_MASCARA_METADE = (1 << _BITS_METADE) - 1
+_RODADAS = 4
+
+
+def _rodada(chave, rodada, metade):
+    digest = hashlib.blake2b(
+        metade.to_bytes(2, 'big'),
+        key=chave,
+        person=bytes([rodada]) * 16,
+        digest_size=4
+    ).digest()
+    return int.from_bytes(digest, 'big') & _MASCARA_METADE
+
+
+def _feistel(valor, chave):
+    esquerda, direita = valor >> _BITS_METADE, valor & _MASCARA_METADE
+    for rodada in range(_RODADAS):
+        esquerda, direita = direita, esquerda ^ _rodada(chave, rodada, direita)
+    return (esquerda << _BITS_METADE) | direita
+
+
+def _chave():
+    return settings.RACHAS_CODIGO_CONVITE_CHAVE.encode()[:64]
+
+
+def embaralhar(numero):
+    """
+    Permutação (bijeção) de [0, TOTAL_CODIGOS) em si mesmo.
+
+    A rede de Feistel é uma permutação de [0, 2^26); valores fora do
+    intervalo são reaplicados até cair nele (cycle walking), o que mantém a
+    bijeção. Números consecutivos geram códigos sem relação aparente.
+    """
+    if not 0 <= numero < TOTAL_CODIGOS:
+        raise ValueError('Número fora do espaço de códigos de convite')
+    chave = _chave()
+    valor = _feistel(numero, chave)
+    while valor >= TOTAL_CODIGOS:
+        valor = _feistel(valor, chave)
+    return valor
+
+
+def numero_para_codigo(numero):
+    """Converte o número da sequência no código de convite (5 caracteres)"""
+    valor = embaralhar(numero)
+    caracteres = []
+    for _ in range(TAMANHO_CONVITE):
+        valor, resto = divmod(valor, len(ALFABETO_CONVITE))
+        caracteres.append(ALFABETO_CONVITE[resto])
+    return ''.join(reversed(caracteres))
+
+
+def proximo_codigo_convite():
+    """
+    Próximo código de convite, sem consultar os códigos existentes.
+
+    No Postgres o número vem de uma sequência (nextval não bloqueia e nunca
+    se repete entre transações concorrentes), então dois rachas criados ao
+    mesmo tempo recebem códigos distintos por construção.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [SEQUENCIA_CONVITE])
+            numero = cursor.fetchone()[0]
+    else:
+        # Bancos sem sequência (ex: sqlite em desenvolvimento)
+        numero = random.randrange(TOTAL_CODIGOS)
+    return numero_para_codigo(numero)
@@ -0,0 +1,172 @@
+import json
+import time
+import select
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+
+logger = logging.getLogger(__name__)
+
+# Canal do LISTEN/NOTIFY usado no modo postgres
+CANAL_POSTGRES = 'rachas_partida_eventos'
+# Eventos pendentes por assinante; acima disso o evento é descartado e o
+# cliente deve recarregar a partida
+TAMANHO_FILA = 100
+
+Inscricao = namedtuple('Inscricao', ['chave', 'loop', 'fila'])
+
+
+class BrokerLocal:
+    """
+    Broker em memória: entrega eventos aos assinantes deste processo.
+
+    publicar() pode ser chamado de threads síncronas (views WSGI/DRF); a
+    entrega é agendada no event loop de cada assinante.
+    """
+
+    def __init__(self):
+        self._assinantes = {}
+        self._lock = threading.Lock()
+
+    def entregar(self, partida_id, evento):
+        with self._lock:
+            assinantes = list(self._assinantes.get(str(partida_id), ()))
+        for inscricao in assinantes:
+            try:
+                inscricao.loop.call_soon_threadsafe(self._enfileirar, inscricao.fila, evento)
+            except RuntimeError:
+                # Loop já encerrado; a inscrição será cancelada pelo stream
+                pass
+
+    @staticmethod
+    def _enfileirar(fila, evento):
+        try:
+            fila.put_nowait(evento)
+        except asyncio.QueueFull:
+            logger.warning('Fila de eventos cheia; evento descartado')
+
+    def publicar(self, partida_id, evento):
+        self.entregar(partida_id, evento)
+
+    def inscrever(self, partida_id):
+        """
+        Registra um assinante no event loop atual.
+        Retorna a inscrição (cujo .fila recebe os eventos) para cancelar() depois.
+        """
+        inscricao = Inscricao(str(partida_id), asyncio.get_running_loop(), asyncio.Queue(maxsize=TAMANHO_FILA))
+        with self._lock:
+            self._assinantes.setdefault(inscricao.chave, set()).add(inscricao)
+        return inscricao
+
+    def cancelar(self, inscricao):
+        with self._lock:
+            assinantes = self._assinantes.get(inscricao.chave)
+            if assinantes is not None:
+                assinantes.discard(inscricao)
+                if not assinantes:
+                    del self._assinantes[inscricao.chave]
+
+
+class BrokerPostgres(BrokerLocal):
+    """
+    Broker entre workers via LISTEN/NOTIFY do Postgres.
+
+    publicar() envia um NOTIFY; cada processo mantém uma thread com uma
+    conexão dedicada em LISTEN (iniciada na primeira assinatura) que repassa
+    as notificações aos assinantes locais.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publicar(self, partida_id, evento):
+        payload = json.dumps({'partida_id': str(partida_id), 'evento': evento}, cls=DjangoJSONEncoder)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CANAL_POSTGRES, payload])
+
+    def _iniciar_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._escutar, name='rachas-eventos', daemon=True)
+            self._listener.start()
+
+    def _escutar(self):
+        while True:
+            conn = None
+            try:
+                # Conexão DB-API dedicada (psycopg2), fora do pool do Django
+                conn = connection.get_new_connection(connection.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {CANAL_POSTGRES}')
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notificacao = conn.notifies.pop(0)
+                        dados = json.loads(notificacao.payload)
+                        self.entregar(dados['partida_id'], dados['evento'])
+            except Exception:
+                logger.exception('Listener de eventos desconectado; reconectando')
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(1)
+
+    def inscrever(self, partida_id):
+        self._iniciar_listener()
+        return super().inscrever(partida_id)
+
+
+_broker = None
+
+
+def get_broker():
+    """Broker configurado em RACHAS_EVENTOS_BROKER ('local' ou 'postgres')"""
+    global _broker
+    if _broker is None:
+        if getattr(settings, 'RACHAS_EVENTOS_BROKER', 'local') == 'postgres':
+            _broker = BrokerPostgres()
+        else:
+            _broker = BrokerLocal()
+    return _broker
+
+
+def publicar_evento(partida_id, tipo, dados=None):
+    """
+    Publica um delta da partida após o commit da transação atual.
+    Falhas na publicação não afetam a escrita que gerou o evento.
+    """
+    evento = {'tipo': tipo, 'dados': dados or {}, 'ts': int(time.time() * 1000)}
+
+    def enviar():
+        try:
+            get_broker().publicar(partida_id, evento)
+        except Exception:
+            logger.exception('Falha ao publicar evento da partida %s', partida_id)
+
+    transaction.on_commit(enviar)
+
+
+def registro_evento(registro):
+    """Delta compacto de um registro de gol/assistência"""
+    return {
+        'id': str(registro.id),
+        'jogador_gol_id': str(registro.jogador_gol_id) if registro.jogador_gol_id else None,
+        'jogador_assistencia_id': str(registro.jogador_assistencia_id) if registro.jogador_assistencia_id else None,
+    }
+
+
+def formatar_sse(evento):
+    dados = json.dumps(evento['dados'], cls=DjangoJSONEncoder)
+    return f"id: {evento['ts']}\nevent: {evento['tipo']}\ndata: {dados}\n\n"
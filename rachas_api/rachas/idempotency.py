@@ -0,0 +1,101 @@
+import time
+import hashlib
+import functools
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ChaveIdempotencia
+
+
+HEADER = 'Idempotency-Key'
+MAX_TAMANHO_CHAVE = 255
+
+# Última limpeza de chaves expiradas feita por este processo
+_ultima_limpeza = 0.0
+
+
+def _ttl():
+    return getattr(settings, 'RACHAS_IDEMPOTENCIA_TTL', 24 * 60 * 60)
+
+
+def _limpar_expiradas():
+    """Remove chaves expiradas, no máximo uma vez por intervalo em cada processo"""
+    global _ultima_limpeza
+    agora = time.monotonic()
+    if agora - _ultima_limpeza < getattr(settings, 'RACHAS_IDEMPOTENCIA_INTERVALO_LIMPEZA', 300):
+        return
+    _ultima_limpeza = agora
+    limite = timezone.now() - timedelta(seconds=_ttl())
+    ChaveIdempotencia.objects.filter(criado_em__lt=limite).delete()
+
+
+def _resposta_armazenada(registro):
+    response = Response(registro.resposta, status=registro.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotente(view_method):
+    """
+    Torna uma action de escrita idempotente via header Idempotency-Key.
+
+    A chave é reservada na mesma transação da escrita: uma repetição recebe a
+    resposta armazenada sem executar a view novamente (repetições simultâneas
+    aguardam o commit da primeira). Apenas respostas 2xx são armazenadas; em
+    caso de erro a reserva é desfeita e o cliente pode tentar de novo.
+    """
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        chave_cliente = request.headers.get(HEADER)
+        if not chave_cliente:
+            return view_method(self, request, *args, **kwargs)
+        if len(chave_cliente) > MAX_TAMANHO_CHAVE:
+            return Response(
+                {'erro': f'{HEADER} deve ter no máximo {MAX_TAMANHO_CHAVE} caracteres'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        chave = hashlib.sha256(
+            f'{request.user.pk}:{request.method}:{request.path}:{chave_cliente}'.encode()
+        ).hexdigest()
+        corpo_hash = hashlib.sha256(request.body).hexdigest()
+
+        _limpar_expiradas()
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    registro = ChaveIdempotencia.objects.create(chave=chave, corpo_hash=corpo_hash)
+            except IntegrityError:
+                registro = ChaveIdempotencia.objects.select_for_update().get(chave=chave)
+                if registro.criado_em < timezone.now() - timedelta(seconds=_ttl()):
+                    # Chave expirada ainda não limpa: reutiliza a linha
+                    registro.corpo_hash = corpo_hash
+                    registro.status_code = 0
+                    registro.resposta = None
+                    registro.criado_em = timezone.now()
+                    registro.save()
+                elif registro.corpo_hash != corpo_hash:
+                    return Response(
+                        {'erro': f'{HEADER} já utilizada com outro conteúdo'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                else:
+                    return _resposta_armazenada(registro)
+
+            response = view_method(self, request, *args, **kwargs)
+
+            if status.is_success(response.status_code):
+                registro.status_code = response.status_code
+                registro.resposta = response.data
+                registro.save(update_fields=['status_code', 'resposta'])
+            else:
+                transaction.set_rollback(True)
+            return response
+
+    return wrapper
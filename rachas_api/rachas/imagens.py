@@ -0,0 +1,105 @@
+import threading
+from io import BytesIO
+from django.conf import settings
+
+
+# Sessões rembg do processo, por modelo. Criar uma sessão carrega o modelo
+# ONNX (dezenas a centenas de MB), então cada processo cria uma única vez e
+# a reutiliza; InferenceSession.run pode ser chamada de várias threads.
+_sessoes = {}
+_trava_sessoes = threading.Lock()
+
+
+def _nova_sessao(modelo):
+    import onnxruntime
+    import rembg
+
+    opcoes = onnxruntime.SessionOptions()
+    intra = getattr(settings, 'RACHAS_REMBG_THREADS_INTRA', 0)
+    inter = getattr(settings, 'RACHAS_REMBG_THREADS_INTER', 0)
+    if intra:
+        opcoes.intra_op_num_threads = intra
+    if inter:
+        opcoes.inter_op_num_threads = inter
+    return rembg.new_session(modelo, sess_opts=opcoes)
+
+
+def sessao_rembg(modelo=None):
+    """Sessão rembg compartilhada do processo (RACHAS_REMBG_MODELO por padrão)"""
+    modelo = modelo or getattr(settings, 'RACHAS_REMBG_MODELO', 'u2net')
+    sessao = _sessoes.get(modelo)
+    if sessao is None:
+        with _trava_sessoes:
+            sessao = _sessoes.get(modelo)
+            if sessao is None:
+                sessao = _sessoes[modelo] = _nova_sessao(modelo)
+    return sessao
+
+
+def _abrir_reduzida(arquivo, lado_max):
+    """
+    Abre a imagem já orientada (EXIF) e com o maior lado <= lado_max.
+
+    Em JPEG, draft() faz o decodificador reduzir por 1/2, 1/4 ou 1/8 durante
+    a leitura, então uma foto de 12 MP nunca é decodificada inteira.
+    """
+    from PIL import Image, ImageOps
+
+    imagem = Image.open(arquivo)
+    imagem.draft('RGB', (lado_max, lado_max))
+    imagem = ImageOps.exif_transpose(imagem)
+    imagem.thumbnail((lado_max, lado_max), Image.LANCZOS)
+    return imagem
+
+
+def gerar_variantes(arquivo, lados, qualidade=80):
+    """
+    Versões WebP da imagem com o maior lado limitado a cada valor de `lados`.
+    Retorna [(lado, bytes)]. A imagem é decodificada uma única vez, já
+    reduzida para o maior dos lados.
+    """
+    from PIL import Image
+
+    imagem = _abrir_reduzida(arquivo, max(lados))
+    transparente = imagem.mode in ('RGBA', 'LA', 'PA') or 'transparency' in imagem.info
+    imagem = imagem.convert('RGBA' if transparente else 'RGB')
+
+    variantes = []
+    for lado in sorted(lados, reverse=True):
+        # Reduz a partir da variante anterior (maior), que já é pequena
+        imagem.thumbnail((lado, lado), Image.LANCZOS)
+        buffer = BytesIO()
+        imagem.save(buffer, format='WEBP', quality=qualidade, method=4)
+        variantes.append((lado, buffer.getvalue()))
+    return variantes
+
+
+def remover_fundo(arquivo):
+    """
+    Remove o fundo da imagem (arquivo aberto) e retorna o PNG resultante.
+
+    A imagem de saída tem no máximo RACHAS_IMAGEM_PERFIL_LADO_MAX; a
+    segmentação roda numa cópia menor (RACHAS_REMBG_LADO_INFERENCIA) e a
+    máscara é ampliada para o tamanho de saída.
+
+    rembg e Pillow são importados aqui, e não no topo do módulo, para que
+    só o processo que processa imagens (o worker) carregue o modelo.
+    """
+    import rembg
+    from PIL import Image
+
+    lado_saida = getattr(settings, 'RACHAS_IMAGEM_PERFIL_LADO_MAX', 1024)
+    lado_inferencia = getattr(settings, 'RACHAS_REMBG_LADO_INFERENCIA', 640)
+
+    imagem = _abrir_reduzida(arquivo, lado_saida).convert('RGBA')
+    entrada = imagem.convert('RGB')
+    entrada.thumbnail((lado_inferencia, lado_inferencia), Image.BILINEAR)
+
+    mascara = rembg.remove(entrada, session=sessao_rembg(), only_mask=True)
+    if mascara.size != imagem.size:
+        mascara = mascara.resize(imagem.size, Image.BILINEAR)
+    resultado = Image.composite(imagem, Image.new('RGBA', imagem.size, 0), mascara)
+
+    buffer = BytesIO()
+    resultado.save(buffer, format='PNG')
+    return buffer.getvalue()
@@ -0,0 +1,183 @@
+import random
+import logging
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Tarefas registradas com @tarefa: nome -> função
+TAREFAS = {}
+
+
+def tarefa(nome, ao_falhar=None):
+    """
+    Registra uma função como tarefa de segundo plano.
+
+    A função recebe os argumentos do job (JSON) como kwargs; o valor
+    retornado (serializável em JSON) fica em Job.resultado. Exceções geram
+    nova tentativa com backoff até max_tentativas. ao_falhar, se informada,
+    é chamada com os mesmos kwargs só quando a última tentativa falha.
+    """
+    def registrar(funcao):
+        funcao.ao_falhar = ao_falhar
+        TAREFAS[nome] = funcao
+        return funcao
+    return registrar
+
+
+def falha_definitiva(funcao, argumentos):
+    """Chama o ao_falhar da tarefa; erros no próprio tratamento só são registrados"""
+    if getattr(funcao, 'ao_falhar', None) is None:
+        return
+    try:
+        funcao.ao_falhar(**argumentos)
+    except Exception:
+        logger.exception('Falha no tratamento da falha da tarefa %s', funcao.__name__)
+
+
+def enfileirar(nome, /, atraso=0, max_tentativas=None, **argumentos):
+    """
+    Cria um job para a tarefa. Dentro de uma transação, o job só fica
+    visível para o worker após o commit (junto com os dados que ele usa).
+    """
+    if nome not in TAREFAS:
+        raise ValueError(f'Tarefa não registrada: {nome}')
+    return Job.objects.create(
+        tipo=nome,
+        argumentos=argumentos,
+        max_tentativas=max_tentativas or getattr(settings, 'RACHAS_JOBS_MAX_TENTATIVAS', 5),
+        executar_em=timezone.now() + timedelta(seconds=atraso)
+    )
+
+
+def reivindicar(limite, tipos=None):
+    """
+    Marca como EXECUTANDO até `limite` jobs vencidos e os retorna.
+
+    SELECT ... FOR UPDATE SKIP LOCKED: workers concorrentes pulam as linhas
+    já travadas por outro worker em vez de esperar por elas, então cada job
+    é entregue a um único worker.
+    """
+    agora = timezone.now()
+    with transaction.atomic():
+        jobs = Job.objects.select_for_update(skip_locked=True).filter(
+            status='PENDENTE',
+            executar_em__lte=agora
+        )
+        if tipos:
+            jobs = jobs.filter(tipo__in=tipos)
+        ids = list(jobs.order_by('executar_em').values_list('id', flat=True)[:limite])
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids).update(
+            status='EXECUTANDO',
+            iniciado_em=agora,
+            reservado_ate=agora + _reserva(),
+            tentativas=F('tentativas') + 1
+        )
+    return list(Job.objects.filter(id__in=ids).order_by('executar_em'))
+
+
+def _reserva():
+    return timedelta(seconds=getattr(settings, 'RACHAS_JOBS_RESERVA', 60))
+
+
+def _backoff(tentativas):
+    """Espera exponencial (base * 2^(n-1)) com jitter, limitada ao máximo"""
+    base = getattr(settings, 'RACHAS_JOBS_BACKOFF_BASE', 10)
+    maximo = getattr(settings, 'RACHAS_JOBS_BACKOFF_MAX', 60 * 60)
+    espera = min(base * 2 ** (tentativas - 1), maximo)
+    return espera * random.uniform(0.8, 1.2)
+
+
+def renovar_reservas(ids):
+    """Estende a reserva dos jobs ainda em execução por este worker"""
+    if not ids:
+        return 0
+    return Job.objects.filter(id__in=ids, status='EXECUTANDO').update(
+        reservado_ate=timezone.now() + _reserva()
+    )
+
+
+def executar(job):
+    """
+    Executa um job reivindicado e grava o resultado, a nova tentativa ou a
+    falha. Se a reserva venceu e o job foi reivindicado de novo nesse meio
+    tempo, o resultado desta execução é descartado.
+    """
+    funcao = TAREFAS.get(job.tipo)
+    # Só a execução que detém a reserva (mesma tentativa) grava o desfecho
+    desta_execucao = Job.objects.filter(id=job.id, status='EXECUTANDO', tentativas=job.tentativas)
+    try:
+        if funcao is None:
+            raise LookupError(f'Tarefa não registrada: {job.tipo}')
+        resultado = funcao(**job.argumentos)
+    except Exception:
+        erro = traceback.format_exc()
+        agora = timezone.now()
+        if funcao is not None and job.tentativas < job.max_tentativas:
+            espera = _backoff(job.tentativas)
+            logger.warning('Job %s (%s) falhou; nova tentativa em %.0fs', job.id, job.tipo, espera)
+            desta_execucao.update(
+                status='PENDENTE',
+                executar_em=agora + timedelta(seconds=espera),
+                erro=erro
+            )
+        else:
+            logger.error('Job %s (%s) falhou definitivamente', job.id, job.tipo)
+            if desta_execucao.update(status='FALHOU', concluido_em=agora, erro=erro):
+                falha_definitiva(funcao, job.argumentos)
+        return False
+
+    desta_execucao.update(
+        status='CONCLUIDO',
+        concluido_em=timezone.now(),
+        resultado=resultado,
+        erro=''
+    )
+    return True
+
+
+def recuperar_travados():
+    """
+    Devolve para a fila jobs EXECUTANDO cuja reserva venceu (o worker parou
+    de renová-la: encerrado ou travado no meio da execução). Jobs longos de
+    um worker ativo continuam com ele. Conta como tentativa; na última, o
+    job falha e o ao_falhar da tarefa é chamado, como em executar().
+    """
+    agora = timezone.now()
+    travados = Job.objects.filter(status='EXECUTANDO').filter(
+        # Sem reserva: reivindicados antes de a coluna existir
+        Q(reservado_ate__lt=agora) | Q(reservado_ate__isnull=True, iniciado_em__lt=agora - _reserva())
+    )
+    with transaction.atomic():
+        # Travados por outro worker recuperando ao mesmo tempo ficam com ele
+        esgotados = list(
+            travados.filter(tentativas__gte=F('max_tentativas')).select_for_update(skip_locked=True)
+        )
+        Job.objects.filter(id__in=[job.id for job in esgotados]).update(
+            status='FALHOU',
+            concluido_em=agora,
+            erro='Tempo de execução esgotado'
+        )
+    for job in esgotados:
+        logger.error('Job %s (%s) falhou definitivamente: reserva vencida', job.id, job.tipo)
+        falha_definitiva(TAREFAS.get(job.tipo), job.argumentos)
+    devolvidos = travados.filter(tentativas__lt=F('max_tentativas')).update(
+        status='PENDENTE',
+        executar_em=agora
+    )
+    return devolvidos + len(esgotados)
+
+
+def limpar_concluidos():
+    """Remove jobs concluídos há mais de RACHAS_JOBS_RETENCAO segundos"""
+    limite = timezone.now() - timedelta(seconds=getattr(settings, 'RACHAS_JOBS_RETENCAO', 7 * 24 * 60 * 60))
+    return Job.objects.filter(status='CONCLUIDO', concluido_em__lt=limite).delete()[0]
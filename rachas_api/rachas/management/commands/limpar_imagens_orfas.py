@@ -0,0 +1,70 @@
+import posixpath
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rachas.models import User, Racha
+from rachas.uploads import PREFIXO_PENDENTES
+
+
+def _arquivos(storage, diretorio):
+    """(nome, modificado_em) dos arquivos sob `diretorio`"""
+    if hasattr(storage, 'bucket'):
+        # Uma listagem traz a data de cada objeto, sem um HEAD por arquivo
+        prefixo = storage._normalize_name(f'{diretorio}/')
+        raiz = prefixo[:-len(f'{diretorio}/')]
+        for objeto in storage.bucket.objects.filter(Prefix=prefixo):
+            yield objeto.key[len(raiz):], objeto.last_modified
+        return
+    diretorios, arquivos = storage.listdir(diretorio)
+    for arquivo in arquivos:
+        nome = posixpath.join(diretorio, arquivo)
+        yield nome, storage.get_modified_time(nome)
+    for subdiretorio in diretorios:
+        yield from _arquivos(storage, posixpath.join(diretorio, subdiretorio))
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga do storage as imagens de perfil, variantes e uploads temporários que nenhum '
+        'usuário ou racha referencia. Com nomes por conteúdo, storage.delete() não apaga '
+        'nada (o arquivo pode ser compartilhado); esta é a limpeza.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idade', type=float, default=24,
+            help='Só apaga arquivos sem referência há mais de N horas (uploads e jobs em andamento)'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Só lista, sem apagar')
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=options['idade'])
+        referenciados = set()
+        diretorios = {}
+        for modelo in (User, Racha):
+            campo = modelo._meta.get_field('imagem_perfil')
+            diretorios.setdefault(campo.storage, {PREFIXO_PENDENTES}).add(campo.upload_to.rstrip('/'))
+            registros = modelo.objects.values_list('imagem_perfil', 'imagem_variantes', 'imagem_pendente')
+            for nome, variantes, pendente in registros.iterator():
+                # Upload confirmado esperando o worker (tarefa imagens.armazenar_upload)
+                referenciados.update((nome, pendente))
+                referenciados.update((variantes or {}).get('tamanhos', {}).values())
+
+        apagados = 0
+        for storage, nomes_diretorios in diretorios.items():
+            apagar = getattr(storage, 'apagar_definitivo', storage.delete)
+            for diretorio in sorted(nomes_diretorios):
+                for nome, modificado_em in _arquivos(storage, diretorio):
+                    if nome in referenciados or modificado_em > limite:
+                        continue
+                    if options['dry_run']:
+                        self.stdout.write(f'  {nome}')
+                    else:
+                        apagar(nome)
+                    apagados += 1
+
+        if options['dry_run']:
+            self.stdout.write(f'[dry-run] {apagados} arquivos sem referência')
+        else:
+            self.stdout.write(f'{apagados} arquivos sem referência apagados')
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from rachas.models import User, Racha
+from rachas.storage import url_publica
+
+
+class Command(BaseCommand):
+    help = (
+        'Preenche imagem_perfil_url (e as URLs das variantes) de usuários e rachas '
+        'com imagem. Rode após a migração ou ao mudar RACHAS_MEDIA_URL_PUBLICA (--todos).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos', action='store_true',
+            help='Recalcula também os registros que já têm URL'
+        )
+        parser.add_argument('--lote', type=int, default=500, help='Registros por UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Só conta, sem gravar')
+
+    def handle(self, *args, **options):
+        for modelo in (User, Racha):
+            registros = modelo.objects.exclude(imagem_perfil='').exclude(imagem_perfil__isnull=True)
+            if not options['todos']:
+                registros = registros.filter(imagem_perfil_url='')
+            registros = registros.only('pk', 'imagem_perfil', 'imagem_perfil_url', 'imagem_variantes')
+
+            pendentes = []
+            atualizados = sem_url = 0
+            for instance in registros.iterator(chunk_size=options['lote']):
+                storage = instance.imagem_perfil.storage
+                url = url_publica(storage, instance.imagem_perfil.name)
+                if not url:
+                    # Storage com URLs assinadas: continuam resolvidas na leitura
+                    sem_url += 1
+                    continue
+                instance.imagem_perfil_url = url
+                variantes = instance.imagem_variantes
+                if variantes.get('tamanhos'):
+                    variantes['urls'] = {
+                        lado: url_publica(storage, nome) for lado, nome in variantes['tamanhos'].items()
+                    }
+                pendentes.append(instance)
+                if len(pendentes) >= options['lote']:
+                    atualizados += self._gravar(modelo, pendentes, options['dry_run'])
+                    pendentes = []
+            atualizados += self._gravar(modelo, pendentes, options['dry_run'])
+
+            prefixo = '[dry-run] ' if options['dry_run'] else ''
+            self.stdout.write(
+                f'{prefixo}{modelo._meta.verbose_name_plural}: {atualizados} atualizados, '
+                f'{sem_url} sem URL pública estável'
+            )
+
+    def _gravar(self, modelo, instances, dry_run):
+        if instances and not dry_run:
+            modelo.objects.bulk_update(instances, ['imagem_perfil_url', 'imagem_variantes'])
+        return len(instances)
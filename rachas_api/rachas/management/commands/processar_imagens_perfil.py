@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import signal
+import multiprocessing
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from rachas.jobs import falha_definitiva
+from rachas.models import User
+
+
+ACOES = ('remover_fundo', 'variantes')
+
+
+class _Limitador:
+    """Limita as operações do processo a `taxa` por segundo (0 = sem limite)"""
+
+    def __init__(self, taxa):
+        self.intervalo = 1 / taxa if taxa > 0 else 0
+        self.proxima = 0.0
+
+    def aguardar(self):
+        if not self.intervalo:
+            return
+        agora = time.monotonic()
+        if agora < self.proxima:
+            time.sleep(self.proxima - agora)
+        self.proxima = max(agora, self.proxima) + self.intervalo
+
+
+# Estado de cada processo do pool (criado em _iniciar_processo)
+_acao = None
+_limitador = None
+
+
+def _iniciar_processo(acao, taxa, forcar):
+    """Inicializador do pool: conexões próprias e sessão rembg carregada uma vez"""
+    global _acao, _limitador
+    import django
+    # No-op com fork; com spawn o processo começa sem o Django configurado
+    django.setup()
+    # Ctrl+C é tratado pelo processo pai
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _acao = (acao, forcar)
+    _limitador = _Limitador(taxa)
+    if acao == 'remover_fundo' and getattr(settings, 'RACHAS_REMBG_PRECARREGAR', False):
+        from rachas.imagens import sessao_rembg
+        sessao_rembg()
+
+
+def _processar(item):
+    """Processa um usuário; retorna (pk, resultado, erro)"""
+    from rachas import tarefas
+
+    pk, nome = item
+    acao, forcar = _acao
+    if acao == 'remover_fundo':
+        funcao, argumentos = tarefas.remover_fundo_perfil, {'user_id': pk, 'nome': nome}
+    else:
+        funcao = tarefas.gerar_variantes
+        argumentos = {'modelo': User._meta.label, 'pk': pk, 'nome': nome, 'forcar': forcar}
+    # Cada imagem é uma leitura e algumas gravações no storage
+    _limitador.aguardar()
+    try:
+        if acao == 'remover_fundo':
+            # Mesmo estado do upload com remove_bg, exigido pela tarefa
+            User.objects.filter(pk=pk, imagem_perfil=nome).update(imagem_perfil_status='PROCESSANDO')
+        resultado = funcao(**argumentos)
+    except Exception as e:
+        # Sem novas tentativas no lote: a falha é definitiva
+        falha_definitiva(funcao, argumentos)
+        return pk, None, f'{type(e).__name__}: {e}'
+    return pk, resultado, None
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove o fundo ou gera as variantes das imagens de perfil existentes em lote, '
+        'com um pool de processos (uma sessão rembg carregada por processo)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('acao', choices=ACOES)
+        parser.add_argument(
+            '--processos', type=int, default=max((os.cpu_count() or 2) // 2, 1),
+            help='Processos do pool; 0 processa no próprio processo'
+        )
+        parser.add_argument(
+            '--taxa', type=float, default=2.0,
+            help='Máximo de imagens por segundo somando todos os processos (0 = sem limite)'
+        )
+        parser.add_argument(
+            '--progresso', default='processar_imagens_perfil.json',
+            help='Arquivo de progresso; uma nova execução continua de onde parou'
+        )
+        parser.add_argument('--recomecar', action='store_true', help='Ignora o progresso salvo')
+        parser.add_argument('--limite', type=int, help='Processa no máximo N imagens')
+        parser.add_argument('--forcar', action='store_true', help='Reprocessa imagens já sem fundo ou com variantes')
+        parser.add_argument('--dry-run', action='store_true', help='Só lista o que seria processado')
+
+    def handle(self, *args, **options):
+        acao = options['acao']
+        progresso = self._carregar_progresso(options['progresso'], acao, options['recomecar'])
+
+        usuarios = User.objects.exclude(imagem_perfil='').exclude(imagem_perfil__isnull=True).order_by('pk')
+        if acao == 'remover_fundo' and not options['forcar']:
+            # Já sem fundo (upload com remove_bg ou execução anterior). Pelo
+            # status: com nomes pelo hash do conteúdo o nome não diz nada
+            usuarios = usuarios.exclude(imagem_perfil_status='CONCLUIDO')
+        if progresso['ultimo_pk']:
+            usuarios = usuarios.filter(pk__gt=progresso['ultimo_pk'])
+        if options['limite']:
+            usuarios = usuarios[:options['limite']]
+        itens = [(str(pk), nome) for pk, nome in usuarios.values_list('pk', 'imagem_perfil')]
+
+        if options['dry_run']:
+            for pk, nome in itens[:20]:
+                self.stdout.write(f'  {pk} {nome}')
+            self.stdout.write(
+                f'[dry-run] {len(itens)} imagens para {acao} '
+                f'({progresso["processados"]} já processadas antes)'
+            )
+            return
+        if not itens:
+            self.stdout.write('Nada a processar')
+            return
+
+        self.stdout.write(f'{len(itens)} imagens para {acao} com {options["processos"]} processo(s)')
+        processos = options['processos']
+        taxa_por_processo = options['taxa'] / max(processos, 1)
+        inicio = time.monotonic()
+        try:
+            if processos == 0:
+                _iniciar_processo(acao, taxa_por_processo, options['forcar'])
+                resultados = map(_processar, itens)
+                self._acompanhar(resultados, progresso, options['progresso'], len(itens), inicio)
+            else:
+                # Os filhos abrem suas próprias conexões
+                connections.close_all()
+                with multiprocessing.Pool(
+                    processos,
+                    initializer=_iniciar_processo,
+                    initargs=(acao, taxa_por_processo, options['forcar'])
+                ) as pool:
+                    # imap mantém a ordem: o progresso só avança sobre itens concluídos
+                    resultados = pool.imap(_processar, itens)
+                    self._acompanhar(resultados, progresso, options['progresso'], len(itens), inicio)
+        except KeyboardInterrupt:
+            self._salvar_progresso(options['progresso'], progresso)
+            raise CommandError(f'Interrompido; progresso salvo em {options["progresso"]}')
+
+    def _acompanhar(self, resultados, progresso, caminho, total, inicio):
+        for indice, (pk, resultado, erro) in enumerate(resultados, start=1):
+            progresso['ultimo_pk'] = pk
+            progresso['processados'] += 1
+            if erro:
+                progresso['falhas'].append(pk)
+                self.stderr.write(f'  {pk}: {erro}')
+            if indice % 20 == 0 or indice == total:
+                self._salvar_progresso(caminho, progresso)
+                decorrido = time.monotonic() - inicio
+                self.stdout.write(f'{indice}/{total} ({indice / decorrido:.1f} imagens/s)')
+        self.stdout.write(
+            f'Concluído: {progresso["processados"]} processadas, {len(progresso["falhas"])} falhas'
+        )
+
+    def _carregar_progresso(self, caminho, acao, recomecar):
+        novo = {'acao': acao, 'ultimo_pk': None, 'processados': 0, 'falhas': []}
+        if recomecar or not os.path.exists(caminho):
+            return novo
+        with open(caminho) as arquivo:
+            progresso = json.load(arquivo)
+        if progresso.get('acao') != acao:
+            raise CommandError(f'{caminho} é de outra ação ({progresso.get("acao")}); use --recomecar')
+        return progresso
+
+    def _salvar_progresso(self, caminho, progresso):
+        temporario = f'{caminho}.tmp'
+        with open(temporario, 'w') as arquivo:
+            json.dump(progresso, arquivo)
+        os.replace(temporario, caminho)
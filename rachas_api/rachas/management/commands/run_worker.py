@@ -0,0 +1,136 @@
+import os
+import time
+import signal
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from rachas.jobs import reivindicar, executar, renovar_reservas, recuperar_travados, limpar_concluidos
+
+
+logger = logging.getLogger('rachas.jobs')
+
+# Intervalo (s) entre as manutenções (jobs travados e limpeza)
+INTERVALO_MANUTENCAO = 60
+
+
+class Command(BaseCommand):
+    help = 'Executa os jobs em segundo plano da tabela jobs (sem broker externo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concorrencia', type=int,
+            default=getattr(settings, 'RACHAS_JOBS_CONCORRENCIA', 2),
+            help='Jobs executados em paralelo por este worker'
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=1.0,
+            help='Espera (s) entre consultas quando a fila está vazia'
+        )
+        parser.add_argument(
+            '--tipos', default='',
+            help='Lista (separada por vírgula) de tipos de job atendidos; vazio = todos'
+        )
+        parser.add_argument(
+            '--uma-vez', action='store_true',
+            help='Processa os jobs vencidos e termina (útil em cron e testes)'
+        )
+
+    def handle(self, *args, **options):
+        concorrencia = max(1, options['concorrencia'])
+        tipos = [t.strip() for t in options['tipos'].split(',') if t.strip()]
+        self._parar = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._sinal_parada)
+            signal.signal(signal.SIGINT, self._sinal_parada)
+
+        identificacao = f'{socket.gethostname()}:{os.getpid()}'
+        self.stdout.write(f'Worker {identificacao} iniciado (concorrência {concorrencia})')
+        if getattr(settings, 'RACHAS_REMBG_PRECARREGAR', False) and (
+            not tipos or any(tipo.startswith('imagens.') for tipo in tipos)
+        ):
+            # Carrega o modelo antes do primeiro job de imagem
+            from rachas.imagens import sessao_rembg
+            sessao_rembg()
+            self.stdout.write(f'Modelo {settings.RACHAS_REMBG_MODELO} carregado')
+
+        livres = threading.Semaphore(concorrencia)
+        ultima_manutencao = 0.0
+        # Jobs em execução neste worker, cujas reservas são renovadas
+        self._em_execucao = set()
+        self._trava = threading.Lock()
+        fim = threading.Event()
+        renovacao = threading.Thread(
+            target=self._renovar_reservas,
+            args=(fim, getattr(settings, 'RACHAS_JOBS_RESERVA', 60) / 3),
+            name='job-reservas',
+            daemon=True
+        )
+        renovacao.start()
+        with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='job') as pool:
+            while not self._parar.is_set():
+                # Todas as threads ocupadas: espera uma vaga
+                if not livres.acquire(timeout=options['intervalo']):
+                    continue
+                vagas = 1
+                while vagas < concorrencia and livres.acquire(blocking=False):
+                    vagas += 1
+
+                try:
+                    if time.monotonic() - ultima_manutencao > INTERVALO_MANUTENCAO:
+                        ultima_manutencao = time.monotonic()
+                        recuperar_travados()
+                        limpar_concluidos()
+                    # Só reivindica o que pode executar agora
+                    jobs = reivindicar(vagas, tipos)
+                except DatabaseError:
+                    logger.exception('Falha ao consultar a fila de jobs')
+                    connection.close()
+                    jobs = []
+
+                for _ in range(vagas - len(jobs)):
+                    livres.release()
+                for job in jobs:
+                    pool.submit(self._executar, job, livres)
+
+                if not jobs:
+                    if options['uma_vez']:
+                        break
+                    self._parar.wait(options['intervalo'])
+            self.stdout.write(f'Worker {identificacao} aguardando jobs em execução')
+        fim.set()
+        renovacao.join()
+        connection.close()
+
+    def _executar(self, job, livres):
+        with self._trava:
+            self._em_execucao.add(job.id)
+        try:
+            executar(job)
+        except Exception:
+            logger.exception('Erro ao registrar o resultado do job %s', job.id)
+        finally:
+            with self._trava:
+                self._em_execucao.discard(job.id)
+            close_old_connections()
+            livres.release()
+
+    def _renovar_reservas(self, fim, intervalo):
+        """Heartbeat: renova as reservas dos jobs em execução até o worker terminar"""
+        while not fim.wait(intervalo):
+            with self._trava:
+                ids = list(self._em_execucao)
+            try:
+                renovar_reservas(ids)
+            except DatabaseError:
+                logger.exception('Falha ao renovar a reserva dos jobs')
+                connection.close()
+        connection.close()
+
+    def _sinal_parada(self, signum, frame):
+        self.stdout.write(f'Sinal {signum} recebido; encerrando após os jobs em execução')
+        self._parar.set()
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-19 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0008_alter_registropartida_jogador_gol'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='papeis_versao',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
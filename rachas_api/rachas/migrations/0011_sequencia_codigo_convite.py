@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from rachas.convites import SEQUENCIA_CONVITE, TOTAL_CODIGOS
+
+
+def criar_sequencia(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE SEQUENCE IF NOT EXISTS {SEQUENCIA_CONVITE} '
+        f'MINVALUE 0 MAXVALUE {TOTAL_CODIGOS - 1} START 0 NO CYCLE'
+    )
+
+
+def remover_sequencia(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCIA_CONVITE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0010_chaveidempotencia'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_sequencia, remover_sequencia),
+    ]
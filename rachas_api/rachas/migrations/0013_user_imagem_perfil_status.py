@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='imagem_perfil_status',
+            field=models.CharField(blank=True, choices=[('PROCESSANDO', 'Processando'), ('CONCLUIDO', 'Concluído'), ('FALHOU', 'Falhou')], default='', max_length=20),
+        ),
+    ]
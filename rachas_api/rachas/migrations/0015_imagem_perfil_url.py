@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:10
+
+import rachas.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0014_imagem_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='racha',
+            name='imagem_perfil_url',
+            field=rachas.models.UrlImagemField(blank=True, campo_imagem='imagem_perfil', default='', editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='imagem_perfil_url',
+            field=rachas.models.UrlImagemField(blank=True, campo_imagem='imagem_perfil', default='', editable=False, max_length=500),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0015_imagem_perfil_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='reservado_ate',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
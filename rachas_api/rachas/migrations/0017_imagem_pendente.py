@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rachas', '0016_job_reservado_ate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='racha',
+            name='imagem_pendente',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='imagem_pendente',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+    ]
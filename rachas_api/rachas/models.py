@@ -1,13 +1,65 @@
 import uuid
-import string
-import random
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 
+from .convites import proximo_codigo_convite
+from .storage import url_publica
 
-class User(AbstractUser):
+
+class UrlImagemField(models.CharField):
+    """
+    URL pública da imagem do campo `campo_imagem`, resolvida a cada save
+    (como auto_now). Declarado depois do campo da imagem, para que o arquivo
+    já tenha sido gravado e tenha o nome final.
+    """
+    
+    def __init__(self, *args, campo_imagem='imagem_perfil', **kwargs):
+        self.campo_imagem = campo_imagem
+        kwargs.setdefault('max_length', 500)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('default', '')
+        kwargs.setdefault('editable', False)
+        super().__init__(*args, **kwargs)
+    
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['campo_imagem'] = self.campo_imagem
+        return name, path, args, kwargs
+    
+    def pre_save(self, model_instance, add):
+        arquivo = getattr(model_instance, self.campo_imagem)
+        valor = url_publica(arquivo.storage, arquivo.name) if arquivo else ''
+        setattr(model_instance, self.attname, valor)
+        return valor
+
+
+class UrlImagemMixin:
+    """
+    Grava os UrlImagemField sempre que a imagem correspondente é gravada.
+    O pre_save do campo só roda se ele estiver entre os campos salvos, e o
+    save de uma instância com campos adiados (usuário montado a partir do
+    token) grava apenas os campos carregados.
+    """
+    
+    def save(self, *args, update_fields=None, **kwargs):
+        adiados = self.get_deferred_fields()
+        for campo in self._meta.concrete_fields:
+            if not isinstance(campo, UrlImagemField):
+                continue
+            imagem = self._meta.get_field(campo.campo_imagem)
+            if update_fields is not None:
+                if imagem.name in update_fields or imagem.attname in update_fields:
+                    update_fields = {*update_fields, campo.name}
+            elif campo.attname in adiados and imagem.attname not in adiados:
+                # Deixa de ser adiado; o valor é recalculado no pre_save
+                setattr(self, campo.attname, '')
+        return super().save(*args, update_fields=update_fields, **kwargs)
+
+
+class User(UrlImagemMixin, AbstractUser):
     """Modelo de usuário estendido com campos específicos para jogadores"""
     
     POSICOES = [
@@ -25,8 +77,28 @@ class User(AbstractUser):
     data_nascimento = models.DateField(blank=True, null=True)
     posicao = models.CharField(max_length=20, choices=POSICOES)
     imagem_perfil = models.ImageField(upload_to='perfis/', blank=True, null=True)
+    # Remoção de fundo da imagem de perfil, feita pelo worker (tarefas.py)
+    imagem_perfil_status = models.CharField(
+        max_length=20,
+        choices=[
+            ('PROCESSANDO', 'Processando'),
+            ('CONCLUIDO', 'Concluído'),
+            ('FALHOU', 'Falhou'),
+        ],
+        blank=True,
+        default=''
+    )
+    # URL pública da imagem_perfil, lida pelos serializers sem consultar o storage
+    imagem_perfil_url = UrlImagemField()
+    # Chave temporária do upload direto confirmado e ainda não processado (uploads.py)
+    imagem_pendente = models.CharField(max_length=255, blank=True, default='', editable=False)
+    # Variantes WebP da imagem: {'origem': nome da imagem, 'tamanhos': {lado: nome}, 'urls': {lado: url}}
+    imagem_variantes = models.JSONField(default=dict, blank=True, editable=False)
     auth_uid = models.CharField(max_length=255)
     data_criacao = models.DateTimeField(auto_now_add=True)
+    # Incrementada a cada mudança de papéis (admin/membro) para invalidar
+    # os papéis embutidos em access tokens já emitidos
+    papeis_versao = models.PositiveIntegerField(default=0, editable=False)
     
     def get_imagem_perfil_url(self):
         """Retorna a URL absoluta da imagem de perfil"""
@@ -36,6 +108,17 @@ class User(AbstractUser):
             return self.imagem_perfil.url
         return f"{settings.MEDIA_URL}{self.imagem_perfil.name}"
     
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        """
+        Usuário montado a partir do token (JWTUsuarioLeveAuthentication):
+        no primeiro campo adiado acessado, carrega todos os demais de uma vez
+        em vez de uma consulta por campo.
+        """
+        if fields is not None and getattr(self, '_carregar_tudo_ao_acessar', False):
+            self._carregar_tudo_ao_acessar = False
+            fields = set(fields) | self.get_deferred_fields()
+        return super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+    
     class Meta:
         db_table = 'users'
         verbose_name = 'Usuário'
@@ -45,13 +128,18 @@ class User(AbstractUser):
         return self.get_full_name() or self.username
 
 
-class Racha(models.Model):
+class Racha(UrlImagemMixin, models.Model):
     """Modelo para representar um racha (pelada)"""
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     administrador = models.ManyToManyField(User, related_name='rachas_administrados')
     nome = models.CharField(max_length=255)
     imagem_perfil = models.ImageField(upload_to='rachas/', blank=True, null=True)
+    imagem_perfil_url = UrlImagemField()
+    # Ver User.imagem_pendente
+    imagem_pendente = models.CharField(max_length=255, blank=True, default='', editable=False)
+    # Variantes WebP da imagem (ver User.imagem_variantes)
+    imagem_variantes = models.JSONField(default=dict, blank=True, editable=False)
     data_inicio = models.DateField(blank=True, null=True)
     data_encerramento = models.DateField(blank=True, null=True)
     codigo_convite = models.CharField(max_length=5, unique=True, editable=False)
@@ -72,17 +160,23 @@ class Racha(models.Model):
     
     def save(self, *args, **kwargs):
         """Gera código de convite automaticamente se não existir"""
-        if not self.codigo_convite:
+        if self.codigo_convite:
+            return super().save(*args, **kwargs)
+        while True:
             self.codigo_convite = self._gerar_codigo_convite()
-        super().save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # A sequência nunca repete um código, mas pode coincidir com
+                # um código aleatório anterior a ela: passa para o próximo
+                if not Racha.objects.filter(codigo_convite=self.codigo_convite).exists():
+                    raise
     
     @staticmethod
     def _gerar_codigo_convite():
-        """Gera um código de 5 caracteres único"""
-        while True:
-            codigo = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
-            if not Racha.objects.filter(codigo_convite=codigo).exists():
-                return codigo
+        """Gera um código de 5 caracteres único (ver convites.py)"""
+        return proximo_codigo_convite()
 
 
 class JogadoresRacha(models.Model):
@@ -232,3 +326,62 @@ class SolicitacaoRacha(models.Model):
     
     def __str__(self):
         return f"{self.jogador.get_full_name()} - {self.racha.nome} ({self.status})"
+
+
+class ChaveIdempotencia(models.Model):
+    """Resposta armazenada de uma escrita feita com o header Idempotency-Key"""
+    
+    # sha256 de usuário + método + caminho + chave enviada pelo cliente
+    chave = models.CharField(max_length=64, primary_key=True)
+    corpo_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(default=0)
+    resposta = models.JSONField(encoder=DjangoJSONEncoder, blank=True, null=True)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        db_table = 'chave_idempotencia'
+        verbose_name = 'Chave de Idempotência'
+        verbose_name_plural = 'Chaves de Idempotência'
+    
+    def __str__(self):
+        return f"{self.chave} ({self.status_code})"
+
+
+class Job(models.Model):
+    """Tarefa em segundo plano executada pelo worker (manage.py run_worker)"""
+    
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('EXECUTANDO', 'Executando'),
+        ('CONCLUIDO', 'Concluído'),
+        ('FALHOU', 'Falhou'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Nome registrado com @tarefa (ver jobs.py)
+    tipo = models.CharField(max_length=100)
+    argumentos = models.JSONField(encoder=DjangoJSONEncoder, default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDENTE')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    max_tentativas = models.PositiveSmallIntegerField(default=5)
+    executar_em = models.DateTimeField()
+    iniciado_em = models.DateTimeField(blank=True, null=True)
+    # Reserva do worker que executa o job, renovada enquanto ele roda
+    reservado_ate = models.DateTimeField(blank=True, null=True)
+    concluido_em = models.DateTimeField(blank=True, null=True)
+    erro = models.TextField(blank=True, default='')
+    resultado = models.JSONField(encoder=DjangoJSONEncoder, blank=True, null=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'jobs'
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        ordering = ['-criado_em']
+        indexes = [
+            # Busca do worker: pendentes com executar_em vencido
+            models.Index(fields=['status', 'executar_em'], name='jobs_status_executar_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.tipo} ({self.status})"
@@ -1,5 +1,6 @@
 from rest_framework import permissions
-from .models import Racha, JogadoresRacha
+from .models import Racha
+from .roles import papeis_do_usuario
 
 
 class IsAdminRacha(permissions.BasePermission):
@@ -10,7 +11,7 @@ class IsAdminRacha(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # obj deve ser uma instância de Racha
         if isinstance(obj, Racha):
-            return obj.administrador == request.user
+            return papeis_do_usuario(request).is_admin(obj)
         return False
 
 
@@ -22,11 +23,7 @@ class IsJogadorRacha(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # obj deve ser uma instância de Racha
         if isinstance(obj, Racha):
-            return JogadoresRacha.objects.filter(
-                racha=obj,
-                jogador=request.user,
-                ativo=True
-            ).exists()
+            return papeis_do_usuario(request).is_membro(obj)
         return False
 
 
@@ -40,16 +37,12 @@ class IsAdminRachaOrReadOnly(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             # Verificar se é jogador do racha
             if isinstance(obj, Racha):
-                return JogadoresRacha.objects.filter(
-                    racha=obj,
-                    jogador=request.user,
-                    ativo=True
-                ).exists() or obj.administrador == request.user
+                return papeis_do_usuario(request).is_admin_ou_membro(obj)
             return True
         
         # Apenas admin pode editar
         if isinstance(obj, Racha):
-            return request.user in obj.administrador.all()
+            return papeis_do_usuario(request).is_admin(obj)
         return False
 
 
@@ -79,7 +72,7 @@ class IsAdminRachaOrOwner(permissions.BasePermission):
             return True
         
         # Se é admin do racha
-        if hasattr(obj, 'racha'):
-            return obj.racha.administrador == request.user
+        if hasattr(obj, 'racha_id'):
+            return papeis_do_usuario(request).is_admin(obj.racha_id)
         
         return False
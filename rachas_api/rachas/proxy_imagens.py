@@ -0,0 +1,443 @@
+"""
+Proxy de imagens externas (usuarios/proxy_image) com cache em disco.
+
+A imagem é repassada ao cliente em blocos à medida que chega da origem
+(StreamingHttpResponse) e gravada ao mesmo tempo no cache. As conexões com
+as origens vêm de uma requests.Session compartilhada (pool keep-alive).
+
+O cache é um LRU em disco limitado em bytes. Entradas vencidas são
+revalidadas na origem com If-None-Match/If-Modified-Since; respostas do
+cache atendem requisições condicionais e Range do cliente. Só respostas
+com Content-Type de imagem são repassadas e guardadas.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 64 * 1024
+# Rodapé de cada arquivo do cache: tamanho (bytes) do JSON de metadados
+_TAMANHO_RODAPE = 8
+_INTERVALO = re.compile(r'^bytes=(\d*)-(\d*)$')
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+# SVG pode conter scripts: não é servido pelo domínio da API
+_TIPOS_RECUSADOS = ('image/svg+xml',)
+
+
+class ImagemIndisponivel(Exception):
+    """A origem não respondeu ou não retornou a imagem"""
+
+
+_sessao = None
+_trava_sessao = threading.Lock()
+
+
+def sessao_http():
+    """requests.Session do processo, com pool de conexões por host"""
+    global _sessao
+    if _sessao is None:
+        with _trava_sessao:
+            if _sessao is None:
+                sessao = requests.Session()
+                adaptador = HTTPAdapter(
+                    pool_connections=getattr(settings, 'RACHAS_PROXY_HOSTS', 10),
+                    pool_maxsize=getattr(settings, 'RACHAS_PROXY_CONEXOES', 20)
+                )
+                sessao.mount('http://', adaptador)
+                sessao.mount('https://', adaptador)
+                _sessao = sessao
+    return _sessao
+
+
+class EntradaCache:
+    """Arquivo do cache aberto: corpo + metadados (JSON) + rodapé"""
+
+    def __init__(self, caminho, arquivo, meta, tamanho):
+        self.caminho = caminho
+        self.arquivo = arquivo
+        self.meta = meta
+        self.tamanho = tamanho
+
+    def fresca(self):
+        return time.time() < self.meta['expira_em']
+
+    def ler(self, inicio=0, fim=None):
+        """Gera o corpo (ou o intervalo [inicio, fim]) em blocos e fecha o arquivo"""
+        restante = (self.tamanho - 1 if fim is None else fim) - inicio + 1
+        try:
+            self.arquivo.seek(inicio)
+            while restante > 0:
+                bloco = self.arquivo.read(min(TAMANHO_BLOCO, restante))
+                if not bloco:
+                    break
+                restante -= len(bloco)
+                yield bloco
+        finally:
+            self.arquivo.close()
+
+    def fechar(self):
+        self.arquivo.close()
+
+
+class GravacaoCache:
+    """
+    Gravação de uma entrada em um arquivo temporário, movido para o lugar
+    com os.replace (leitores nunca veem um arquivo pela metade). Passando de
+    max_objeto, a gravação é abandonada.
+    """
+
+    def __init__(self, cache, caminho, max_objeto):
+        self.cache = cache
+        self.caminho = caminho
+        self.max_objeto = max_objeto
+        descritor, self.temporario = tempfile.mkstemp(dir=cache.diretorio, suffix='.tmp')
+        self.arquivo = os.fdopen(descritor, 'wb')
+        self.hash = hashlib.sha256()
+        self.tamanho = 0
+        self.ativa = True
+
+    def escrever(self, bloco):
+        if not self.ativa:
+            return
+        self.tamanho += len(bloco)
+        if self.tamanho > self.max_objeto:
+            self.descartar()
+            return
+        self.hash.update(bloco)
+        self.arquivo.write(bloco)
+
+    def concluir(self, meta):
+        if not self.ativa:
+            return
+        # ETag da origem, se houver (o cliente pode tê-lo recebido no repasse);
+        # senão, o hash do corpo
+        meta = dict(meta, etag=meta.get('etag') or f'"{self.hash.hexdigest()[:32]}"')
+        dados = json.dumps(meta).encode()
+        self.arquivo.write(dados)
+        self.arquivo.write(len(dados).to_bytes(_TAMANHO_RODAPE, 'big'))
+        self.arquivo.close()
+        os.replace(self.temporario, self.caminho)
+        self.ativa = False
+        self.cache.gravado(self.tamanho)
+
+    def descartar(self):
+        if not self.ativa:
+            return
+        self.ativa = False
+        self.arquivo.close()
+        try:
+            os.remove(self.temporario)
+        except FileNotFoundError:
+            pass
+
+
+class CacheDisco:
+    """
+    Cache LRU em disco limitado a max_bytes.
+
+    Cada URL é um único arquivo (corpo, metadados e rodapé); o mtime marca o
+    último uso, e limpar() apaga os menos usados quando o total passa do limite.
+    limpar() percorre o diretório inteiro, então roda no máximo uma vez por
+    intervalo, ou antes disso se as gravações desde a última passarem de 10%
+    do limite.
+    """
+
+    def __init__(self, diretorio, max_bytes, max_objeto):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.max_objeto = max_objeto
+        # Última limpeza e bytes gravados desde ela, neste processo
+        self._ultima_limpeza = 0.0
+        self._gravados = 0
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, url):
+        return os.path.join(self.diretorio, hashlib.sha256(url.encode()).hexdigest() + '.cache')
+
+    def abrir(self, url):
+        """Entrada da URL (marcada como usada agora) ou None"""
+        caminho = self.caminho(url)
+        try:
+            arquivo = open(caminho, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            total = os.fstat(arquivo.fileno()).st_size
+            arquivo.seek(total - _TAMANHO_RODAPE)
+            tamanho_meta = int.from_bytes(arquivo.read(_TAMANHO_RODAPE), 'big')
+            arquivo.seek(total - _TAMANHO_RODAPE - tamanho_meta)
+            meta = json.loads(arquivo.read(tamanho_meta))
+            os.utime(caminho)
+        except (OSError, ValueError):
+            arquivo.close()
+            logger.warning('Entrada de cache ilegível descartada: %s', caminho)
+            self._remover(caminho)
+            return None
+        return EntradaCache(caminho, arquivo, meta, total - _TAMANHO_RODAPE - tamanho_meta)
+
+    def gravar(self, url):
+        return GravacaoCache(self, self.caminho(url), self.max_objeto)
+
+    def revalidar(self, entrada, expira_em):
+        """Regrava a entrada com a nova validade (origem respondeu 304)"""
+        gravacao = GravacaoCache(self, entrada.caminho, self.max_objeto)
+        for bloco in entrada.ler():
+            gravacao.escrever(bloco)
+        # Mantém os validadores da origem e o ETag da entrada
+        gravacao.concluir({**entrada.meta, 'expira_em': expira_em})
+
+    def gravado(self, tamanho):
+        """Entrada gravada: limpa o cache se já passou o intervalo ou o volume"""
+        self._gravados += tamanho
+        agora = time.monotonic()
+        intervalo = getattr(settings, 'RACHAS_PROXY_CACHE_INTERVALO_LIMPEZA', 60)
+        if agora - self._ultima_limpeza < intervalo and self._gravados < self.max_bytes * 0.1:
+            return
+        self._ultima_limpeza = agora
+        self._gravados = 0
+        self.limpar()
+
+    def limpar(self):
+        """Apaga as entradas menos usadas até o total ficar em 90% do limite"""
+        entradas = []
+        total = 0
+        with os.scandir(self.diretorio) as itens:
+            for item in itens:
+                try:
+                    info = item.stat()
+                except FileNotFoundError:
+                    continue
+                if item.name.endswith('.tmp') and info.st_mtime < time.time() - 3600:
+                    # Gravação interrompida (processo encerrado)
+                    self._remover(item.path)
+                elif item.name.endswith('.cache'):
+                    entradas.append((info.st_mtime, info.st_size, item.path))
+                    total += info.st_size
+        if total <= self.max_bytes:
+            return
+        for _, tamanho, caminho in sorted(entradas):
+            self._remover(caminho)
+            total -= tamanho
+            if total <= self.max_bytes * 0.9:
+                break
+
+    @staticmethod
+    def _remover(caminho):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = CacheDisco(
+            getattr(settings, 'RACHAS_PROXY_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'rachas_proxy_imagens')),
+            getattr(settings, 'RACHAS_PROXY_CACHE_MAX_BYTES', 256 * 1024 * 1024),
+            getattr(settings, 'RACHAS_PROXY_CACHE_MAX_OBJETO', 10 * 1024 * 1024)
+        )
+    return _cache
+
+
+def _validade(cabecalhos):
+    """Segundos de validade pelo Cache-Control da origem (None = não guardar)"""
+    cache_control = cabecalhos.get('Cache-Control', '').lower()
+    # O cache é compartilhado entre usuários
+    if 'no-store' in cache_control or 'private' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+    max_age = _MAX_AGE.search(cache_control)
+    if max_age:
+        return int(max_age.group(1))
+    return getattr(settings, 'RACHAS_PROXY_CACHE_TTL', 60 * 60)
+
+
+def _intervalo(request, entrada):
+    """
+    Intervalo (inicio, fim) pedido no cabeçalho Range, None para a resposta
+    completa (sem Range, If-Range desatualizado ou vários intervalos) ou
+    False se o intervalo não é satisfazível.
+    """
+    cabecalho = request.headers.get('Range')
+    if not cabecalho:
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (entrada.meta['etag'], entrada.meta.get('last_modified')):
+        return None
+    correspondencia = _INTERVALO.match(cabecalho.strip())
+    if not correspondencia or correspondencia.groups() == ('', ''):
+        return None
+    inicio, fim = correspondencia.groups()
+    if not inicio:
+        # Sufixo: últimos N bytes
+        sufixo = int(fim)
+        if sufixo == 0:
+            return False
+        return max(entrada.tamanho - sufixo, 0), entrada.tamanho - 1
+    inicio = int(inicio)
+    fim = min(int(fim), entrada.tamanho - 1) if fim else entrada.tamanho - 1
+    if inicio >= entrada.tamanho or inicio > fim:
+        return False
+    return inicio, fim
+
+
+def _e_imagem(content_type):
+    tipo = (content_type or '').split(';')[0].strip().lower()
+    return tipo.startswith('image/') and tipo not in _TIPOS_RECUSADOS
+
+
+def _cabecalhos_cache(resposta, meta):
+    resposta['ETag'] = meta['etag']
+    if meta.get('last_modified'):
+        resposta['Last-Modified'] = meta['last_modified']
+    resposta['Cache-Control'] = f"public, max-age={max(int(meta['expira_em'] - time.time()), 0)}"
+    resposta['Accept-Ranges'] = 'bytes'
+    resposta['X-Content-Type-Options'] = 'nosniff'
+
+
+def _resposta_cache(request, entrada):
+    """Resposta a partir do cache: 304/412, 206 (Range), 416 ou 200"""
+    meta = entrada.meta
+    condicional = get_conditional_response(
+        request,
+        etag=meta['etag'],
+        last_modified=parse_http_date_safe(meta.get('last_modified') or '')
+    )
+    if condicional is not None:
+        entrada.fechar()
+        _cabecalhos_cache(condicional, meta)
+        return condicional
+
+    intervalo = _intervalo(request, entrada)
+    if intervalo is False:
+        entrada.fechar()
+        resposta = HttpResponse(status=416)
+        resposta['Content-Range'] = f'bytes */{entrada.tamanho}'
+        return resposta
+    if intervalo is None:
+        resposta = StreamingHttpResponse(entrada.ler(), content_type=meta['content_type'])
+        resposta['Content-Length'] = entrada.tamanho
+    else:
+        inicio, fim = intervalo
+        resposta = StreamingHttpResponse(entrada.ler(inicio, fim), status=206, content_type=meta['content_type'])
+        resposta['Content-Length'] = fim - inicio + 1
+        resposta['Content-Range'] = f'bytes {inicio}-{fim}/{entrada.tamanho}'
+    _cabecalhos_cache(resposta, meta)
+    return resposta
+
+
+def _resposta_origem(url, origem):
+    """
+    Repassa o corpo da origem em blocos, gravando no cache ao mesmo tempo.
+    Range do cliente é ignorado aqui (a resposta é completa, 200).
+    """
+    validade = _validade(origem.headers)
+    content_type = origem.headers.get('Content-Type', 'application/octet-stream')
+    gravacao = get_cache().gravar(url) if validade is not None else None
+
+    def corpo():
+        try:
+            for bloco in origem.iter_content(TAMANHO_BLOCO):
+                if gravacao:
+                    gravacao.escrever(bloco)
+                yield bloco
+            if gravacao:
+                gravacao.concluir({
+                    'url': url,
+                    'content_type': content_type,
+                    'etag': origem.headers.get('ETag'),
+                    'etag_origem': origem.headers.get('ETag'),
+                    'last_modified': origem.headers.get('Last-Modified'),
+                    'expira_em': time.time() + validade,
+                })
+        finally:
+            origem.close()
+            if gravacao:
+                gravacao.descartar()
+
+    resposta = StreamingHttpResponse(corpo(), content_type=content_type)
+    # Com Content-Encoding o requests entrega o corpo já descomprimido
+    if 'Content-Length' in origem.headers and 'Content-Encoding' not in origem.headers:
+        resposta['Content-Length'] = origem.headers['Content-Length']
+    # Validadores da origem: o cliente revalida depois contra o cache
+    for cabecalho in ('ETag', 'Last-Modified'):
+        if origem.headers.get(cabecalho):
+            resposta[cabecalho] = origem.headers[cabecalho]
+    resposta['Cache-Control'] = f'public, max-age={validade}' if validade else 'no-cache'
+    resposta['X-Content-Type-Options'] = 'nosniff'
+    return resposta
+
+
+def resposta_proxy(request, url):
+    """
+    Resposta HTTP com a imagem da URL. Levanta ImagemIndisponivel se a
+    origem falhar e não houver cópia em cache.
+    """
+    entrada = get_cache().abrir(url)
+    if entrada is not None and not _e_imagem(entrada.meta.get('content_type')):
+        # Gravada antes da verificação de Content-Type
+        entrada.fechar()
+        get_cache()._remover(entrada.caminho)
+        entrada = None
+    if entrada is not None and entrada.fresca():
+        return _resposta_cache(request, entrada)
+
+    cabecalhos = {}
+    if entrada is not None:
+        if entrada.meta.get('etag_origem'):
+            cabecalhos['If-None-Match'] = entrada.meta['etag_origem']
+        if entrada.meta.get('last_modified'):
+            cabecalhos['If-Modified-Since'] = entrada.meta['last_modified']
+
+    try:
+        origem = sessao_http().get(
+            url,
+            headers=cabecalhos,
+            stream=True,
+            timeout=(
+                getattr(settings, 'RACHAS_PROXY_TIMEOUT_CONEXAO', 3.05),
+                getattr(settings, 'RACHAS_PROXY_TIMEOUT_LEITURA', 10)
+            )
+        )
+    except requests.RequestException as e:
+        if entrada is not None:
+            # Origem fora do ar: serve a cópia vencida
+            logger.warning('Proxy de imagem: origem indisponível (%s); usando cache', e)
+            return _resposta_cache(request, entrada)
+        raise ImagemIndisponivel('Falha ao buscar imagem') from e
+
+    if origem.status_code == 304 and entrada is not None:
+        origem.close()
+        validade = _validade(origem.headers)
+        get_cache().revalidar(entrada, time.time() + (validade or 0))
+        entrada = get_cache().abrir(url)
+        if entrada is None:
+            raise ImagemIndisponivel('Falha ao buscar imagem')
+        return _resposta_cache(request, entrada)
+    if entrada is not None:
+        entrada.fechar()
+    if origem.status_code != 200:
+        origem.close()
+        raise ImagemIndisponivel('Falha ao buscar imagem')
+    if not _e_imagem(origem.headers.get('Content-Type')):
+        origem.close()
+        raise ImagemIndisponivel('A URL não aponta para uma imagem')
+    return _resposta_origem(url, origem)
@@ -0,0 +1,210 @@
+import uuid
+import base64
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Value, CharField, F
+from rest_framework.permissions import SAFE_METHODS
+
+from .models import User, Racha, JogadoresRacha
+
+
+PAPEL_ADMIN = 'A'
+PAPEL_MEMBRO = 'M'
+
+# Claims compactos embutidos no access token
+CLAIM_ADMIN = 'ra'
+CLAIM_MEMBRO = 'rm'
+CLAIM_VERSAO = 'rv'
+
+
+def _normalizar_id(racha):
+    """Converte Racha, UUID ou string em UUID (None se inválido)"""
+    if isinstance(racha, Racha):
+        return racha.pk
+    if isinstance(racha, uuid.UUID):
+        return racha
+    try:
+        return uuid.UUID(str(racha))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _codificar_id(racha_id):
+    """UUID -> 22 caracteres base64url (sem padding)"""
+    return base64.urlsafe_b64encode(racha_id.bytes).rstrip(b'=').decode('ascii')
+
+
+def _decodificar_id(valor):
+    return uuid.UUID(bytes=base64.urlsafe_b64decode(valor + '=='))
+
+
+class PapeisUsuario:
+    """
+    Papéis (admin/membro) de um usuário nos rachas, carregados uma única vez.
+
+    Uma única consulta (UNION) traz os ids dos rachas que o usuário administra
+    e dos rachas em que é jogador ativo; as verificações seguintes são feitas
+    em memória.
+    """
+
+    def __init__(self, user, claims=None):
+        self.user_id = getattr(user, 'id', None) if getattr(user, 'is_authenticated', False) else None
+        self._claims = claims
+        self._admin_ids = None
+        self._membro_ids = None
+
+    @property
+    def via_token(self):
+        """Indica se os papéis vêm dos claims do token (sem consulta ao banco)"""
+        return self._claims is not None
+
+    def _consulta(self):
+        """UNION (racha_id, papel) dos rachas administrados e dos rachas como jogador ativo"""
+        admin = Racha.administrador.through.objects.filter(
+            user_id=self.user_id
+        ).annotate(
+            papel=Value(PAPEL_ADMIN, output_field=CharField())
+        ).values_list('racha_id', 'papel')
+        membro = JogadoresRacha.objects.filter(
+            jogador_id=self.user_id,
+            ativo=True
+        ).annotate(
+            papel=Value(PAPEL_MEMBRO, output_field=CharField())
+        ).values_list('racha_id', 'papel')
+        return admin.union(membro, all=True)
+
+    def _aplicar(self, linhas):
+        admin_ids = set()
+        membro_ids = set()
+        for racha_id, papel in linhas:
+            if papel == PAPEL_ADMIN:
+                admin_ids.add(racha_id)
+            else:
+                membro_ids.add(racha_id)
+        self._admin_ids = admin_ids
+        self._membro_ids = membro_ids
+
+    def _carregar(self):
+        if self._admin_ids is not None:
+            return
+        if self.user_id is None:
+            self._aplicar([])
+        elif self._claims is not None:
+            self._admin_ids = {_decodificar_id(v) for v in self._claims[CLAIM_ADMIN]}
+            self._membro_ids = {_decodificar_id(v) for v in self._claims[CLAIM_MEMBRO]}
+        else:
+            self._aplicar(self._consulta())
+
+    async def acarregar(self):
+        """Versão assíncrona do carregamento (views async); retorna o próprio objeto"""
+        if self._admin_ids is None and self.user_id is not None and self._claims is None:
+            self._aplicar([linha async for linha in self._consulta()])
+        self._carregar()
+        return self
+
+    @property
+    def admin_ids(self):
+        self._carregar()
+        return self._admin_ids
+
+    @property
+    def membro_ids(self):
+        self._carregar()
+        return self._membro_ids
+
+    def is_admin(self, racha):
+        """Verifica se o usuário administra o racha"""
+        return _normalizar_id(racha) in self.admin_ids
+
+    def is_membro(self, racha):
+        """Verifica se o usuário é jogador ativo do racha"""
+        return _normalizar_id(racha) in self.membro_ids
+
+    def is_admin_ou_membro(self, racha):
+        racha_id = _normalizar_id(racha)
+        return racha_id in self.admin_ids or racha_id in self.membro_ids
+
+    def invalidar(self):
+        """Descarta os papéis carregados (ex: após criar racha ou mudar admins)"""
+        self._claims = None
+        self._admin_ids = None
+        self._membro_ids = None
+
+
+def _claims_do_request(request, user):
+    """
+    Retorna os claims de papéis do token se puderem ser usados.
+
+    O token só é aceito se a versão embutida for igual à versão atual do
+    usuário; caso contrário (papéis alterados após a emissão) retorna None
+    e os papéis são lidos do banco.
+    """
+    if not getattr(settings, 'RACHAS_JWT_PAPEIS', False):
+        return None
+    # Escritas sempre conferem os papéis no banco
+    if getattr(request, 'method', None) not in SAFE_METHODS:
+        return None
+    token = getattr(request, 'auth', None)
+    payload = getattr(token, 'payload', None)
+    if not payload or CLAIM_VERSAO not in payload:
+        return None
+    if payload[CLAIM_VERSAO] != versao_papeis(user):
+        return None
+    return payload
+
+
+def _chave_versao(user_id):
+    return f'rachas:papeis_versao:{user_id}'
+
+
+def versao_papeis(user):
+    """
+    Versão atual dos papéis do usuário.
+
+    Se o User foi montado a partir do token (campos adiados), a versão é lida
+    do cache para não forçar o carregamento do registro completo.
+    """
+    if 'papeis_versao' not in user.get_deferred_fields():
+        return user.papeis_versao
+    chave = _chave_versao(user.pk)
+    versao = cache.get(chave)
+    if versao is None:
+        versao = User.objects.filter(pk=user.pk).values_list('papeis_versao', flat=True).first()
+        cache.set(chave, versao, getattr(settings, 'RACHAS_PAPEIS_VERSAO_CACHE_TTL', 30))
+    return versao
+
+
+def adicionar_claims_papeis(token, user):
+    """Embute os papéis do usuário (e a versão atual) no access token"""
+    papeis = PapeisUsuario(user)
+    total = len(papeis.admin_ids) + len(papeis.membro_ids)
+    if total > getattr(settings, 'RACHAS_JWT_PAPEIS_MAX', 50):
+        return token
+    token[CLAIM_ADMIN] = sorted(_codificar_id(r) for r in papeis.admin_ids)
+    token[CLAIM_MEMBRO] = sorted(_codificar_id(r) for r in papeis.membro_ids)
+    token[CLAIM_VERSAO] = user.papeis_versao
+    return token
+
+
+def incrementar_versao_papeis(*user_ids):
+    """Invalida os papéis embutidos nos tokens já emitidos para os usuários"""
+    ids = {u for u in user_ids if u is not None}
+    if ids:
+        User.objects.filter(id__in=ids).update(papeis_versao=F('papeis_versao') + 1)
+        cache.delete_many([_chave_versao(u) for u in ids])
+
+
+def papeis_do_usuario(request):
+    """
+    Retorna o PapeisUsuario do request, criando-o na primeira chamada.
+
+    O cache fica no HttpRequest subjacente para ser compartilhado entre
+    permissões, views e serializers do mesmo request.
+    """
+    http_request = getattr(request, '_request', request)
+    user = getattr(request, 'user', None)
+    papeis = getattr(http_request, '_papeis_racha', None)
+    if papeis is None or papeis.user_id != (user.id if getattr(user, 'is_authenticated', False) else None):
+        papeis = PapeisUsuario(user, claims=_claims_do_request(request, user))
+        http_request._papeis_racha = papeis
+    return papeis
@@ -1,6 +1,12 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
 from django.db.models import Sum, Count, Q
 from django.conf import settings
+from .roles import papeis_do_usuario, adicionar_claims_papeis
+from .storage import url_publica
+from .tarefas import agendar_variantes
 from .models import (
     User, Racha, JogadoresRacha, Premio, Partida, 
     JogadorPartida, RegistroPartida, PremioPartida, SolicitacaoRacha
@@ -11,6 +17,10 @@ def get_image_url(image_field):
     """Helper para obter URL completa de imagens"""
     if not image_field:
         return None
+    # URL guardada ao salvar (UrlImagemField): não consulta o storage
+    salva = getattr(image_field.instance, f'{image_field.field.name}_url', None)
+    if salva:
+        return salva
     try:
         url = image_field.url
         if url.startswith('http'):
@@ -20,19 +30,53 @@ def get_image_url(image_field):
         return None
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_image_variantes(instance):
+    """
+    URLs das variantes WebP da imagem_perfil por maior lado ({'64': url, ...}).
+    Vazio enquanto as variantes da imagem atual não foram geradas.
+    """
+    variantes = instance.imagem_variantes or {}
+    if not instance.imagem_perfil or variantes.get('origem') != instance.imagem_perfil.name:
+        return {}
+    if variantes.get('urls') and all(variantes['urls'].values()):
+        return dict(variantes['urls'])
+    storage = instance.imagem_perfil.storage
+    # URL assinada (não guardada por url_publica) vale só para esta resposta
+    return {
+        lado: url_publica(storage, nome) or storage.url(nome)
+        for lado, nome in variantes.get('tamanhos', {}).items()
+    }
+
+
+class ImagemVariantesMixin:
+    """
+    Agenda a geração das variantes WebP quando a imagem_perfil é alterada.
+    Só faz sentido com imagem_perfil gravável; a do racha muda por
+    RachaViewSet.confirmar_imagem, que agenda as variantes.
+    """
+    
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        if 'imagem_perfil' in self.validated_data:
+            agendar_variantes(instance)
+        return instance
+
+
+class UserSerializer(ImagemVariantesMixin, serializers.ModelSerializer):
     """Serializer para usuários/jogadores"""
     
     # imagem_perfil = serializers.SerializerMethodField()
+    # use_url=False: a URL vem de get_image_url (to_representation), sem storage.url()
+    imagem_perfil = serializers.ImageField(required=False, allow_null=True, use_url=False)
     
     class Meta:
         model = User
         fields = [
             'id', 'username', 'email', 'first_name', 'last_name',
             'telefone', 'data_nascimento', 'posicao', 'imagem_perfil',
-            'data_criacao'
+            'imagem_perfil_status', 'data_criacao'
         ]
-        read_only_fields = ['id', 'data_criacao']
+        read_only_fields = ['id', 'imagem_perfil_status', 'data_criacao']
         extra_kwargs = {
             'data_nascimento': {'required': False},
             'posicao': {'required': False},
@@ -42,6 +86,9 @@ class UserSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['imagem_perfil'] = get_image_url(instance.imagem_perfil)
+        representation['imagem_variantes'] = get_image_variantes(instance)
+        # Upload direto confirmado e ainda não processado pelo worker
+        representation['imagem_pendente'] = bool(instance.imagem_pendente)
         return representation
 
 
@@ -73,12 +120,14 @@ class RachaSerializer(serializers.ModelSerializer):
     )
     total_jogadores = serializers.SerializerMethodField()
     imagem_perfil = serializers.SerializerMethodField()
+    imagem_variantes = serializers.SerializerMethodField()
+    imagem_pendente = serializers.SerializerMethodField()
     is_admin = serializers.SerializerMethodField()
     
     class Meta:
         model = Racha
         fields = [
-            'id', 'nome', 'descricao', 'imagem_perfil',
+            'id', 'nome', 'descricao', 'imagem_perfil', 'imagem_variantes', 'imagem_pendente',
             'data_inicio', 'data_encerramento', 'codigo_convite',
             'ponto_gol', 'ponto_assistencia', 'ponto_presenca',
             'criado_em', 'total_jogadores', 'is_admin',
@@ -88,17 +137,28 @@ class RachaSerializer(serializers.ModelSerializer):
 
     def get_is_admin(self, obj):
         """Verifica se o usuário atual é o administrador do racha"""
+        # Valor anotado na queryset (ex: meus_rachas) dispensa nova consulta
+        if hasattr(obj, 'is_admin'):
+            return obj.is_admin
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            return request.user in obj.administrador.all()
+            return papeis_do_usuario(request).is_admin(obj)
         return False
     
     def get_total_jogadores(self, obj):
+        if hasattr(obj, 'total_jogadores'):
+            return obj.total_jogadores
         return obj.jogadores_racha.filter(ativo=True).count()
     
     def get_imagem_perfil(self, obj):
         """Retorna URL completa da imagem do racha"""
         return get_image_url(obj.imagem_perfil)
+    
+    def get_imagem_variantes(self, obj):
+        return get_image_variantes(obj)
+    
+    def get_imagem_pendente(self, obj):
+        return bool(obj.imagem_pendente)
 
 
 class RachaDetailSerializer(RachaSerializer):
@@ -194,7 +254,7 @@ class PartidaDetailSerializer(PartidaSerializer):
         """Verifica se o usuário atual é o administrador do racha"""
         request = self.context.get('request')
         if request and hasattr(request, 'user'):
-            return request.user in obj.racha.administrador.all()
+            return papeis_do_usuario(request).is_admin(obj.racha_id)
         return False
 
 
@@ -204,6 +264,7 @@ class RankingJogadorSerializer(serializers.Serializer):
     jogador_id = serializers.UUIDField()
     jogador_nome = serializers.CharField()
     jogador_imagem_perfil = serializers.CharField()
+    jogador_imagem_variantes = serializers.DictField(child=serializers.CharField(), required=False)
     posicao = serializers.CharField()
     gols = serializers.IntegerField()
     assistencias = serializers.IntegerField()
@@ -215,7 +276,8 @@ class RankingJogadorSerializer(serializers.Serializer):
     class Meta:
         fields = [
             'jogador_id', 'jogador_nome', 'jogador_username', 'posicao', 'gols',
-            'assistencias', 'presencas', 'premios_pontos', 'pontuacao_total', 'jogador_imagem_perfil'
+            'assistencias', 'presencas', 'premios_pontos', 'pontuacao_total', 'jogador_imagem_perfil',
+            'jogador_imagem_variantes'
         ]
 
 
@@ -237,3 +299,41 @@ class RankingAssistenciasSerializer(serializers.Serializer):
     assistencias = serializers.IntegerField()
     posicao = serializers.IntegerField()
     jogador_username = serializers.CharField(required=False)
+
+
+
+def _access_com_papeis(access, user):
+    """Reemite o access token com os papéis do usuário embutidos"""
+    token = AccessToken(access)
+    adicionar_claims_papeis(token, user)
+    return str(token)
+
+
+class RachaTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Obtenção de tokens com papéis opcionais no access token"""
+    
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        # Permite montar o request.user sem consulta no modo stateless
+        token['username'] = user.username
+        return token
+    
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if settings.RACHAS_JWT_PAPEIS:
+            data['access'] = _access_com_papeis(data['access'], self.user)
+        return data
+
+
+class RachaTokenRefreshSerializer(TokenRefreshSerializer):
+    """Renovação de tokens recalculando os papéis embutidos"""
+    
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if settings.RACHAS_JWT_PAPEIS:
+            user_id = AccessToken(data['access']).payload.get(jwt_settings.USER_ID_CLAIM)
+            user = User.objects.filter(**{jwt_settings.USER_ID_FIELD: user_id}).first()
+            if user:
+                data['access'] = _access_com_papeis(data['access'], user)
+        return data
@@ -0,0 +1,43 @@
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Racha
+from .roles import incrementar_versao_papeis
+from .solicitacoes import esquecer_codigo, esquecer_pendentes, esquecer_pendentes_dos_rachas
+
+
+@receiver(m2m_changed, sender=Racha.administrador.through)
+def administradores_alterados(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalida os papéis em tokens quando a lista de administradores muda"""
+    if action == 'pre_clear':
+        # Guarda quem perderá o papel antes do clear (pk_set vem vazio)
+        if reverse:
+            instance._admins_removidos = {instance.pk}
+        else:
+            instance._admins_removidos = set(instance.administrador.values_list('id', flat=True))
+        return
+    
+    if action == 'post_clear':
+        admins = getattr(instance, '_admins_removidos', ())
+        incrementar_versao_papeis(*admins)
+        esquecer_pendentes(*admins)
+        return
+    
+    if action in ('post_add', 'post_remove') and pk_set:
+        # user.rachas_administrados.add(...): o usuário é a instância
+        admins = {instance.pk} if reverse else pk_set
+        incrementar_versao_papeis(*admins)
+        # Os contadores de solicitações pendentes mudam de escopo
+        esquecer_pendentes(*admins)
+
+
+@receiver(post_delete, sender=Racha)
+def racha_excluido(sender, instance, **kwargs):
+    """Remove o código de convite do cache de resolução"""
+    esquecer_codigo(instance.codigo_convite)
+
+
+@receiver(pre_delete, sender=Racha)
+def racha_sera_excluido(sender, instance, **kwargs):
+    """As solicitações pendentes saem junto com o racha (cascade)"""
+    esquecer_pendentes_dos_rachas(instance.pk)
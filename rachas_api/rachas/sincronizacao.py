@@ -0,0 +1,205 @@
+import uuid
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import JogadoresRacha, Premio, JogadorPartida, RegistroPartida, PremioPartida
+
+
+# Máximo de entradas aceitas por seção do log
+MAX_ENTRADAS_LOG = 1000
+
+
+def _uuid(valor):
+    try:
+        return uuid.UUID(str(valor))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class LogInvalido(Exception):
+    """Log com estrutura inválida (rejeitado por inteiro)"""
+
+
+def _secao(log, nome):
+    entradas = log.get(nome) or []
+    if not isinstance(entradas, list) or not all(isinstance(e, dict) for e in entradas):
+        raise LogInvalido(f'{nome} deve ser uma lista de objetos')
+    if len(entradas) > MAX_ENTRADAS_LOG:
+        raise LogInvalido(f'Máximo de {MAX_ENTRADAS_LOG} entradas em {nome}')
+    return entradas
+
+
+def mesclar_log_partida(partida, log):
+    """
+    Mescla o log offline de uma partida (presenças, gols/assistências, prêmios
+    e finalização) em uma única transação.
+
+    Cada entrada traz um 'id_cliente' (UUID gerado no aparelho). Gols e
+    prêmios usam esse id como chave primária, então reenviar o mesmo log não
+    duplica registros. Presenças usam a chave natural (partida, jogador).
+
+    As consultas são por conjunto (elenco, prêmios e registros existentes) e
+    as gravações são upserts em lote; entradas que não puderem ser aplicadas
+    são devolvidas em 'conflitos' sem impedir as demais.
+    """
+    if not isinstance(log, dict):
+        raise LogInvalido('O log deve ser um objeto')
+    presencas_log = _secao(log, 'presencas')
+    gols_log = _secao(log, 'gols')
+    premios_log = _secao(log, 'premios')
+    finalizar = log.get('finalizar')
+
+    conflitos = []
+
+    def conflito(tipo, entrada, motivo):
+        conflitos.append({'tipo': tipo, 'id_cliente': entrada.get('id_cliente'), 'motivo': motivo})
+
+    # Uma consulta para o elenco de todos os jogadores citados no log
+    citados = set()
+    for entrada in presencas_log + premios_log:
+        citados.add(_uuid(entrada.get('jogador_id')))
+    for entrada in gols_log:
+        citados.add(_uuid(entrada.get('jogador_gol_id')))
+        citados.add(_uuid(entrada.get('jogador_assistencia_id')))
+    citados.discard(None)
+    elenco = set(
+        JogadoresRacha.objects.filter(
+            racha_id=partida.racha_id,
+            jogador_id__in=citados,
+            ativo=True
+        ).values_list('jogador_id', flat=True)
+    )
+
+    def jogador_do_elenco(tipo, entrada, campo, obrigatorio=True):
+        """Retorna (ok, jogador_id) validando o campo contra o elenco"""
+        valor = entrada.get(campo)
+        if not valor:
+            if obrigatorio:
+                conflito(tipo, entrada, f'{campo} obrigatório')
+                return False, None
+            return True, None
+        jogador_id = _uuid(valor)
+        if jogador_id not in elenco:
+            conflito(tipo, entrada, f'Jogador {valor} não pertence a este racha')
+            return False, None
+        return True, jogador_id
+
+    # Presenças: chave natural (partida, jogador); a última entrada vence
+    presencas = {}
+    for entrada in presencas_log:
+        ok, jogador_id = jogador_do_elenco('presenca', entrada, 'jogador_id')
+        if ok:
+            presencas[jogador_id] = (entrada, bool(entrada.get('presente', True)))
+
+    # Gols e prêmios: o id_cliente vira a chave primária
+    def com_id_cliente(tipo, entradas):
+        validas = {}
+        for entrada in entradas:
+            id_cliente = _uuid(entrada.get('id_cliente'))
+            if id_cliente is None:
+                conflito(tipo, entrada, 'id_cliente inválido')
+            else:
+                validas[id_cliente] = entrada
+        return validas
+
+    gols = com_id_cliente('gol', gols_log)
+    premios_entradas = com_id_cliente('premio', premios_log)
+
+    registros = []
+    for id_cliente, entrada in gols.items():
+        ok_gol, gol_id = jogador_do_elenco('gol', entrada, 'jogador_gol_id', obrigatorio=False)
+        ok_assist, assist_id = jogador_do_elenco('gol', entrada, 'jogador_assistencia_id', obrigatorio=False)
+        if not (ok_gol and ok_assist):
+            continue
+        if not gol_id and not assist_id:
+            conflito('gol', entrada, 'Informe pelo menos o autor do gol ou da assistência')
+            continue
+        registros.append(RegistroPartida(
+            id=id_cliente,
+            partida=partida,
+            jogador_gol_id=gol_id,
+            jogador_assistencia_id=assist_id
+        ))
+
+    premios_racha = set(
+        Premio.objects.filter(
+            racha_id=partida.racha_id,
+            id__in={_uuid(e.get('premio_id')) for e in premios_entradas.values()} - {None}
+        ).values_list('id', flat=True)
+    )
+    premios = []
+    for id_cliente, entrada in premios_entradas.items():
+        ok, jogador_id = jogador_do_elenco('premio', entrada, 'jogador_id')
+        if not ok:
+            continue
+        premio_id = _uuid(entrada.get('premio_id'))
+        if premio_id not in premios_racha:
+            conflito('premio', entrada, 'O prêmio não pertence ao racha desta partida')
+            continue
+        premios.append(PremioPartida(
+            id=id_cliente,
+            partida=partida,
+            premio_id=premio_id,
+            jogador_id=jogador_id
+        ))
+
+    data_fim = None
+    if finalizar:
+        data_fim = timezone.now()
+        if isinstance(finalizar, dict) and finalizar.get('data_fim'):
+            try:
+                data_fim = parse_datetime(str(finalizar['data_fim'])) or data_fim
+            except ValueError:
+                raise LogInvalido('finalizar.data_fim inválida')
+
+    def gravar_por_id(modelo, tipo, objetos, entradas, campos):
+        """
+        Grava os objetos cujo id_cliente é desta partida (ou novo). Os ids são
+        inseridos com ON CONFLICT DO NOTHING e travados antes de conferir a
+        partida dona, então uma sincronização concorrente de outra partida
+        não tem seus registros sobrescritos.
+        """
+        modelo.objects.bulk_create(objetos, ignore_conflicts=True)
+        donos = dict(
+            modelo.objects.select_for_update().filter(
+                id__in=[objeto.id for objeto in objetos]
+            ).values_list('id', 'partida_id')
+        )
+        proprios = []
+        for objeto in objetos:
+            if donos.get(objeto.id) == partida.pk:
+                proprios.append(objeto)
+            else:
+                conflito(tipo, entradas[objeto.id], 'id_cliente já usado em outra partida')
+        modelo.objects.bulk_update(proprios, campos)
+        return proprios
+
+    with transaction.atomic():
+        JogadorPartida.objects.bulk_create(
+            [
+                JogadorPartida(partida=partida, jogador_id=jogador_id, presente=presente)
+                for jogador_id, (_, presente) in presencas.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['partida', 'jogador'],
+            update_fields=['presente']
+        )
+        registros = gravar_por_id(
+            RegistroPartida, 'gol', registros, gols, ['jogador_gol', 'jogador_assistencia']
+        )
+        premios = gravar_por_id(
+            PremioPartida, 'premio', premios, premios_entradas, ['premio', 'jogador']
+        )
+        if data_fim and partida.status:
+            partida.data_fim = data_fim
+            partida.status = False
+            partida.save(update_fields=['data_fim', 'status'])
+
+    return {
+        'presencas': [str(e.get('id_cliente')) for e, _ in presencas.values()],
+        'gols': [str(r.id) for r in registros],
+        'premios': [str(p.id) for p in premios],
+        'finalizada': not partida.status,
+        'conflitos': conflitos,
+    }
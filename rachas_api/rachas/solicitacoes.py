@@ -0,0 +1,224 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Racha, JogadoresRacha, SolicitacaoRacha
+from .roles import incrementar_versao_papeis
+
+
+def _chave_convite(codigo):
+    return f'rachas:convite:{codigo}'
+
+
+def _chave_pendentes(admin_id):
+    return f'rachas:solicitacoes_pendentes:{admin_id}'
+
+
+def _contadores_em_cache():
+    # Só com cache compartilhado entre os workers (ver RACHAS_PENDENTES_CACHE)
+    return getattr(settings, 'RACHAS_PENDENTES_CACHE', False)
+
+
+def _contar_no_banco(admin_id):
+    return SolicitacaoRacha.objects.filter(status='PENDENTE', racha__administrador=admin_id).count()
+
+
+def contar_pendentes(admin_id):
+    """
+    Total de solicitações pendentes nos rachas que o usuário administra.
+
+    Com RACHAS_PENDENTES_CACHE (padrão só com RACHAS_CACHE_URL), lido do
+    cache (uma leitura); só em cache vazio conta no banco. O valor é mantido
+    por ajustar_pendentes em toda escrita que cria, decide, altera ou remove
+    solicitações. Sem ele, é um COUNT no banco a cada chamada.
+    """
+    if not _contadores_em_cache():
+        return _contar_no_banco(admin_id)
+    chave = _chave_pendentes(admin_id)
+    total = cache.get(chave)
+    if total is None:
+        total = _contar_no_banco(admin_id)
+        # add() não sobrescreve um contador criado/ajustado nesse meio tempo
+        cache.add(chave, total, getattr(settings, 'RACHAS_PENDENTES_CACHE_TTL', 300))
+    return total
+
+
+def ajustar_pendentes(deltas):
+    """
+    Soma {racha_id: delta} aos contadores dos admins de cada racha, após o
+    commit. Contador fora do cache é recontado e gravado com set(): um
+    add() de uma contagem lida antes deste commit (contar_pendentes em
+    outro request) não pode ficar valendo.
+    """
+    deltas = {racha_id: delta for racha_id, delta in deltas.items() if delta}
+    if not deltas or not _contadores_em_cache():
+        return
+    
+    def aplicar():
+        por_admin = {}
+        for racha_id, admin_id in Racha.administrador.through.objects.filter(
+            racha_id__in=deltas.keys()
+        ).values_list('racha_id', 'user_id'):
+            por_admin[admin_id] = por_admin.get(admin_id, 0) + deltas[racha_id]
+        for admin_id, delta in por_admin.items():
+            chave = _chave_pendentes(admin_id)
+            try:
+                cache.incr(chave, delta)
+            except ValueError:
+                cache.set(chave, _contar_no_banco(admin_id), getattr(settings, 'RACHAS_PENDENTES_CACHE_TTL', 300))
+    
+    transaction.on_commit(aplicar)
+
+
+def esquecer_pendentes(*admin_ids):
+    """Descarta os contadores (ex: usuário passou a administrar outro racha)"""
+    cache.delete_many([_chave_pendentes(admin_id) for admin_id in admin_ids])
+
+
+def esquecer_pendentes_dos_rachas(*racha_ids):
+    """Descarta, após o commit, os contadores dos admins dos rachas"""
+    admins = set(
+        Racha.administrador.through.objects.filter(racha_id__in=racha_ids).values_list('user_id', flat=True)
+    )
+    if admins:
+        transaction.on_commit(lambda: esquecer_pendentes(*admins))
+
+
+def delta_pendente(antes, depois):
+    """
+    {racha_id: delta} da troca de uma solicitação (racha_id, status) por
+    outra; None em antes/depois para criação/remoção.
+    """
+    deltas = {}
+    for estado, sinal in ((antes, -1), (depois, 1)):
+        if estado and estado[1] == 'PENDENTE':
+            deltas[estado[0]] = deltas.get(estado[0], 0) + sinal
+    return deltas
+
+
+def racha_id_por_codigo(codigo):
+    """
+    Resolve o código de convite para o id do racha, com cache.
+
+    O código de um racha nunca muda, então a entrada só fica inválida se o
+    racha for excluído (ver esquecer_codigo e racha_para_solicitacao).
+    """
+    chave = _chave_convite(codigo)
+    racha_id = cache.get(chave)
+    if racha_id is None:
+        racha_id = Racha.objects.filter(codigo_convite=codigo).values_list('id', flat=True).first()
+        if racha_id is None:
+            return None
+        cache.set(chave, str(racha_id), getattr(settings, 'RACHAS_CONVITE_CACHE_TTL', 3600))
+    return uuid.UUID(str(racha_id))
+
+
+def esquecer_codigo(codigo):
+    cache.delete(_chave_convite(codigo))
+
+
+def racha_para_solicitacao(codigo, user_id):
+    """
+    Racha do código com as flags 'membro' e 'pendente' do usuário, em uma
+    única consulta. Retorna None se o código não existir.
+    """
+    racha_id = racha_id_por_codigo(codigo)
+    if racha_id is None:
+        return None
+    racha = Racha.objects.filter(pk=racha_id).annotate(
+        membro=Exists(
+            JogadoresRacha.objects.filter(racha_id=OuterRef('pk'), jogador_id=user_id)
+        ),
+        pendente=Exists(
+            SolicitacaoRacha.objects.filter(racha_id=OuterRef('pk'), jogador_id=user_id, status='PENDENTE')
+        ),
+    ).first()
+    if racha is None:
+        # Racha excluído depois de o código entrar no cache
+        esquecer_codigo(codigo)
+    return racha
+
+
+def criar_solicitacao_pendente(racha, jogador):
+    """
+    Cria a solicitação PENDENTE com INSERT ... ON CONFLICT DO NOTHING.
+
+    Retorna a solicitação criada ou None se outra requisição simultânea do
+    mesmo jogador já a criou (unique racha/jogador/status).
+    """
+    solicitacao = SolicitacaoRacha(
+        id=uuid.uuid4(),
+        racha=racha,
+        jogador=jogador,
+        status='PENDENTE',
+        criado_em=timezone.now()
+    )
+    campos = [SolicitacaoRacha._meta.get_field(nome) for nome in ('id', 'racha', 'jogador', 'status', 'criado_em')]
+    colunas = ', '.join(connection.ops.quote_name(campo.column) for campo in campos)
+    valores = [campo.get_db_prep_save(getattr(solicitacao, campo.attname), connection) for campo in campos]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {connection.ops.quote_name(SolicitacaoRacha._meta.db_table)} ({colunas}) '
+            f'VALUES ({", ".join(["%s"] * len(campos))}) '
+            f'ON CONFLICT DO NOTHING RETURNING {connection.ops.quote_name("id")}',
+            valores
+        )
+        if cursor.fetchone() is None:
+            return None
+    ajustar_pendentes({racha.pk: 1})
+    solicitacao._state.adding = False
+    solicitacao._state.db = connection.alias
+    return solicitacao
+
+
+def decidir_em_lote(ids, novo_status, admin_ids):
+    """
+    Aprova ('ACEITO') ou nega ('NEGADO') várias solicitações pendentes.
+
+    Só entram solicitações PENDENTE de rachas em admin_ids. Ao aprovar, os
+    vínculos JogadoresRacha são criados com um bulk_create(ignore_conflicts)
+    e os status mudam com um único UPDATE. Retorna a lista de
+    (id, racha_id, jogador_id) das solicitações decididas.
+    """
+    with transaction.atomic():
+        # Trava as pendentes para dois admins não decidirem a mesma solicitação
+        decididas = list(
+            SolicitacaoRacha.objects.select_for_update().filter(
+                id__in=ids,
+                status='PENDENTE',
+                racha_id__in=admin_ids
+            ).order_by().values_list('id', 'racha_id', 'jogador_id')
+        )
+        if not decididas:
+            return []
+        ids_decididas = [id_ for id_, _, _ in decididas]
+        
+        if novo_status == 'ACEITO':
+            JogadoresRacha.objects.bulk_create(
+                [JogadoresRacha(racha_id=racha_id, jogador_id=jogador_id) for _, racha_id, jogador_id in decididas],
+                ignore_conflicts=True
+            )
+        # Se o jogador já tem uma solicitação com o novo status no racha
+        # (unique racha/jogador/status), a pendente é só descartada
+        SolicitacaoRacha.objects.filter(id__in=ids_decididas, status='PENDENTE').exclude(
+            Exists(
+                SolicitacaoRacha.objects.filter(
+                    racha_id=OuterRef('racha_id'),
+                    jogador_id=OuterRef('jogador_id'),
+                    status=novo_status
+                )
+            )
+        ).update(status=novo_status)
+        SolicitacaoRacha.objects.filter(id__in=ids_decididas, status='PENDENTE').delete()
+        
+        deltas = {}
+        for _, racha_id, _ in decididas:
+            deltas[racha_id] = deltas.get(racha_id, 0) - 1
+        ajustar_pendentes(deltas)
+        
+        if novo_status == 'ACEITO':
+            incrementar_versao_papeis(*{jogador_id for _, _, jogador_id in decididas})
+    return decididas
@@ -0,0 +1,87 @@
+import hashlib
+import posixpath
+from django.conf import settings
+from django.core.files import File
+from storages.backends.s3 import S3Storage
+
+
+class ConteudoEnderecadoMixin:
+    """
+    Nomeia cada arquivo pelo SHA-256 do conteúdo, mantendo o diretório
+    (upload_to) e a extensão: perfis/<sha256>.png.
+
+    Uploads idênticos resultam no mesmo nome e só o primeiro é enviado ao
+    storage. Como o conteúdo de um nome nunca muda, as URLs podem ser
+    servidas com Cache-Control immutable.
+
+    Um mesmo arquivo pode estar referenciado por vários registros, então
+    delete() não apaga nada. Os arquivos sem referência são removidos pelo
+    comando limpar_imagens_orfas, com apagar_definitivo().
+    """
+
+    TAMANHO_BLOCO = 64 * 1024
+
+    def _hash_conteudo(self, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for bloco in content.chunks(self.TAMANHO_BLOCO):
+            digest.update(bloco if isinstance(bloco, bytes) else bloco.encode())
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return digest.hexdigest()
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        extensao = posixpath.splitext(name)[1].lower()
+        nome = posixpath.join(posixpath.dirname(name), self._hash_conteudo(content) + extensao)
+        if self.exists(nome):
+            return nome
+        return super().save(nome, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # O nome já é único por conteúdo: nunca acrescenta sufixo
+        return name
+
+    def delete(self, name):
+        # Outro registro pode usar o mesmo arquivo (ver limpar_imagens_orfas)
+        pass
+
+    def apagar_definitivo(self, name):
+        """Apaga o arquivo de fato; só para quem sabe que ninguém o referencia"""
+        super().delete(name)
+
+
+class S3ConteudoStorage(ConteudoEnderecadoMixin, S3Storage):
+    """S3Storage com nomes por conteúdo e objetos marcados como imutáveis"""
+
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+    def get_object_parameters(self, name):
+        parametros = super().get_object_parameters(name)
+        parametros.setdefault('CacheControl', self.CACHE_CONTROL)
+        return parametros
+
+
+def url_publica(storage, nome):
+    """
+    URL pública estável do arquivo, para ser guardada junto ao registro.
+
+    Com RACHAS_MEDIA_URL_PUBLICA (domínio público do bucket ou CDN) é só o
+    prefixo + nome, sem chamar o storage. Sem ele, só arquivos servidos pelo
+    próprio sistema (storage local, URL relativa) têm URL estável; URLs do
+    bucket expiram ou não são públicas e não são guardadas (retorna ''), e
+    os serializers usam storage.url() a cada resposta.
+    """
+    if not nome:
+        return ''
+    base = getattr(settings, 'RACHAS_MEDIA_URL_PUBLICA', '')
+    if base:
+        return f"{base.rstrip('/')}/{nome}"
+    url = storage.url(nome)
+    if url.startswith('http') or '?' in url:
+        return ''
+    return f'{settings.BASE_URL_IMAGES}{nome}'
@@ -0,0 +1,169 @@
+"""
+Tarefas de segundo plano do app, executadas pelo worker (manage.py run_worker).
+"""
+import os
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .jobs import tarefa, enfileirar
+from .models import User
+from .storage import url_publica
+from . import imagens, uploads
+
+
+def agendar_variantes(instance):
+    """
+    Enfileira a geração das variantes WebP da imagem_perfil atual de um
+    User ou Racha. Imagens ainda aguardando a remoção de fundo são
+    ignoradas: a tarefa de remoção agenda as variantes da versão final.
+    """
+    if not instance.imagem_perfil or getattr(instance, 'imagem_perfil_status', '') == 'PROCESSANDO':
+        return None
+    return enfileirar(
+        'imagens.gerar_variantes',
+        modelo=instance._meta.label,
+        pk=str(instance.pk),
+        nome=instance.imagem_perfil.name
+    )
+
+
+def _com_upload_pendente(modelo, pk, chave):
+    """Registro cujo upload confirmado mais recente é `chave`"""
+    return apps.get_model(modelo).objects.filter(pk=pk, imagem_pendente=chave)
+
+
+def _upload_falhou(modelo, pk, chave, **argumentos):
+    """Última tentativa falhou: a imagem atual fica e o upload deixa de estar pendente"""
+    _com_upload_pendente(modelo, pk, chave).update(imagem_pendente='')
+
+
+@tarefa('imagens.armazenar_upload', ao_falhar=_upload_falhou)
+def armazenar_upload(modelo, pk, chave, content_type, remover_fundo=False):
+    """
+    Conclui o upload direto confirmado em confirmar_imagem (uploads.py):
+    confere o arquivo, copia para o nome definitivo e troca a imagem_perfil.
+
+    Só o upload confirmado por último (imagem_pendente) é aplicado; o de
+    uma confirmação anterior é descartado e o objeto temporário fica para o
+    limpar_imagens_orfas. Conteúdo que não é imagem não gera nova tentativa:
+    imagem_pendente volta a '' e a imagem atual fica.
+    """
+    instance = _com_upload_pendente(modelo, pk, chave).first()
+    if instance is None:
+        return {'ignorado': True}
+    try:
+        nome = uploads.armazenar_upload(instance, chave, content_type)
+    except uploads.UploadInvalido as e:
+        _com_upload_pendente(modelo, pk, chave).update(imagem_pendente='')
+        return {'erro': str(e)}
+    
+    campos = {
+        'imagem_perfil': nome,
+        'imagem_perfil_url': url_publica(instance.imagem_perfil.storage, nome),
+        'imagem_pendente': '',
+    }
+    if modelo == User._meta.label:
+        campos['imagem_perfil_status'] = 'PROCESSANDO' if remover_fundo else ''
+    if not _com_upload_pendente(modelo, pk, chave).update(**campos):
+        return {'ignorado': True}
+    if remover_fundo:
+        enfileirar('imagens.remover_fundo_perfil', user_id=pk, nome=nome)
+    else:
+        enfileirar('imagens.gerar_variantes', modelo=modelo, pk=pk, nome=nome)
+    return {'imagem_perfil': nome}
+
+
+def _aguardando_remocao(user_id, nome):
+    """
+    Usuário cuja imagem atual ainda espera esta remoção de fundo. Com nomes
+    por conteúdo, reenviar a mesma imagem sem remove_bg repete o nome; é o
+    status PROCESSANDO que mantém o job válido.
+    """
+    return User.objects.filter(pk=user_id, imagem_perfil=nome, imagem_perfil_status='PROCESSANDO')
+
+
+def _remocao_falhou(user_id, nome):
+    """Última tentativa da remoção de fundo falhou: a imagem original fica"""
+    _aguardando_remocao(user_id, nome).update(imagem_perfil_status='FALHOU')
+
+
+@tarefa('imagens.remover_fundo_perfil', ao_falhar=_remocao_falhou)
+def remover_fundo_perfil(user_id, nome):
+    """
+    Troca a imagem de perfil `nome` pela versão sem fundo (PNG) e marca o
+    status CONCLUIDO.
+
+    Se o usuário trocou a imagem enquanto o job esperava na fila, o
+    resultado é descartado; a troca é um UPDATE condicionado ao nome atual
+    e ao status PROCESSANDO. Erros geram nova tentativa; o status só vira
+    FALHOU na última.
+    """
+    user = _aguardando_remocao(user_id, nome).first()
+    if user is None:
+        return {'ignorado': True}
+    
+    with user.imagem_perfil.open('rb') as arquivo:
+        conteudo = imagens.remover_fundo(arquivo)
+    
+    campo = user.imagem_perfil.field
+    storage = user.imagem_perfil.storage
+    nome_base = os.path.splitext(os.path.basename(nome))[0]
+    novo_nome = storage.save(
+        campo.generate_filename(user, f'{nome_base}_nobg.png'),
+        ContentFile(conteudo)
+    )
+    trocadas = _aguardando_remocao(user_id, nome).update(
+        imagem_perfil=novo_nome,
+        imagem_perfil_url=url_publica(storage, novo_nome),
+        imagem_perfil_status='CONCLUIDO'
+    )
+    # Arquivo que ficou sem referência. No storage por conteúdo delete() não
+    # apaga (pode ser compartilhado); fica para o limpar_imagens_orfas
+    storage.delete(nome if trocadas else novo_nome)
+    if not trocadas:
+        return {'ignorado': True}
+    enfileirar('imagens.gerar_variantes', modelo=User._meta.label, pk=str(user_id), nome=novo_nome)
+    return {'imagem_perfil': novo_nome}
+
+
+@tarefa('imagens.gerar_variantes')
+def gerar_variantes(modelo, pk, nome, forcar=False):
+    """
+    Gera as variantes WebP (RACHAS_IMAGEM_VARIANTES) da imagem `nome` e
+    as registra em imagem_variantes, apagando as da imagem anterior.
+    Variantes já geradas para `nome` só são refeitas com forcar=True.
+    """
+    Modelo = apps.get_model(modelo)
+    instance = Modelo.objects.filter(pk=pk, imagem_perfil=nome).first()
+    if instance is None or (instance.imagem_variantes.get('origem') == nome and not forcar):
+        return {'ignorado': True}
+    
+    storage = instance.imagem_perfil.storage
+    with instance.imagem_perfil.open('rb') as arquivo:
+        variantes = imagens.gerar_variantes(
+            arquivo,
+            getattr(settings, 'RACHAS_IMAGEM_VARIANTES', [64, 128, 256, 512]),
+            getattr(settings, 'RACHAS_IMAGEM_VARIANTES_QUALIDADE', 80)
+        )
+    nome_base = os.path.splitext(nome)[0]
+    tamanhos = {
+        str(lado): storage.save(f'{nome_base}_{lado}.webp', ContentFile(conteudo))
+        for lado, conteudo in variantes
+    }
+    
+    atualizados = Modelo.objects.filter(pk=pk, imagem_perfil=nome).update(
+        imagem_variantes={
+            'origem': nome,
+            'tamanhos': tamanhos,
+            'urls': {lado: url_publica(storage, arquivo) for lado, arquivo in tamanhos.items()},
+        }
+    )
+    # Sem atualização (imagem trocada nesse meio tempo) as novas sobram;
+    # com atualização, as da imagem anterior (ver remover_fundo_perfil)
+    sem_referencia = instance.imagem_variantes.get('tamanhos', {}) if atualizados else tamanhos
+    for arquivo in sem_referencia.values():
+        storage.delete(arquivo)
+    if not atualizados:
+        return {'ignorado': True}
+    return tamanhos
@@ -1,10 +1,50 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import F
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework import status
+import os
+import sys
+import json
 import uuid
+import subprocess
+import asyncio
+import threading
+import hashlib
+import tempfile
+import shutil
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO, BytesIO
+from datetime import timedelta
+from unittest import mock, skipUnless
+from importlib.util import find_spec
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from asgiref.sync import async_to_sync
 
-from .models import Racha, JogadoresRacha, Premio, Partida, SolicitacaoRacha
+from .models import (
+    Racha, JogadoresRacha, Premio, Partida, SolicitacaoRacha,
+    JogadorPartida, RegistroPartida, PremioPartida, Job
+)
+from .roles import PapeisUsuario
+from .authentication import usuario_do_token
+from .serializers import RachaSerializer, RachaTokenObtainPairSerializer, UserSerializer
+from .eventos import get_broker
+from . import views_async, imagens, proxy_imagens
+from .solicitacoes import racha_id_por_codigo, racha_para_solicitacao, criar_solicitacao_pendente
+from .jobs import tarefa, enfileirar, reivindicar, executar, renovar_reservas, recuperar_travados
+from .storage import ConteudoEnderecadoMixin, S3ConteudoStorage
+from .convites import numero_para_codigo, ALFABETO_CONVITE, TAMANHO_CONVITE, TOTAL_CODIGOS
 
 User = get_user_model()
 
@@ -104,3 +144,1735 @@ class PremioAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(response.data['nome'], 'Melhor Jogador')
         self.assertEqual(response.data['valor_pontos'], 5)
+
+
+class MeusRachasAPITestCase(APITestCase):
+    """Testes para a listagem paginada de meus_rachas"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='jogador',
+            email='jogador@test.com',
+            password='pass123',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.outro = User.objects.create_user(
+            username='outro',
+            email='outro@test.com',
+            password='pass123',
+            posicao='GOLEIRO',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.client.force_authenticate(user=self.user)
+        
+        # Racha administrado e jogado pelo usuário
+        self.racha_admin = Racha.objects.create(nome='Racha Admin')
+        self.racha_admin.administrador.add(self.user)
+        JogadoresRacha.objects.create(racha=self.racha_admin, jogador=self.user)
+        JogadoresRacha.objects.create(racha=self.racha_admin, jogador=self.outro, ativo=False)
+        
+        # Racha em que o usuário é apenas jogador
+        self.racha_membro = Racha.objects.create(nome='Racha Membro')
+        self.racha_membro.administrador.add(self.outro)
+        JogadoresRacha.objects.create(racha=self.racha_membro, jogador=self.user)
+        JogadoresRacha.objects.create(racha=self.racha_membro, jogador=self.outro)
+        
+        # Racha sem vínculo com o usuário
+        self.racha_alheio = Racha.objects.create(nome='Racha Alheio')
+        self.racha_alheio.administrador.add(self.outro)
+    
+    def test_meus_rachas_paginado_sem_duplicatas(self):
+        """Retorna cada racha uma única vez, com contagens e flag de admin"""
+        response = self.client.get('/api/v1/rachas/meus_rachas/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        por_nome = {r['nome']: r for r in response.data['results']}
+        self.assertEqual(set(por_nome), {'Racha Admin', 'Racha Membro'})
+        self.assertTrue(por_nome['Racha Admin']['is_admin'])
+        self.assertFalse(por_nome['Racha Membro']['is_admin'])
+        self.assertEqual(por_nome['Racha Admin']['total_jogadores'], 1)
+        self.assertEqual(por_nome['Racha Membro']['total_jogadores'], 2)
+    
+    def test_meus_rachas_consultas_constantes(self):
+        """O número de consultas não cresce com a quantidade de rachas"""
+        for i in range(5):
+            racha = Racha.objects.create(nome=f'Racha Extra {i}')
+            racha.administrador.add(self.outro)
+            JogadoresRacha.objects.create(racha=racha, jogador=self.user)
+        
+        # count + página + prefetch de administradores
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/rachas/meus_rachas/')
+        self.assertEqual(response.data['count'], 7)
+
+
+class PapeisUsuarioTestCase(TestCase):
+    """Testes para o resolvedor de papéis (admin/membro) por request"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jogador',
+            email='jogador@test.com',
+            password='pass123',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.racha_admin = Racha.objects.create(nome='Racha Admin')
+        self.racha_admin.administrador.add(self.user)
+        self.racha_membro = Racha.objects.create(nome='Racha Membro')
+        JogadoresRacha.objects.create(racha=self.racha_membro, jogador=self.user)
+        self.racha_inativo = Racha.objects.create(nome='Racha Inativo')
+        JogadoresRacha.objects.create(racha=self.racha_inativo, jogador=self.user, ativo=False)
+    
+    def test_papeis_em_uma_consulta(self):
+        """Todas as verificações são respondidas com uma única consulta"""
+        papeis = PapeisUsuario(self.user)
+        with self.assertNumQueries(1):
+            self.assertTrue(papeis.is_admin(self.racha_admin))
+            self.assertTrue(papeis.is_admin(str(self.racha_admin.id)))
+            self.assertFalse(papeis.is_admin(self.racha_membro.id))
+            self.assertTrue(papeis.is_membro(self.racha_membro))
+            self.assertFalse(papeis.is_membro(self.racha_inativo))
+            self.assertTrue(papeis.is_admin_ou_membro(self.racha_admin))
+            self.assertFalse(papeis.is_admin('id-invalido'))
+    
+    def test_detalhe_racha_usa_papeis_do_request(self):
+        """Permissão e serializer compartilham o mesmo cache do request"""
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(f'/api/v1/rachas/{self.racha_admin.id}/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_admin'])
+        
+        response = client.get(f'/api/v1/rachas/{self.racha_inativo.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+
+@override_settings(RACHAS_JWT_PAPEIS=True)
+class PapeisTokenAPITestCase(APITestCase):
+    """Testes para papéis embutidos no access token"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(
+            username='admin',
+            email='admin@test.com',
+            password='pass123',
+            posicao='GOLEIRO',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.jogador = User.objects.create_user(
+            username='jogador',
+            email='jogador@test.com',
+            password='pass123',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.racha = Racha.objects.create(nome='Racha Token')
+        self.racha.administrador.add(self.admin)
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.jogador)
+    
+    def _token(self, username):
+        response = self.client.post(
+            '/api/auth/token/',
+            {'username': username, 'password': 'pass123'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['access']
+    
+    def test_leitura_autorizada_pelos_claims(self):
+        """Com a versão em dia, a leitura usa os papéis do token"""
+        access = self._token('jogador')
+        # Remoção sem incrementar a versão: só o token ainda conhece o vínculo
+        JogadoresRacha.objects.filter(jogador=self.jogador).delete()
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.client.get(f'/api/v1/rachas/{self.racha.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_token_desatualizado_consulta_banco(self):
+        """Mudança de papéis incrementa a versão e invalida os claims"""
+        access_jogador = self._token('jogador')
+        access_admin = self._token('admin')
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_admin}')
+        response = self.client.post(
+            f'/api/v1/rachas/{self.racha.id}/alterar_status_jogador/',
+            {'jogador_id': str(self.jogador.id), 'ativo': False},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_jogador}')
+        response = self.client.get(f'/api/v1/rachas/{self.racha.id}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_alteracao_de_admins_incrementa_versao(self):
+        """Edições no M2M de administradores incrementam a versão"""
+        versao = User.objects.get(id=self.jogador.id).papeis_versao
+        self.racha.administrador.add(self.jogador)
+        self.racha.administrador.clear()
+        self.assertEqual(User.objects.get(id=self.jogador.id).papeis_versao, versao + 2)
+
+
+
+class UsuarioLeveTestCase(TestCase):
+    """Testes para o usuário montado a partir do token (modo stateless)"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jogador',
+            email='jogador@test.com',
+            password='pass123',
+            first_name='Jogador',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.token = RachaTokenObtainPairSerializer.get_token(self.user).access_token
+    
+    def test_usuario_sem_consulta(self):
+        """id e username vêm do token, sem acessar o banco"""
+        with self.assertNumQueries(0):
+            user = usuario_do_token(self.token)
+            self.assertEqual(user.id, self.user.id)
+            self.assertEqual(user.username, 'jogador')
+            self.assertTrue(user.is_authenticated)
+            self.assertEqual(user, self.user)
+    
+    def test_campos_fora_do_token_carregados_uma_vez(self):
+        """O primeiro campo fora do token carrega o registro inteiro"""
+        user = usuario_do_token(self.token)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'jogador@test.com')
+            self.assertEqual(user.first_name, 'Jogador')
+            self.assertEqual(user.posicao, 'MEIA')
+
+
+
+class PartidaEventosAPITestCase(APITestCase):
+    """Testes para registros em lote na partida"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(
+            username='admin',
+            email='admin@test.com',
+            password='pass123',
+            posicao='GOLEIRO',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.racha = Racha.objects.create(nome='Racha Partida', ponto_gol=2, ponto_assistencia=1)
+        self.racha.administrador.add(self.admin)
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.admin)
+        self.jogadores = []
+        for i in range(20):
+            jogador = User.objects.create_user(
+                username=f'jogador{i}',
+                email=f'jogador{i}@test.com',
+                posicao='MEIA',
+                auth_uid=str(uuid.uuid4())
+            )
+            JogadoresRacha.objects.create(racha=self.racha, jogador=jogador)
+            self.jogadores.append(jogador)
+        self.estranho = User.objects.create_user(
+            username='estranho',
+            email='estranho@test.com',
+            password='pass123',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.partida = Partida.objects.create(racha=self.racha)
+        self.url = f'/api/v1/partidas/{self.partida.id}/'
+    
+    def _adicionar(self, ids):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                self.url + 'adicionar_jogador/',
+                {'jogadores_ids': ids},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(ctx.captured_queries)
+    
+    def test_adicionar_jogadores_em_lote(self):
+        """Consultas constantes e resultado por id, inclusive upsert"""
+        ids = [str(j.id) for j in self.jogadores]
+        _, consultas_poucos = self._adicionar(ids[:2])
+        
+        JogadorPartida.objects.filter(partida=self.partida).update(presente=False)
+        response, consultas_muitos = self._adicionar(ids + [str(self.estranho.id), 'invalido'])
+        
+        self.assertEqual(consultas_poucos, consultas_muitos)
+        self.assertEqual(len(response.data['jogadores']), 20)
+        self.assertEqual(len(response.data['erros']), 2)
+        status_por_id = {r['jogador_id']: r['status'] for r in response.data['resultados']}
+        self.assertEqual(status_por_id[str(self.estranho.id)], 'erro')
+        self.assertEqual(status_por_id[ids[0]], 'adicionado')
+        self.assertEqual(JogadorPartida.objects.filter(partida=self.partida, presente=True).count(), 20)
+    
+    def test_registrar_gols_em_lote(self):
+        """Súmula inteira gravada de uma vez, validando o elenco"""
+        a, b, c = self.jogadores[:3]
+        eventos = [
+            {'jogador_gol_id': str(a.id), 'jogador_assistencia_id': str(b.id)},
+            {'jogador_gol_id': str(b.id)},
+            {'jogador_assistencia_id': str(c.id)},
+        ]
+        response = self.client.post(self.url + 'registrar_gols/', {'eventos': eventos}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['jogador_gol']['username'], a.username)
+        self.assertEqual(RegistroPartida.objects.filter(partida=self.partida).count(), 3)
+    
+    def test_registrar_gols_rejeita_lote_com_jogador_de_fora(self):
+        """Um evento inválido impede a gravação de todo o lote"""
+        eventos = [
+            {'jogador_gol_id': str(self.jogadores[0].id)},
+            {'jogador_gol_id': str(self.estranho.id)},
+        ]
+        response = self.client.post(self.url + 'registrar_gols/', {'eventos': eventos}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['erros'][0]['indice'], 1)
+        self.assertFalse(RegistroPartida.objects.filter(partida=self.partida).exists())
+    
+    def test_registrar_gols_apenas_admin(self):
+        """Jogador do racha não envia a súmula inteira"""
+        self.client.force_authenticate(user=self.jogadores[0])
+        eventos = [{'jogador_gol_id': str(self.jogadores[0].id)}]
+        response = self.client.post(self.url + 'registrar_gols/', {'eventos': eventos}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(RegistroPartida.objects.filter(partida=self.partida).exists())
+    
+    def test_registrar_gol_idempotente(self):
+        """Repetição com a mesma Idempotency-Key devolve a resposta original"""
+        dados = {'jogador_gol_id': str(self.jogadores[0].id)}
+        primeira = self.client.post(
+            self.url + 'registrar_gol/', dados, format='json', HTTP_IDEMPOTENCY_KEY='gol-1'
+        )
+        repetida = self.client.post(
+            self.url + 'registrar_gol/', dados, format='json', HTTP_IDEMPOTENCY_KEY='gol-1'
+        )
+        
+        self.assertEqual(primeira.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(repetida.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(repetida.data['id'], primeira.data['id'])
+        self.assertEqual(RegistroPartida.objects.filter(partida=self.partida).count(), 1)
+        
+        # Mesma chave com outro conteúdo é rejeitada
+        outra = self.client.post(
+            self.url + 'registrar_gol/',
+            {'jogador_gol_id': str(self.jogadores[1].id)},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY='gol-1'
+        )
+        self.assertEqual(outra.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    def test_sincronizar_log_offline(self):
+        """Log offline mesclado em lote, idempotente e com conflitos reportados"""
+        a, b = self.jogadores[:2]
+        premio = Premio.objects.create(racha=self.racha, nome='Craque', valor_pontos=3)
+        id_gol = str(uuid.uuid4())
+        log = {
+            'presencas': [
+                {'id_cliente': str(uuid.uuid4()), 'jogador_id': str(a.id)},
+                {'id_cliente': str(uuid.uuid4()), 'jogador_id': str(b.id)},
+                {'id_cliente': str(uuid.uuid4()), 'jogador_id': str(self.estranho.id)},
+            ],
+            'gols': [
+                {'id_cliente': id_gol, 'jogador_gol_id': str(a.id), 'jogador_assistencia_id': str(b.id)},
+                {'id_cliente': 'nao-e-uuid', 'jogador_gol_id': str(b.id)},
+            ],
+            'premios': [
+                {'id_cliente': str(uuid.uuid4()), 'jogador_id': str(a.id), 'premio_id': str(premio.id)},
+            ],
+            'finalizar': {'id_cliente': str(uuid.uuid4())},
+        }
+        
+        response = self.client.post(self.url + 'sincronizar/', log, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['conflitos']), 2)
+        self.assertEqual(response.data['gols'], [id_gol])
+        self.assertTrue(response.data['finalizada'])
+        
+        # Reenvio do mesmo log não duplica registros
+        response = self.client.post(self.url + 'sincronizar/', log, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(JogadorPartida.objects.filter(partida=self.partida).count(), 2)
+        self.assertEqual(RegistroPartida.objects.filter(partida=self.partida).count(), 1)
+        self.assertEqual(PremioPartida.objects.filter(partida=self.partida).count(), 1)
+        self.partida.refresh_from_db()
+        self.assertFalse(self.partida.status)
+    
+    def test_sincronizar_nao_sobrescreve_outra_partida(self):
+        """id_cliente de outra partida vira conflito; data_fim malformada é 400"""
+        a, b = self.jogadores[:2]
+        outra = Partida.objects.create(racha=self.racha)
+        registro = RegistroPartida.objects.create(partida=outra, jogador_gol=a)
+        log = {'gols': [{'id_cliente': str(registro.id), 'jogador_gol_id': str(b.id)}]}
+        
+        response = self.client.post(self.url + 'sincronizar/', log, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['gols'], [])
+        self.assertEqual(response.data['conflitos'][0]['motivo'], 'id_cliente já usado em outra partida')
+        registro.refresh_from_db()
+        self.assertEqual((registro.partida_id, registro.jogador_gol_id), (outra.id, a.id))
+        
+        response = self.client.post(
+            self.url + 'sincronizar/', {'finalizar': {'data_fim': '2024-13-45T25:00:00'}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_gol_publica_evento_apos_commit(self):
+        """Registrar gol publica o delta somente após o commit"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(
+                self.url + 'registrar_gol/',
+                {'jogador_gol_id': str(self.jogadores[0].id)},
+                format='json'
+            )
+        self.assertEqual(len(callbacks), 1)
+    
+    def test_editar_registro(self):
+        registro = RegistroPartida.objects.create(partida=self.partida, jogador_gol=self.jogadores[0])
+        response = self.client.put(
+            self.url + 'editar_registro/',
+            {'registro_id': str(registro.id), 'jogador_gol_id': str(self.jogadores[1].id)},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        registro.refresh_from_db()
+        self.assertEqual(registro.jogador_gol_id, self.jogadores[1].id)
+    
+    def test_registrar_premio_do_racha(self):
+        premio = Premio.objects.create(racha=self.racha, nome='Craque', valor_pontos=3)
+        outro = Premio.objects.create(racha=Racha.objects.create(nome='Outro Racha'), nome='Bagre', valor_pontos=1)
+        dados = {'jogador_id': str(self.jogadores[0].id)}
+        
+        response = self.client.post(self.url + 'registrar_premio/', {**dados, 'premio_id': str(outro.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url + 'registrar_premio/', {**dados, 'premio_id': str(premio.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(PremioPartida.objects.get(partida=self.partida).premio, premio)
+    
+    def test_presenca_e_premio_publicam_eventos(self):
+        """Presença e prêmio avulsos também geram deltas para os clientes"""
+        premio = Premio.objects.create(racha=self.racha, nome='Craque', valor_pontos=3)
+        jogador = self.jogadores[0]
+        with mock.patch('rachas.views.publicar_evento') as publicar:
+            presenca = self.client.post(
+                self.url + 'registrar_presenca/', {'jogador_id': str(jogador.id)}, format='json'
+            )
+            premiado = self.client.post(
+                self.url + 'registrar_premio/',
+                {'premio_id': str(premio.id), 'jogador_id': str(jogador.id)},
+                format='json'
+            )
+        
+        self.assertEqual(presenca.status_code, status.HTTP_200_OK)
+        self.assertEqual(premiado.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [chamada.args[1] for chamada in publicar.call_args_list],
+            ['presenca_alterada', 'premio_adicionado']
+        )
+
+
+@override_settings(RACHAS_ASGI=True)
+class EventosPartidaTestCase(TestCase):
+    """Testes para o stream SSE de eventos da partida"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='jogador',
+            email='jogador@test.com',
+            posicao='MEIA',
+            auth_uid=str(uuid.uuid4())
+        )
+        self.racha = Racha.objects.create(nome='Racha SSE')
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.user)
+        self.partida = Partida.objects.create(racha=self.racha)
+        self.url = f'/api/v1/partidas/{self.partida.id}/eventos/'
+    
+    async def test_stream_recebe_evento_publicado(self):
+        """O assinante recebe o delta publicado para a partida"""
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(self.url, {'token': token})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        proximo = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        get_broker().publicar(self.partida.id, {'tipo': 'gol_adicionado', 'dados': {'id': 'x'}, 'ts': 1})
+        chunk = await asyncio.wait_for(proximo, timeout=5)
+        self.assertIn(b'event: gol_adicionado', chunk)
+        await stream.aclose()
+    
+    async def test_stream_exige_token(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+    
+    @override_settings(RACHAS_ASGI=False)
+    async def test_stream_indisponivel_sob_wsgi(self):
+        token = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(self.url, {'token': token})
+        self.assertEqual(response.status_code, 501)
+
+
+class ViewsAsyncTestCase(TestCase):
+    """Testes para as leituras async (modo ASGI)"""
+    
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@test.com', posicao='MEIA', auth_uid=str(uuid.uuid4())
+        )
+        self.jogador = User.objects.create_user(
+            username='jogador', email='jogador@test.com', posicao='ATACANTE', auth_uid=str(uuid.uuid4())
+        )
+        self.estranho = User.objects.create_user(
+            username='estranho', email='estranho@test.com', posicao='ZAGUEIRO', auth_uid=str(uuid.uuid4())
+        )
+        self.racha = Racha.objects.create(nome='Racha Async', ponto_gol=3, ponto_assistencia=2, ponto_presenca=1)
+        self.racha.administrador.add(self.admin)
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.admin)
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.jogador)
+        premio = Premio.objects.create(racha=self.racha, nome='Craque', valor_pontos=5)
+        self.partida = Partida.objects.create(racha=self.racha)
+        JogadorPartida.objects.create(partida=self.partida, jogador=self.jogador, presente=True)
+        RegistroPartida.objects.create(partida=self.partida, jogador_gol=self.jogador, jogador_assistencia=self.admin)
+        RegistroPartida.objects.create(partida=self.partida, jogador_gol=self.jogador)
+        PremioPartida.objects.create(partida=self.partida, premio=premio, jogador=self.admin)
+        self.factory = AsyncRequestFactory()
+    
+    def _headers(self, user):
+        return {'headers': {'Authorization': f'Bearer {AccessToken.for_user(user)}'}}
+    
+    def test_respostas_iguais_as_views_sincronas(self):
+        """Cada view async devolve o mesmo JSON da action síncrona equivalente"""
+        client = APIClient()
+        client.force_authenticate(user=self.jogador)
+        rotas = [
+            (views_async.me, '/api/v1/usuarios/me/', {}),
+            (views_async.meus_rachas, '/api/v1/rachas/meus_rachas/', {}),
+            (views_async.partida_detalhe, f'/api/v1/partidas/{self.partida.id}/', {'pk': self.partida.id}),
+            (views_async.ranking, f'/api/v1/rachas/{self.racha.id}/ranking/', {'pk': self.racha.id}),
+            (
+                views_async.ranking_artilheiros,
+                f'/api/v1/rachas/{self.racha.id}/ranking_artilheiros/',
+                {'pk': self.racha.id}
+            ),
+            (
+                views_async.ranking_assistencias,
+                f'/api/v1/rachas/{self.racha.id}/ranking_assistencias/',
+                {'pk': self.racha.id}
+            ),
+        ]
+        for view, url, kwargs in rotas:
+            with self.subTest(url=url):
+                esperado = client.get(url)
+                request = self.factory.get(url, **self._headers(self.jogador))
+                response = async_to_sync(view)(request, **kwargs)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(response.content), json.loads(esperado.content))
+    
+    async def test_exige_token(self):
+        request = self.factory.get('/api/v1/usuarios/me/')
+        response = await views_async.me(request)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+    
+    async def test_usuario_inativo_recusado(self):
+        await User.objects.filter(pk=self.jogador.pk).aupdate(is_active=False)
+        url = f'/api/v1/rachas/{self.racha.id}/ranking/'
+        request = self.factory.get(url, **self._headers(self.jogador))
+        response = await views_async.ranking(request, pk=self.racha.id)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        
+        # No modo stateless o acesso vale até o access token expirar
+        with self.settings(RACHAS_JWT_STATELESS=True):
+            request = self.factory.get(url, **self._headers(self.jogador))
+            response = await views_async.ranking(request, pk=self.racha.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    async def test_ranking_sem_acesso(self):
+        url = f'/api/v1/rachas/{self.racha.id}/ranking/'
+        request = self.factory.get(url, **self._headers(self.estranho))
+        response = await views_async.ranking(request, pk=self.racha.id)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_escrita_segue_para_viewset(self):
+        """PATCH em /usuarios/me/ é atendido pelo UserViewSet síncrono"""
+        request = self.factory.patch(
+            '/api/v1/usuarios/me/',
+            data=json.dumps({'first_name': 'Novo'}),
+            content_type='application/json',
+            **self._headers(self.jogador)
+        )
+        response = async_to_sync(views_async.me)(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.jogador.refresh_from_db()
+        self.assertEqual(self.jogador.first_name, 'Novo')
+
+
+class CodigoConviteTestCase(TestCase):
+    """Testes para a alocação de códigos de convite"""
+    
+    def test_permutacao_sem_colisoes(self):
+        codigos = [numero_para_codigo(n) for n in range(20000)]
+        self.assertEqual(len(set(codigos)), len(codigos))
+        for codigo in codigos[:100]:
+            self.assertEqual(len(codigo), TAMANHO_CONVITE)
+            self.assertTrue(set(codigo) <= set(ALFABETO_CONVITE))
+        self.assertEqual(len(numero_para_codigo(TOTAL_CODIGOS - 1)), TAMANHO_CONVITE)
+        with self.assertRaises(ValueError):
+            numero_para_codigo(TOTAL_CODIGOS)
+    
+    def test_codigo_legado_e_pulado(self):
+        """Código vindo da sequência que coincide com um código antigo é descartado"""
+        Racha.objects.create(nome='Antigo', codigo_convite='AAAAA')
+        with mock.patch('rachas.models.proximo_codigo_convite', side_effect=['AAAAA', 'BBBBB']):
+            racha = Racha.objects.create(nome='Novo')
+        self.assertEqual(racha.codigo_convite, 'BBBBB')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Requer a sequência do Postgres')
+class CodigoConviteConcorrenteTestCase(TransactionTestCase):
+    """Criação concorrente de milhares de rachas sem colisão de código"""
+    
+    THREADS = 16
+    RACHAS_POR_THREAD = 150
+    
+    def test_criacao_concorrente(self):
+        erros = []
+        
+        def criar(indice):
+            try:
+                for i in range(self.RACHAS_POR_THREAD):
+                    Racha.objects.create(nome=f'Racha {indice}-{i}')
+            except Exception as e:
+                erros.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=criar, args=(i,)) for i in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(erros, [])
+        total = self.THREADS * self.RACHAS_POR_THREAD
+        self.assertEqual(Racha.objects.count(), total)
+        self.assertEqual(Racha.objects.values('codigo_convite').distinct().count(), total)
+
+
+class SolicitacaoEntradaTestCase(APITestCase):
+    """Testes para pedidos de entrada por código de convite"""
+    
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(
+            username='admin', email='admin@test.com', posicao='MEIA', auth_uid=str(uuid.uuid4())
+        )
+        self.jogador = User.objects.create_user(
+            username='jogador', email='jogador@test.com', posicao='ATACANTE', auth_uid=str(uuid.uuid4())
+        )
+        self.racha = Racha.objects.create(nome='Racha Convite')
+        self.racha.administrador.add(self.admin)
+        JogadoresRacha.objects.create(racha=self.racha, jogador=self.admin)
+        self.client.force_authenticate(user=self.jogador)
+    
+    def test_cria_solicitacao_pendente(self):
+        dados = {'codigo_convite': self.racha.codigo_convite}
+        response = self.client.post('/api/v1/solicitacoes/', dados, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], 'PENDENTE')
+        self.assertTrue(SolicitacaoRacha.objects.filter(id=response.data['id'], status='PENDENTE').exists())
+        
+        response = self.client.post('/api/v1/solicitacoes/', dados, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(SolicitacaoRacha.objects.count(), 1)
+    
+    def test_codigo_resolvido_pelo_cache(self):
+        """Com o código em cache, resolução e verificações custam uma consulta"""
+        self.assertEqual(racha_id_por_codigo(self.racha.codigo_convite), self.racha.id)
+        with self.assertNumQueries(1):
+            racha = racha_para_solicitacao(self.racha.codigo_convite, self.jogador.id)
+        self.assertFalse(racha.membro)
+        self.assertFalse(racha.pendente)
+    
+    def test_insert_concorrente_nao_duplica(self):
+        """Solicitação criada por outra requisição entre a verificação e o INSERT"""
+        SolicitacaoRacha.objects.create(racha=self.racha, jogador=self.jogador, status='PENDENTE')
+        self.assertIsNone(criar_solicitacao_pendente(self.racha, self.jogador))
+        self.assertEqual(SolicitacaoRacha.objects.count(), 1)
+    
+    def test_membro_e_codigo_inexistente(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post(
+            f'/api/v1/rachas/{self.racha.id}/entrar_por_codigo/',
+            {'codigo_convite': self.racha.codigo_convite},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/v1/solicitacoes/', {'codigo_convite': 'ZZZZZ'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_racha_excluido_sai_do_cache(self):
+        codigo = self.racha.codigo_convite
+        racha_id_por_codigo(codigo)
+        self.racha.delete()
+        self.assertIsNone(racha_id_por_codigo(codigo))
+    
+    def _pendentes(self, total):
+        jogadores = [
+            User.objects.create_user(username=f'novo{i}', email=f'novo{i}@test.com', posicao='MEIA')
+            for i in range(total)
+        ]
+        return [
+            SolicitacaoRacha.objects.create(racha=self.racha, jogador=jogador, status='PENDENTE')
+            for jogador in jogadores
+        ]
+    
+    def test_aprovar_em_lote(self):
+        solicitacoes = self._pendentes(5)
+        self.client.force_authenticate(user=self.admin)
+        ids = [str(s.id) for s in solicitacoes] + [str(uuid.uuid4()), 'invalido']
+        
+        # Papéis, SELECT FOR UPDATE, INSERT, UPDATE, DELETE, versão de papéis (+ savepoint)
+        with self.assertNumQueries(8):
+            response = self.client.post('/api/v1/solicitacoes/aprovar_lote/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['processadas']), 5)
+        self.assertEqual(len(response.data['ignoradas']), 2)
+        self.assertEqual(SolicitacaoRacha.objects.filter(status='ACEITO').count(), 5)
+        self.assertEqual(
+            JogadoresRacha.objects.filter(racha=self.racha, jogador__in=[s.jogador for s in solicitacoes]).count(),
+            5
+        )
+    
+    def test_negar_em_lote_exige_admin(self):
+        solicitacoes = self._pendentes(2)
+        ids = [str(s.id) for s in solicitacoes]
+        response = self.client.post('/api/v1/solicitacoes/negar_lote/', {'ids': ids}, format='json')
+        self.assertEqual(response.data['processadas'], [])
+        self.assertEqual(SolicitacaoRacha.objects.filter(status='PENDENTE').count(), 2)
+        
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.post('/api/v1/solicitacoes/negar_lote/', {'ids': ids}, format='json')
+        self.assertEqual(len(response.data['processadas']), 2)
+        self.assertEqual(SolicitacaoRacha.objects.filter(status='NEGADO').count(), 2)
+        self.assertFalse(JogadoresRacha.objects.filter(jogador__in=[s.jogador for s in solicitacoes]).exists())
+    
+    @override_settings(RACHAS_PENDENTES_CACHE=True)
+    def test_contagem_de_pendentes(self):
+        """Contador do admin acompanha criação e decisão sem consultar o banco"""
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 0)
+        
+        self.client.force_authenticate(user=self.jogador)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/v1/solicitacoes/', {'codigo_convite': self.racha.codigo_convite}, format='json'
+            )
+        
+        self.client.force_authenticate(user=self.admin)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/solicitacoes/contagem/')
+        self.assertEqual(response.data['pendentes'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                '/api/v1/solicitacoes/negar_lote/',
+                {'ids': [str(SolicitacaoRacha.objects.get().id)]},
+                format='json'
+            )
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 0)
+    
+    @override_settings(RACHAS_PENDENTES_CACHE=True)
+    def test_contagem_acompanha_edicao_e_exclusao(self):
+        """PATCH e DELETE pelo ViewSet também ajustam o contador"""
+        solicitacoes = self._pendentes(2)
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 2)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/v1/solicitacoes/{solicitacoes[0].id}/', {'status': 'NEGADO'}, format='json')
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/v1/solicitacoes/{solicitacoes[1].id}/')
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 0)
+    
+    @override_settings(RACHAS_PENDENTES_CACHE=True)
+    def test_contagem_lida_antes_do_commit_nao_prevalece(self):
+        """Contador ausente no ajuste: recontado após o commit, não perdido"""
+        self.client.force_authenticate(user=self.jogador)
+        # Outro request contou (0) antes do commit e só grava depois
+        contagem_antiga = 0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/v1/solicitacoes/', {'codigo_convite': self.racha.codigo_convite}, format='json')
+        cache.add(f'rachas:solicitacoes_pendentes:{self.admin.pk}', contagem_antiga)
+        
+        self.client.force_authenticate(user=self.admin)
+        self.assertEqual(self.client.get('/api/v1/solicitacoes/contagem/').data['pendentes'], 1)
+    
+    def test_contagem_sem_cache_compartilhado(self):
+        """Sem RACHAS_PENDENTES_CACHE a contagem vem do banco (igual em todos os workers)"""
+        _, segunda = self._pendentes(2)
+        segunda.delete()
+        self.client.force_authenticate(user=self.admin)
+        self.client.get('/api/v1/solicitacoes/contagem/')
+        # Criada sem passar por ajustar_pendentes (ex: por outro worker)
+        SolicitacaoRacha.objects.create(racha=self.racha, jogador=segunda.jogador, status='PENDENTE')
+        response = self.client.get('/api/v1/solicitacoes/contagem/')
+        self.assertEqual(response.data['pendentes'], 2)
+
+
+@tarefa('teste.somar')
+def _tarefa_somar(a, b):
+    return a + b
+
+
+@tarefa('teste.falhar')
+def _tarefa_falhar():
+    raise RuntimeError('falhou')
+
+
+# Chamadas do ao_falhar de teste.com_tratamento
+_falhas_tratadas = []
+
+
+@tarefa('teste.com_tratamento', ao_falhar=lambda **argumentos: _falhas_tratadas.append(argumentos))
+def _tarefa_com_tratamento(valor):
+    return valor
+
+
+class JobsTestCase(TestCase):
+    """Testes para a fila de jobs em segundo plano"""
+    
+    def test_executa_e_guarda_resultado(self):
+        job = enfileirar('teste.somar', a=2, b=3)
+        reivindicados = reivindicar(10)
+        self.assertEqual([j.id for j in reivindicados], [job.id])
+        self.assertEqual(reivindicados[0].status, 'EXECUTANDO')
+        # Já reivindicado: não é entregue de novo
+        self.assertEqual(reivindicar(10), [])
+        
+        self.assertTrue(executar(reivindicados[0]))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'CONCLUIDO')
+        self.assertEqual(job.resultado, 5)
+    
+    def test_falha_com_backoff_ate_max_tentativas(self):
+        job = enfileirar('teste.falhar', max_tentativas=2)
+        executar(reivindicar(1)[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'PENDENTE')
+        self.assertGreater(job.executar_em, timezone.now())
+        self.assertIn('RuntimeError', job.erro)
+        
+        Job.objects.filter(id=job.id).update(executar_em=timezone.now())
+        executar(reivindicar(1)[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FALHOU')
+        self.assertEqual(job.tentativas, 2)
+    
+    def test_job_travado_volta_para_fila(self):
+        job = enfileirar('teste.somar', a=1, b=1)
+        reivindicar(1)
+        Job.objects.filter(id=job.id).update(reservado_ate=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(recuperar_travados(), 1)
+        self.assertEqual(reivindicar(1)[0].id, job.id)
+    
+    def test_reserva_vencida_na_ultima_tentativa_chama_ao_falhar(self):
+        """O worker morreu: a recuperação segue o mesmo caminho de falha de executar()"""
+        self.addCleanup(_falhas_tratadas.clear)
+        job = enfileirar('teste.com_tratamento', max_tentativas=2, valor=7)
+        
+        def vencer():
+            Job.objects.filter(id=job.id).update(reservado_ate=timezone.now() - timedelta(seconds=1))
+        
+        # Primeira tentativa: volta para a fila sem chamar o tratamento
+        reivindicar(1)
+        vencer()
+        self.assertEqual(recuperar_travados(), 1)
+        self.assertEqual(_falhas_tratadas, [])
+        
+        reivindicar(1)
+        vencer()
+        self.assertEqual(recuperar_travados(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.erro), ('FALHOU', 'Tempo de execução esgotado'))
+        self.assertEqual(_falhas_tratadas, [{'valor': 7}])
+        # Já tratado: uma nova recuperação não chama de novo
+        self.assertEqual(recuperar_travados(), 0)
+        self.assertEqual(len(_falhas_tratadas), 1)
+    
+    def test_job_longo_com_reserva_renovada_continua(self):
+        """Iniciado há muito tempo, mas com o heartbeat em dia: não é devolvido"""
+        job = enfileirar('teste.somar', a=1, b=1)
+        reivindicado = reivindicar(1)[0]
+        Job.objects.filter(id=job.id).update(
+            iniciado_em=timezone.now() - timedelta(days=1),
+            reservado_ate=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(renovar_reservas([job.id]), 1)
+        self.assertEqual(recuperar_travados(), 0)
+        self.assertTrue(executar(reivindicado))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'CONCLUIDO')
+    
+    def test_execucao_com_reserva_vencida_e_descartada(self):
+        """A execução antiga não sobrescreve a que reivindicou o job depois"""
+        job = enfileirar('teste.somar', a=1, b=1)
+        antiga = reivindicar(1)[0]
+        Job.objects.filter(id=job.id).update(reservado_ate=timezone.now() - timedelta(seconds=1))
+        recuperar_travados()
+        nova = reivindicar(1)[0]
+        
+        executar(antiga)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'EXECUTANDO')
+        self.assertTrue(executar(nova))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'CONCLUIDO')
+    
+    def test_tarefa_nao_registrada(self):
+        with self.assertRaises(ValueError):
+            enfileirar('teste.inexistente')
+
+
+@override_settings(RACHAS_REMBG_PRECARREGAR=False)
+class RunWorkerTestCase(TransactionTestCase):
+    """Testes para o comando run_worker"""
+    
+    def test_processa_fila_e_termina(self):
+        jobs = [enfileirar('teste.somar', a=i, b=i) for i in range(5)]
+        # Uma thread: o sqlite em memória dos testes trava a tabela sob escrita concorrente
+        call_command('run_worker', uma_vez=True, concorrencia=1, stdout=StringIO())
+        self.assertEqual(Job.objects.filter(id__in=[j.id for j in jobs], status='CONCLUIDO').count(), 5)
+
+
+# Testes de imagem gravam no storage em memória, nunca no bucket configurado
+STORAGES_MEMORIA = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def _imagem_png(nome='foto.png', tamanho=(8, 8)):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', tamanho, 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(nome, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(STORAGES=STORAGES_MEMORIA)
+class RemocaoFundoTestCase(APITestCase):
+    """Testes para a remoção de fundo da imagem de perfil em segundo plano"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='foto', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=self.user)
+    
+    def _enviar(self, **extra):
+        return self.client.patch(
+            '/api/v1/usuarios/me/',
+            {'imagem_perfil': _imagem_png(), **extra},
+            format='multipart'
+        )
+    
+    def test_salva_original_e_enfileira(self):
+        response = self._enviar(remove_bg='true')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['imagem_perfil_status'], 'PROCESSANDO')
+        
+        self.user.refresh_from_db()
+        original = self.user.imagem_perfil.name
+        job = Job.objects.get(tipo='imagens.remover_fundo_perfil')
+        self.assertEqual(job.argumentos, {'user_id': str(self.user.pk), 'nome': original})
+        
+        with mock.patch('rachas.imagens.remover_fundo', return_value=b'png') as remover:
+            self.assertTrue(executar(reivindicar(1)[0]))
+        remover.assert_called_once()
+        
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.imagem_perfil.name.endswith('_nobg.png'))
+        self.assertEqual(self.user.imagem_perfil_status, 'CONCLUIDO')
+        self.assertFalse(self.user.imagem_perfil.storage.exists(original))
+        
+        response = self.client.get('/api/v1/usuarios/me/')
+        self.assertEqual(response.data['imagem_perfil_status'], 'CONCLUIDO')
+    
+    def test_sem_remove_bg_nao_enfileira(self):
+        response = self._enviar()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['imagem_perfil_status'], '')
+        self.assertFalse(Job.objects.filter(tipo='imagens.remover_fundo_perfil').exists())
+    
+    def test_imagem_trocada_descarta_resultado(self):
+        self._enviar(remove_bg='true')
+        self._enviar()
+        self.user.refresh_from_db()
+        atual = self.user.imagem_perfil.name
+        
+        with mock.patch('rachas.imagens.remover_fundo', return_value=b'png') as remover:
+            executar(reivindicar(1, ['imagens.remover_fundo_perfil'])[0])
+        remover.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil.name, atual)
+        self.assertEqual(self.user.imagem_perfil_status, '')
+    
+    @override_settings(STORAGES={
+        **STORAGES_MEMORIA, 'default': {'BACKEND': 'rachas.tests._ConteudoMemoriaStorage'}
+    })
+    def test_mesma_imagem_reenviada_sem_remove_bg(self):
+        """Com nomes por conteúdo o nome se repete: o status invalida o job antigo"""
+        self._enviar(remove_bg='true')
+        self._enviar()
+        self.user.refresh_from_db()
+        nome = self.user.imagem_perfil.name
+        
+        with mock.patch('rachas.imagens.remover_fundo', return_value=b'sem fundo') as remover:
+            executar(reivindicar(1, ['imagens.remover_fundo_perfil'])[0])
+        remover.assert_not_called()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.imagem_perfil.name, self.user.imagem_perfil_status), (nome, ''))
+    
+    def test_falha_marca_status_na_ultima_tentativa(self):
+        self._enviar(remove_bg='true')
+        with mock.patch('rachas.imagens.remover_fundo', side_effect=OSError('imagem inválida')):
+            self.assertFalse(executar(reivindicar(1)[0]))
+            # Ainda há tentativas: continua processando
+            self.user.refresh_from_db()
+            self.assertEqual(self.user.imagem_perfil_status, 'PROCESSANDO')
+            
+            Job.objects.update(executar_em=timezone.now(), tentativas=F('max_tentativas') - 1)
+            self.assertFalse(executar(reivindicar(1)[0]))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_status, 'FALHOU')
+        self.assertFalse(self.user.imagem_perfil.name.endswith('_nobg.png'))
+    
+    def test_worker_encerrado_na_ultima_tentativa_marca_falha(self):
+        """Worker morto (ex.: OOM no rembg) na última tentativa: a reserva vence e o status vira FALHOU"""
+        self._enviar(remove_bg='true')
+        Job.objects.update(tentativas=F('max_tentativas') - 1)
+        job = reivindicar(1)[0]
+        Job.objects.filter(id=job.id).update(reservado_ate=timezone.now() - timedelta(seconds=1))
+        
+        self.assertEqual(recuperar_travados(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'FALHOU')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_status, 'FALHOU')
+
+
+class SessaoRembgTestCase(TestCase):
+    """Testes para o registro de sessões rembg do processo"""
+    
+    def setUp(self):
+        self.addCleanup(imagens._sessoes.clear)
+    
+    @override_settings(RACHAS_REMBG_MODELO='u2netp')
+    def test_sessao_criada_uma_vez_por_modelo(self):
+        with mock.patch('rachas.imagens._nova_sessao', side_effect=lambda modelo: object()) as nova:
+            sessao = imagens.sessao_rembg()
+            self.assertIs(imagens.sessao_rembg(), sessao)
+            self.assertIsNot(imagens.sessao_rembg('u2net'), sessao)
+        self.assertEqual([c.args[0] for c in nova.call_args_list], ['u2netp', 'u2net'])
+    
+    @override_settings(RACHAS_REMBG_THREADS_INTRA=2, RACHAS_REMBG_THREADS_INTER=1)
+    def test_threads_do_onnxruntime(self):
+        with mock.patch('rembg.new_session') as new_session:
+            imagens.sessao_rembg('u2netp')
+        opcoes = new_session.call_args.kwargs['sess_opts']
+        self.assertEqual(new_session.call_args.args, ('u2netp',))
+        self.assertEqual((opcoes.intra_op_num_threads, opcoes.inter_op_num_threads), (2, 1))
+
+
+class RemoverFundoPipelineTestCase(TestCase):
+    """Testes para a redução da imagem antes da segmentação"""
+    
+    @override_settings(RACHAS_IMAGEM_PERFIL_LADO_MAX=400, RACHAS_REMBG_LADO_INFERENCIA=100)
+    def test_segmenta_reduzida_e_aplica_mascara_na_saida(self):
+        from PIL import Image
+        # Foto 2000x1000 com EXIF "girar 90°" (orientação 6): em pé, 1000x2000
+        foto = Image.new('RGB', (2000, 1000), 'blue')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        arquivo = BytesIO()
+        foto.save(arquivo, format='JPEG', exif=exif)
+        arquivo.seek(0)
+        
+        tamanhos = []
+        
+        def mascara(entrada, session, only_mask):
+            tamanhos.append(entrada.size)
+            # Metade de cima opaca, metade de baixo transparente
+            resultado = Image.new('L', entrada.size, 0)
+            resultado.paste(255, (0, 0, entrada.size[0], entrada.size[1] // 2))
+            return resultado
+        
+        with mock.patch('rachas.imagens.sessao_rembg'), mock.patch('rembg.remove', side_effect=mascara):
+            resultado = Image.open(BytesIO(imagens.remover_fundo(arquivo)))
+        
+        self.assertEqual(tamanhos, [(50, 100)])
+        self.assertEqual(resultado.size, (200, 400))
+        self.assertEqual(resultado.mode, 'RGBA')
+        self.assertEqual(resultado.getpixel((100, 50))[3], 255)
+        self.assertEqual(resultado.getpixel((100, 350))[3], 0)
+
+
+@override_settings(RACHAS_IMAGEM_VARIANTES=[32, 16], STORAGES=STORAGES_MEMORIA)
+class ImagemVariantesTestCase(APITestCase):
+    """Testes para as variantes WebP das imagens de perfil"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='variantes', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=self.user)
+    
+    def _executar_variantes(self):
+        for job in reivindicar(10, ['imagens.gerar_variantes']):
+            executar(job)
+    
+    def test_variantes_geradas_apos_upload(self):
+        response = self.client.patch(
+            '/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png(tamanho=(100, 50))}, format='multipart'
+        )
+        self.assertEqual(response.data['imagem_variantes'], {})
+        self._executar_variantes()
+        self.user.refresh_from_db()
+        
+        response = self.client.get('/api/v1/usuarios/me/')
+        variantes = response.data['imagem_variantes']
+        self.assertEqual(set(variantes), {'32', '16'})
+        self.assertTrue(variantes['32'].endswith('_32.webp'))
+        
+        from PIL import Image
+        nome = self.user.imagem_variantes['tamanhos']['32']
+        with self.user.imagem_perfil.storage.open(nome) as arquivo:
+            imagem = Image.open(arquivo)
+            self.assertEqual((imagem.format, imagem.size), ('WEBP', (32, 16)))
+    
+    def test_troca_de_imagem_substitui_variantes(self):
+        self.client.patch('/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png()}, format='multipart')
+        self._executar_variantes()
+        self.user.refresh_from_db()
+        antigas = list(self.user.imagem_variantes['tamanhos'].values())
+        
+        response = self.client.patch('/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png()}, format='multipart')
+        # Variantes da imagem anterior não são expostas
+        self.assertEqual(response.data['imagem_variantes'], {})
+        self._executar_variantes()
+        
+        storage = self.user.imagem_perfil.storage
+        self.assertFalse(any(storage.exists(nome) for nome in antigas))
+        self.user.refresh_from_db()
+        self.assertEqual(len(self.client.get('/api/v1/usuarios/me/').data['imagem_variantes']), 2)
+
+
+class _OrigemImagens(BaseHTTPRequestHandler):
+    """Origem de teste: /imagem.png com ETag, 304 condicional e contagem de GETs"""
+    
+    corpo = bytes(range(256)) * 4
+    etag = '"v1"'
+    last_modified = 'Wed, 01 Jan 2025 00:00:00 GMT'
+    cache_control = 'max-age=60'
+    requisicoes = []
+    
+    def do_GET(self):
+        self.requisicoes.append(dict(self.headers))
+        caminho = self.path.split('?')[0]
+        if caminho == '/pagina.html':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'<p/>')
+            return
+        if caminho != '/imagem.png':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.send_header('Cache-Control', self.cache_control)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(self.corpo)))
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', self.last_modified)
+        self.send_header('Cache-Control', self.cache_control)
+        self.end_headers()
+        self.wfile.write(self.corpo)
+    
+    def log_message(self, *args):
+        pass
+
+
+class ProxyImagemTestCase(APITestCase):
+    """Testes para o proxy de imagens com cache em disco"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = ThreadingHTTPServer(('127.0.0.1', 0), _OrigemImagens)
+        threading.Thread(target=cls.servidor.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.servidor.server_port}/imagem.png'
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        super().tearDownClass()
+    
+    def setUp(self):
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio, ignore_errors=True)
+        configuracao = override_settings(RACHAS_PROXY_CACHE_DIR=diretorio)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        proxy_imagens._cache = None
+        self.addCleanup(setattr, proxy_imagens, '_cache', None)
+        _OrigemImagens.requisicoes = []
+        _OrigemImagens.cache_control = 'max-age=60'
+        
+        self.user = User.objects.create_user(username='proxy', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=self.user)
+    
+    def _get(self, url=None, **headers):
+        return self.client.get('/api/v1/usuarios/proxy_image/', {'url': url or self.url}, headers=headers)
+    
+    def test_repassa_e_serve_do_cache(self):
+        response = self._get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), _OrigemImagens.corpo)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        
+        response = self._get()
+        self.assertEqual(b''.join(response.streaming_content), _OrigemImagens.corpo)
+        self.assertEqual(len(_OrigemImagens.requisicoes), 1)
+        
+        # ETag do cache atende a requisição condicional do cliente
+        response = self._get(**{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_range(self):
+        b''.join(self._get().streaming_content)
+        response = self._get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), _OrigemImagens.corpo[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(_OrigemImagens.corpo)}')
+        
+        response = self._get(Range='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), _OrigemImagens.corpo[-4:])
+        
+        response = self._get(Range='bytes=5000-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+    
+    def test_revalida_entrada_vencida(self):
+        _OrigemImagens.cache_control = 'no-cache'
+        b''.join(self._get().streaming_content)
+        response = self._get()
+        self.assertEqual(b''.join(response.streaming_content), _OrigemImagens.corpo)
+        self.assertEqual(len(_OrigemImagens.requisicoes), 2)
+        self.assertEqual(_OrigemImagens.requisicoes[1].get('If-None-Match'), _OrigemImagens.etag)
+    
+    def test_origem_com_erro(self):
+        response = self._get(url=self.url.replace('imagem.png', 'outra.png'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('erro', response.data)
+        
+        response = self._get(url='file:///etc/passwd')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_recusa_conteudo_que_nao_e_imagem(self):
+        url = self.url.replace('imagem.png', 'pagina.html')
+        for _ in range(2):
+            self.assertEqual(self._get(url=url).status_code, status.HTTP_400_BAD_REQUEST)
+        # Nada guardado: as duas foram à origem
+        self.assertEqual(len(_OrigemImagens.requisicoes), 2)
+        self.assertFalse(any(nome.endswith('.cache') for nome in os.listdir(settings.RACHAS_PROXY_CACHE_DIR)))
+    
+    def test_primeira_resposta_revalidavel(self):
+        """Os validadores da origem vão na primeira resposta e valem contra o cache"""
+        response = self._get()
+        b''.join(response.streaming_content)
+        self.assertEqual(response['ETag'], _OrigemImagens.etag)
+        self.assertEqual(response['Last-Modified'], _OrigemImagens.last_modified)
+        
+        response = self._get(**{'If-None-Match': _OrigemImagens.etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self._get(**{'If-Modified-Since': _OrigemImagens.last_modified})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(_OrigemImagens.requisicoes), 1)
+    
+    def test_limpeza_do_cache_espacada(self):
+        with mock.patch.object(proxy_imagens.CacheDisco, 'limpar', autospec=True) as limpar:
+            for i in range(3):
+                b''.join(self._get(url=f'{self.url}?v={i}').streaming_content)
+            self.assertEqual(limpar.call_count, 1)
+            
+            # Gravações acima de 10% do limite antecipam a limpeza
+            proxy_imagens.get_cache().max_bytes = len(_OrigemImagens.corpo)
+            b''.join(self._get(url=f'{self.url}?v=3').streaming_content)
+            self.assertEqual(limpar.call_count, 2)
+
+
+class _ConteudoMemoriaStorage(ConteudoEnderecadoMixin, InMemoryStorage):
+    pass
+
+
+class ConteudoEnderecadoStorageTestCase(TestCase):
+    """Testes para o storage com nomes pelo hash do conteúdo"""
+    
+    def test_nome_por_conteudo_e_deduplicacao(self):
+        storage = _ConteudoMemoriaStorage()
+        nome = storage.save('perfis/Captura de tela.PNG', ContentFile(b'abc'))
+        self.assertEqual(nome, f'perfis/{hashlib.sha256(b"abc").hexdigest()}.png')
+        
+        with mock.patch.object(InMemoryStorage, '_save') as salvar:
+            self.assertEqual(storage.save('perfis/outra.png', ContentFile(b'abc')), nome)
+        salvar.assert_not_called()
+        
+        self.assertNotEqual(storage.save('perfis/outra.png', ContentFile(b'abcd')), nome)
+        # Arquivo pode ser compartilhado: delete não remove
+        storage.delete(nome)
+        self.assertTrue(storage.exists(nome))
+    
+    def test_objetos_s3_imutaveis(self):
+        storage = S3ConteudoStorage(bucket_name='rachas')
+        self.assertIn('immutable', storage.get_object_parameters('perfis/x.png')['CacheControl'])
+
+
+def _storage_s3(endpoint='http://127.0.0.1:9'):
+    return S3ConteudoStorage(
+        bucket_name='rachas',
+        endpoint_url=endpoint,
+        access_key='teste',
+        secret_key='teste',
+        region_name='us-east-1',
+        signature_version='s3v4',
+        default_acl='public-read'
+    )
+
+
+@override_settings(STORAGES={**STORAGES_MEMORIA, 'default': {'BACKEND': 'rachas.tests._ConteudoMemoriaStorage'}})
+class LimparImagensOrfasTestCase(TestCase):
+    """Testes para a remoção dos arquivos sem referência do storage por conteúdo"""
+    
+    def setUp(self):
+        self.imagem = default_storage.save('perfis/atual.png', ContentFile(b'atual'))
+        self.variante = default_storage.save('perfis/atual_64.webp', ContentFile(b'variante'))
+        self.capa = default_storage.save('rachas/capa.png', ContentFile(b'capa'))
+        self.orfas = [
+            default_storage.save('perfis/antiga.png', ContentFile(b'antiga')),
+            default_storage.save('rachas/antiga_64.webp', ContentFile(b'variante antiga')),
+            default_storage.save('uploads/nunca-confirmado.png', ContentFile(b'pendente')),
+        ]
+        user = User.objects.create_user(username='orfas', password='x', posicao='MEIA')
+        User.objects.filter(pk=user.pk).update(
+            imagem_perfil=self.imagem,
+            imagem_variantes={'origem': self.imagem, 'tamanhos': {'64': self.variante}}
+        )
+        racha = Racha.objects.create(nome='Racha Órfãs')
+        Racha.objects.filter(pk=racha.pk).update(imagem_perfil=self.capa)
+    
+    def _executar(self, **opcoes):
+        saida = StringIO()
+        call_command('limpar_imagens_orfas', stdout=saida, **opcoes)
+        return saida.getvalue()
+    
+    def test_delete_nao_apaga_arquivo_compartilhado(self):
+        default_storage.delete(self.orfas[0])
+        self.assertTrue(default_storage.exists(self.orfas[0]))
+    
+    def test_apaga_so_arquivos_sem_referencia(self):
+        self.assertIn('[dry-run] 3 arquivos', self._executar(idade=0, dry_run=True))
+        self.assertTrue(all(default_storage.exists(nome) for nome in self.orfas))
+        
+        self.assertIn('3 arquivos sem referência apagados', self._executar(idade=0))
+        self.assertFalse(any(default_storage.exists(nome) for nome in self.orfas))
+        for nome in (self.imagem, self.variante, self.capa):
+            self.assertTrue(default_storage.exists(nome))
+    
+    def test_arquivos_recentes_ficam(self):
+        """Upload ou job em andamento: o arquivo existe antes da referência"""
+        self.assertIn('0 arquivos', self._executar())
+        self.assertTrue(all(default_storage.exists(nome) for nome in self.orfas))
+
+
+@override_settings(STORAGES=STORAGES_MEMORIA)
+class UploadDiretoTestCase(APITestCase):
+    """Testes para o upload direto ao bucket com URL assinada"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='upload', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=self.user)
+    
+    def _preparar(self, url='/api/v1/usuarios/upload_imagem/', modelo=User, **dados):
+        dados = {'content_type': 'image/png', 'tamanho': 1024, **dados}
+        # Gerar a URL assinada não acessa a rede
+        with mock.patch.object(modelo._meta.get_field('imagem_perfil'), 'storage', _storage_s3()):
+            return self.client.post(url, dados, format='json')
+    
+    def _enviar(self, conteudo):
+        """Token de um upload preparado e o PUT do cliente simulado no storage"""
+        token = self._preparar(tamanho=len(conteudo)).data['token']
+        chave = signing.loads(token, salt='rachas.uploads')['chave']
+        default_storage.save(chave, ContentFile(conteudo))
+        return token, chave
+    
+    def _confirmar(self, token, url='/api/v1/usuarios/confirmar_imagem/', **dados):
+        return self.client.post(url, {'token': token, **dados}, format='json')
+    
+    def _processar_upload(self):
+        """Executa no worker a tarefa que conclui o upload confirmado"""
+        return executar(reivindicar(1, ['imagens.armazenar_upload'])[0])
+    
+    def test_url_assinada(self):
+        response = self._preparar()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        chave = signing.loads(response.data['token'], salt='rachas.uploads')['chave']
+        self.assertTrue(chave.startswith('uploads/') and chave.endswith('.png'))
+        self.assertIn(f'/rachas/{chave}?', response.data['url'])
+        self.assertIn('X-Amz-Signature', response.data['url'])
+        # O tamanho declarado faz parte da assinatura
+        self.assertIn('content-length', response.data['url'])
+        self.assertEqual(response.data['cabecalhos'], {'Content-Type': 'image/png', 'Content-Length': '1024'})
+        
+        response = self.client.post('/api/v1/usuarios/upload_imagem/', {'content_type': 'text/html', 'tamanho': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    @override_settings(RACHAS_UPLOAD_MAX_BYTES=100)
+    def test_tamanho_obrigatorio_e_limitado(self):
+        self.assertEqual(self._preparar(tamanho=None).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._preparar(tamanho=0).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._preparar(tamanho=101).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._preparar(tamanho=100).status_code, status.HTTP_200_OK)
+    
+    def test_confirmar_associa_imagem(self):
+        token = self._preparar().data['token']
+        self.assertEqual(self._confirmar(token).status_code, status.HTTP_400_BAD_REQUEST)
+        
+        token, chave = self._enviar(_imagem_png().read())
+        # O request não lê o arquivo: só o tamanho (HEAD)
+        with mock.patch.object(InMemoryStorage, 'open', side_effect=AssertionError('arquivo lido no request')):
+            response = self._confirmar(token)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(response.data['imagem_pendente'])
+        
+        self.assertTrue(self._processar_upload())
+        self.user.refresh_from_db()
+        nome = self.user.imagem_perfil.name
+        # Copiada para o nome definitivo; o objeto temporário é apagado
+        self.assertTrue(nome.startswith('perfis/'))
+        self.assertEqual(self.user.imagem_pendente, '')
+        self.assertTrue(default_storage.exists(nome))
+        self.assertFalse(default_storage.exists(chave))
+        self.assertTrue(Job.objects.filter(tipo='imagens.gerar_variantes', argumentos__nome=nome).exists())
+    
+    def test_confirmar_com_remocao_de_fundo(self):
+        token, _ = self._enviar(_imagem_png().read())
+        self._confirmar(token, remove_bg='true')
+        self._processar_upload()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_status, 'PROCESSANDO')
+        self.assertTrue(Job.objects.filter(
+            tipo='imagens.remover_fundo_perfil', argumentos__nome=self.user.imagem_perfil.name
+        ).exists())
+    
+    def test_arquivo_que_nao_e_imagem_descartado(self):
+        token, chave = self._enviar(b'<html>nao e png</html>')
+        self.assertEqual(self._confirmar(token).status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(self._processar_upload())
+        job = Job.objects.get(tipo='imagens.armazenar_upload')
+        # Sem novas tentativas: o conteúdo não vai mudar
+        self.assertEqual(job.status, 'CONCLUIDO')
+        self.assertIn('erro', job.resultado)
+        self.assertFalse(default_storage.exists(chave))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.imagem_perfil)
+        self.assertEqual(self.user.imagem_pendente, '')
+    
+    def test_confirmar_recusa_arquivo_grande(self):
+        token, chave = self._enviar(_imagem_png().read())
+        with override_settings(RACHAS_UPLOAD_MAX_BYTES=10):
+            response = self._confirmar(token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(default_storage.exists(chave))
+        self.assertFalse(Job.objects.filter(tipo='imagens.armazenar_upload').exists())
+    
+    def test_so_a_ultima_confirmacao_e_aplicada(self):
+        primeiro, _ = self._enviar(_imagem_png().read())
+        segundo, _ = self._enviar(_imagem_png(tamanho=(4, 4)).read())
+        self._confirmar(primeiro)
+        self._confirmar(segundo)
+        
+        self._processar_upload()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.imagem_perfil)
+        self._processar_upload()
+        self.user.refresh_from_db()
+        with self.user.imagem_perfil.open('rb') as arquivo:
+            self.assertEqual(arquivo.read(), _imagem_png(tamanho=(4, 4)).read())
+    
+    def test_upload_multipart_descarta_pendente(self):
+        token, _ = self._enviar(_imagem_png().read())
+        self._confirmar(token)
+        self.client.patch('/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png('nova.png')}, format='multipart')
+        self.user.refresh_from_db()
+        nome = self.user.imagem_perfil.name
+        
+        self._processar_upload()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil.name, nome)
+    
+    def test_token_de_outro_registro(self):
+        token = self._preparar().data['token']
+        outro = User.objects.create_user(username='outro', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=outro)
+        response = self.client.post('/api/v1/usuarios/confirmar_imagem/', {'token': token}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_racha_apenas_admin(self):
+        racha = Racha.objects.create(nome='Racha Upload')
+        url = f'/api/v1/rachas/{racha.id}/upload_imagem/'
+        self.assertEqual(self._preparar(url, Racha).status_code, status.HTTP_403_FORBIDDEN)
+        racha.administrador.add(self.user)
+        self.assertEqual(self._preparar(url, Racha).status_code, status.HTTP_200_OK)
+    
+    def test_racha_confirmar_agenda_variantes(self):
+        """RachaSerializer não grava imagem: as variantes vêm do confirmar_imagem"""
+        racha = Racha.objects.create(nome='Racha Variantes')
+        racha.administrador.add(self.user)
+        conteudo = _imagem_png().read()
+        token = self._preparar(f'/api/v1/rachas/{racha.id}/upload_imagem/', Racha, tamanho=len(conteudo)).data['token']
+        default_storage.save(signing.loads(token, salt='rachas.uploads')['chave'], ContentFile(conteudo))
+        
+        response = self._confirmar(token, f'/api/v1/rachas/{racha.id}/confirmar_imagem/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self._processar_upload()
+        racha.refresh_from_db()
+        self.assertTrue(racha.imagem_perfil.name.startswith('rachas/'))
+        self.assertTrue(Job.objects.filter(
+            tipo='imagens.gerar_variantes', argumentos__modelo='rachas.Racha', argumentos__nome=racha.imagem_perfil.name
+        ).exists())
+
+
+@skipUnless(find_spec('moto'), 'moto não instalado')
+class UploadDiretoS3TestCase(APITestCase):
+    """Upload direto contra um S3 local (moto server)"""
+    
+    def test_put_assinado_e_confirmacao(self):
+        import requests
+        from moto.server import ThreadedMotoServer
+        
+        servidor = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+        servidor.start()
+        self.addCleanup(servidor.stop)
+        host, porta = servidor.get_host_and_port()
+        storage = _storage_s3(f'http://{host}:{porta}')
+        storage.bucket.meta.client.create_bucket(Bucket='rachas')
+        
+        user = User.objects.create_user(username='moto', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=user)
+        conteudo = _imagem_png().read()
+        with mock.patch.object(User._meta.get_field('imagem_perfil'), 'storage', storage):
+            upload = self.client.post(
+                '/api/v1/usuarios/upload_imagem/',
+                {'content_type': 'image/png', 'tamanho': len(conteudo)},
+                format='json'
+            ).data
+            # Corpo maior que o declarado não confere com a assinatura
+            resposta = requests.put(upload['url'], data=conteudo + b'x', headers=upload['cabecalhos'], timeout=10)
+            self.assertNotEqual(resposta.status_code, 200)
+            resposta = requests.put(upload['url'], data=conteudo, headers=upload['cabecalhos'], timeout=10)
+            self.assertEqual(resposta.status_code, 200)
+            response = self.client.post('/api/v1/usuarios/confirmar_imagem/', {'token': upload['token']}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertTrue(executar(reivindicar(1, ['imagens.armazenar_upload'])[0]))
+        
+        user.refresh_from_db()
+        objeto = storage.bucket.Object(user.imagem_perfil.name)
+        self.assertIn('immutable', objeto.cache_control)
+        chave = signing.loads(upload['token'], salt='rachas.uploads')['chave']
+        self.assertFalse(storage.exists(chave))
+
+
+@override_settings(STORAGES=STORAGES_MEMORIA, BASE_URL_IMAGES='http://testserver/media/')
+class UrlImagemPersistidaTestCase(APITestCase):
+    """Testes para a URL pública guardada junto à imagem"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='url', password='x', posicao='MEIA')
+        self.client.force_authenticate(user=self.user)
+    
+    def test_url_guardada_no_upload_e_lida_sem_storage(self):
+        self.client.patch('/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png()}, format='multipart')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_url, f'http://testserver/media/{self.user.imagem_perfil.name}')
+        
+        with mock.patch.object(InMemoryStorage, 'url', side_effect=AssertionError('storage consultado')):
+            dados = UserSerializer(self.user).data
+        self.assertEqual(dados['imagem_perfil'], self.user.imagem_perfil_url)
+    
+    def test_url_atualizada_com_usuario_do_token(self):
+        """No modo stateless o save só grava os campos carregados"""
+        token = RachaTokenObtainPairSerializer.get_token(self.user).access_token
+        self.client.force_authenticate(user=usuario_do_token(token))
+        self.client.patch('/api/v1/usuarios/me/', {'imagem_perfil': _imagem_png()}, format='multipart')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.imagem_perfil)
+        self.assertEqual(self.user.imagem_perfil_url, f'http://testserver/media/{self.user.imagem_perfil.name}')
+    
+    def test_url_incluida_em_update_fields(self):
+        racha = Racha.objects.create(nome='Racha Parcial')
+        racha.imagem_perfil = default_storage.save('rachas/parcial.png', ContentFile(b'png'))
+        racha.save(update_fields=['imagem_perfil'])
+        racha.refresh_from_db()
+        self.assertEqual(racha.imagem_perfil_url, f'http://testserver/media/{racha.imagem_perfil.name}')
+    
+    @override_settings(RACHAS_MEDIA_URL_PUBLICA='https://cdn.exemplo.com/')
+    def test_prefixo_publico(self):
+        racha = Racha.objects.create(nome='Racha URL', imagem_perfil=_imagem_png())
+        self.assertEqual(racha.imagem_perfil_url, f'https://cdn.exemplo.com/{racha.imagem_perfil.name}')
+    
+    def test_url_assinada_nao_e_guardada(self):
+        with mock.patch.object(InMemoryStorage, 'url', return_value='https://s3/x.png?Signature=abc'):
+            racha = Racha.objects.create(nome='Racha Assinada', imagem_perfil=_imagem_png())
+        self.assertEqual(racha.imagem_perfil_url, '')
+    
+    def test_url_do_bucket_so_com_dominio_publico(self):
+        """Sem RACHAS_MEDIA_URL_PUBLICA a URL do bucket não é guardada; a resposta assina na hora"""
+        with mock.patch.object(InMemoryStorage, 'url', return_value='https://conta.r2.cloudflarestorage.com/x.png'):
+            racha = Racha.objects.create(nome='Racha Bucket', imagem_perfil=_imagem_png())
+            self.assertEqual(racha.imagem_perfil_url, '')
+        with mock.patch.object(InMemoryStorage, 'url', return_value='https://s3/x.png?Signature=abc'):
+            self.assertEqual(RachaSerializer(racha).data['imagem_perfil'], 'https://s3/x.png?Signature=abc')
+    
+    def test_preencher_urls_existentes(self):
+        nome = default_storage.save('perfis/antiga.png', ContentFile(b'png'))
+        User.objects.filter(pk=self.user.pk).update(imagem_perfil=nome)
+        
+        saida = StringIO()
+        call_command('preencher_urls_imagens', dry_run=True, stdout=saida)
+        self.assertIn('1 atualizados', saida.getvalue())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_url, '')
+        
+        call_command('preencher_urls_imagens', stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.imagem_perfil_url, f'http://testserver/media/{nome}')
+
+
+@override_settings(RACHAS_IMAGEM_VARIANTES=[32, 16], RACHAS_REMBG_PRECARREGAR=False, STORAGES=STORAGES_MEMORIA)
+class ProcessarImagensPerfilTestCase(TestCase):
+    """Testes para o reprocessamento em lote das imagens de perfil"""
+    
+    def setUp(self):
+        self.users = []
+        for i in range(3):
+            nome = default_storage.save(f'perfis/lote{i}.png', _imagem_png())
+            user = User.objects.create_user(username=f'lote{i}', password='x', posicao='MEIA')
+            User.objects.filter(pk=user.pk).update(imagem_perfil=nome)
+            self.users.append(user)
+        self.users.sort(key=lambda user: user.pk)
+        diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, diretorio)
+        self.progresso = f'{diretorio}/progresso.json'
+    
+    def _executar(self, acao, **opcoes):
+        saida = StringIO()
+        call_command(
+            'processar_imagens_perfil', acao,
+            processos=0, taxa=0, progresso=self.progresso, stdout=saida, stderr=StringIO(), **opcoes
+        )
+        return saida.getvalue()
+    
+    def test_dry_run_nao_altera(self):
+        with mock.patch('rachas.imagens.remover_fundo') as remover:
+            saida = self._executar('remover_fundo', dry_run=True)
+        self.assertIn('[dry-run] 3 imagens', saida)
+        remover.assert_not_called()
+        self.assertFalse(User.objects.filter(imagem_perfil_status='CONCLUIDO').exists())
+    
+    def test_remove_fundo_e_salva_progresso(self):
+        with mock.patch('rachas.imagens.remover_fundo', return_value=b'png'):
+            self._executar('remover_fundo')
+        self.assertEqual(User.objects.filter(imagem_perfil_status='CONCLUIDO').count(), 3)
+        with open(self.progresso) as arquivo:
+            progresso = json.load(arquivo)
+        self.assertEqual(progresso['processados'], 3)
+        self.assertEqual(progresso['ultimo_pk'], str(self.users[-1].pk))
+        
+        # Imagens já sem fundo não entram de novo
+        self.assertIn('Nada a processar', self._executar('remover_fundo', recomecar=True))
+    
+    def test_concluidas_ignoradas_pelo_status(self):
+        """Com nomes pelo hash do conteúdo, só o status indica a remoção feita"""
+        User.objects.filter(pk=self.users[0].pk).update(imagem_perfil_status='CONCLUIDO')
+        self.assertIn('[dry-run] 2 imagens', self._executar('remover_fundo', dry_run=True))
+        saida = self._executar('remover_fundo', dry_run=True, forcar=True, recomecar=True)
+        self.assertIn('[dry-run] 3 imagens', saida)
+    
+    def test_continua_de_onde_parou(self):
+        with open(self.progresso, 'w') as arquivo:
+            json.dump({'acao': 'variantes', 'ultimo_pk': str(self.users[0].pk), 'processados': 1, 'falhas': []}, arquivo)
+        self._executar('variantes')
+        
+        self.users[0].refresh_from_db()
+        self.assertEqual(self.users[0].imagem_variantes, {})
+        for user in self.users[1:]:
+            user.refresh_from_db()
+            self.assertEqual(set(user.imagem_variantes['tamanhos']), {'32', '16'})
+    
+    def test_falha_registrada_sem_interromper(self):
+        with mock.patch('rachas.imagens.remover_fundo', side_effect=[b'png', ValueError('corrompida'), b'png']):
+            self._executar('remover_fundo')
+        with open(self.progresso) as arquivo:
+            progresso = json.load(arquivo)
+        self.assertEqual(progresso['falhas'], [str(self.users[1].pk)])
+        self.users[1].refresh_from_db()
+        self.assertEqual(self.users[1].imagem_perfil_status, 'FALHOU')
+    
+    def test_progresso_de_outra_acao(self):
+        with open(self.progresso, 'w') as arquivo:
+            json.dump({'acao': 'variantes', 'ultimo_pk': None, 'processados': 0, 'falhas': []}, arquivo)
+        with self.assertRaises(CommandError):
+            self._executar('remover_fundo')
+
+
+class ImportsLeveisTestCase(TestCase):
+    """A pilha de imagens (rembg, onnxruntime, numpy, Pillow) só carrega sob demanda"""
+    
+    def test_urls_nao_importam_pilha_de_imagens(self):
+        # Processo novo: o dos testes pode já ter importado esses módulos
+        codigo = (
+            'import sys, django; django.setup(); import config.urls; '
+            'print(",".join(m for m in ("rembg", "onnxruntime", "numpy", "PIL") if m in sys.modules))'
+        )
+        saida = subprocess.run(
+            [sys.executable, '-c', codigo],
+            cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings')},
+            capture_output=True,
+            text=True,
+            timeout=60
+        )
+        self.assertEqual(saida.returncode, 0, saida.stderr)
+        self.assertEqual(saida.stdout.strip(), '')
@@ -0,0 +1,179 @@
+"""
+Upload direto de imagens para o bucket (R2/S3) com URLs assinadas.
+
+1. preparar_upload: gera uma chave temporária (uploads/, privada) e uma URL
+   PUT assinada com o tamanho declarado; o cliente envia o arquivo direto
+   ao bucket, sem passar pelo gunicorn.
+2. validar_upload: na confirmação, confere o token (assinado, com a chave,
+   o modelo e o registro) e o tamanho do objeto (HEAD, sem baixá-lo).
+3. armazenar_upload: no worker (tarefa imagens.armazenar_upload), confere
+   se o conteúdo é uma imagem e o copia para o nome definitivo (hash do
+   conteúdo, público e imutável). O objeto temporário é sempre apagado.
+
+Os bytes do arquivo nunca passam pelo gunicorn.
+
+A URL assinada continua válida até expirar, mas só escreve na chave
+temporária: o arquivo servido nunca é sobrescrito por ela.
+"""
+import os
+import uuid
+from io import BytesIO
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+
+
+# Content-Type aceito -> extensão do objeto
+TIPOS_IMAGEM = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+# Formato do Pillow aceito para cada Content-Type
+FORMATOS_IMAGEM = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/webp': 'WEBP',
+}
+
+# Prefixo das chaves temporárias (privadas) dos uploads ainda não confirmados
+PREFIXO_PENDENTES = 'uploads'
+
+_SALT = 'rachas.uploads'
+
+
+class UploadInvalido(Exception):
+    """Pedido ou confirmação de upload recusado"""
+
+
+def _expiracao():
+    return getattr(settings, 'RACHAS_UPLOAD_EXPIRACAO', 10 * 60)
+
+
+def _max_bytes():
+    return getattr(settings, 'RACHAS_UPLOAD_MAX_BYTES', 10 * 1024 * 1024)
+
+
+def _apagar_pendente(storage, chave):
+    """
+    Apaga o objeto temporário. No storage por conteúdo storage.delete() não
+    apaga nada (arquivos compartilhados), então o S3 é chamado direto.
+    """
+    if hasattr(storage, 'bucket'):
+        storage.bucket.Object(storage._normalize_name(chave)).delete()
+    else:
+        storage.delete(chave)
+
+
+def _conferir_imagem(dados, content_type):
+    """Levanta UploadInvalido se `dados` não for uma imagem do tipo declarado"""
+    # Pillow só é carregado aqui (ver rachas.imagens)
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(BytesIO(dados)) as imagem:
+            formato = imagem.format
+            imagem.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise UploadInvalido('O arquivo enviado não é uma imagem válida')
+    if formato != FORMATOS_IMAGEM[content_type]:
+        raise UploadInvalido('O conteúdo do arquivo não corresponde ao tipo informado')
+
+
+def preparar_upload(instance, content_type, tamanho):
+    """
+    URL assinada (PUT) para enviar a imagem_perfil de `instance` (User ou
+    Racha) direto ao bucket. O cliente deve enviar os `cabecalhos`
+    retornados, que fazem parte da assinatura: o bucket só aceita um corpo
+    com exatamente `tamanho` bytes.
+    """
+    extensao = TIPOS_IMAGEM.get(content_type)
+    if extensao is None:
+        raise UploadInvalido(f'Tipo de imagem não suportado; use {", ".join(TIPOS_IMAGEM)}')
+    try:
+        tamanho = int(tamanho)
+    except (TypeError, ValueError):
+        raise UploadInvalido('Informe o tamanho do arquivo em bytes')
+    if not 0 < tamanho <= _max_bytes():
+        raise UploadInvalido(f'O arquivo deve ter até {_max_bytes()} bytes')
+    storage = instance._meta.get_field('imagem_perfil').storage
+    if not hasattr(storage, 'bucket'):
+        raise UploadInvalido('Upload direto indisponível neste ambiente')
+
+    # Sem ACL nem Cache-Control: o objeto temporário é privado
+    chave = f'{PREFIXO_PENDENTES}/{uuid.uuid4().hex}{extensao}'
+    url = storage.bucket.meta.client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': storage.bucket_name,
+            'Key': storage._normalize_name(chave),
+            'ContentType': content_type,
+            'ContentLength': tamanho,
+        },
+        ExpiresIn=_expiracao()
+    )
+    cabecalhos = {'Content-Type': content_type, 'Content-Length': str(tamanho)}
+    token = signing.dumps(
+        {
+            'chave': chave,
+            'content_type': content_type,
+            'modelo': instance._meta.label,
+            'pk': str(instance.pk),
+        },
+        salt=_SALT
+    )
+    return {
+        'url': url,
+        'metodo': 'PUT',
+        'cabecalhos': cabecalhos,
+        'token': token,
+        'expira_em': _expiracao(),
+    }
+
+
+def validar_upload(instance, token):
+    """
+    (chave, content_type) do upload enviado para `instance`, após conferir
+    o token e o tamanho do objeto temporário. Levanta UploadInvalido caso
+    contrário.
+    """
+    try:
+        # Margem para a confirmação chegar depois de um PUT no limite da validade
+        dados = signing.loads(token or '', salt=_SALT, max_age=_expiracao() * 2)
+    except signing.BadSignature:
+        raise UploadInvalido('Token de upload inválido ou expirado')
+    if dados.get('modelo') != instance._meta.label or dados.get('pk') != str(instance.pk):
+        raise UploadInvalido('Token de upload não pertence a este registro')
+
+    chave = dados['chave']
+    storage = instance._meta.get_field('imagem_perfil').storage
+    if not storage.exists(chave):
+        raise UploadInvalido('Arquivo ainda não foi enviado')
+    # Defesa extra: o tamanho já faz parte da assinatura do PUT
+    if storage.size(chave) > _max_bytes():
+        _apagar_pendente(storage, chave)
+        raise UploadInvalido('Arquivo maior que o permitido')
+    return chave, dados['content_type']
+
+
+def armazenar_upload(instance, chave, content_type):
+    """
+    Nome definitivo da imagem enviada à chave temporária, após conferir o
+    conteúdo e copiá-lo para o nome por conteúdo. Levanta UploadInvalido se
+    não for uma imagem do tipo declarado. Roda no worker.
+    """
+    campo = instance._meta.get_field('imagem_perfil')
+    storage = campo.storage
+    try:
+        if storage.size(chave) > _max_bytes():
+            raise UploadInvalido('Arquivo maior que o permitido')
+        with storage.open(chave, 'rb') as arquivo:
+            conteudo = arquivo.read()
+        _conferir_imagem(conteudo, content_type)
+        # Cópia com o nome definitivo (hash do conteúdo no storage padrão)
+        return storage.save(
+            campo.generate_filename(instance, os.path.basename(chave)),
+            ContentFile(conteudo)
+        )
+    finally:
+        _apagar_pendente(storage, chave)
@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, RachaViewSet, PremioViewSet,
-    PartidaViewSet, SolicitacaoRachaViewSet
+    PartidaViewSet, SolicitacaoRachaViewSet, eventos_partida
 )
 
 router = DefaultRouter()
@@ -13,5 +14,28 @@ router.register(r'partidas', PartidaViewSet, basename='partida')
 router.register(r'solicitacoes', SolicitacaoRachaViewSet, basename='solicitacao')
 
 urlpatterns = [
+    path('partidas/<uuid:pk>/eventos/', eventos_partida, name='partida-eventos'),
     path('', include(router.urls)),
 ]
+
+if settings.RACHAS_ASGI:
+    # Modo ASGI: leituras mais acessadas atendidas pelas views async (GET);
+    # os demais métodos dessas rotas seguem para os ViewSets
+    from . import views_async
+
+    urlpatterns = [
+        path('usuarios/me/', views_async.me, name='usuario-me'),
+        path('rachas/meus_rachas/', views_async.meus_rachas, name='racha-meus-rachas'),
+        path('rachas/<uuid:pk>/ranking/', views_async.ranking, name='racha-ranking'),
+        path(
+            'rachas/<uuid:pk>/ranking_artilheiros/',
+            views_async.ranking_artilheiros,
+            name='racha-ranking-artilheiros'
+        ),
+        path(
+            'rachas/<uuid:pk>/ranking_assistencias/',
+            views_async.ranking_assistencias,
+            name='racha-ranking-assistencias'
+        ),
+        path('partidas/<uuid:pk>/', views_async.partida_detalhe, name='partida-detail'),
+    ] + urlpatterns
@@ -2,15 +2,18 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum, Count, Q, F
+from django.db import transaction
+from django.db.models import Sum, Count, Q, F, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from datetime import timedelta
-import rembg
-from PIL import Image
-from io import BytesIO
-from django.core.files.base import ContentFile
-from django.http import HttpResponse
+import uuid
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+import asyncio
 
 from .models import (
     User, Racha, JogadoresRacha, Premio, Partida,
@@ -21,9 +24,93 @@ from .serializers import (
     JogadoresRachaSerializer, PremioSerializer, PartidaSerializer, PartidaDetailSerializer,
     JogadorPartidaSerializer, RegistroPartidaSerializer, PremioPartidaSerializer,
     SolicitacaoRachaSerializer, RankingJogadorSerializer, RankingArtilhariaSerializer,
-    RankingAssistenciasSerializer, get_image_url
+    RankingAssistenciasSerializer, get_image_url, get_image_variantes
 )
 from .permissions import IsAdminRacha, IsJogadorRacha, IsAdminRachaOrReadOnly
+from .roles import papeis_do_usuario, incrementar_versao_papeis
+from .authentication import ausuario_do_request
+from .idempotency import idempotente
+from .jobs import enfileirar
+from .proxy_imagens import resposta_proxy, ImagemIndisponivel
+from .uploads import preparar_upload, validar_upload, UploadInvalido
+from .solicitacoes import (
+    racha_para_solicitacao, criar_solicitacao_pendente, decidir_em_lote,
+    contar_pendentes, ajustar_pendentes, delta_pendente
+)
+from .sincronizacao import mesclar_log_partida, LogInvalido
+from .eventos import publicar_evento, registro_evento, get_broker, formatar_sse
+
+
+def _separar_ids(ids):
+    """
+    Normaliza uma lista de ids (UUID) removendo duplicatas.
+    Retorna (ids_validos, ids_invalidos) preservando a ordem recebida.
+    """
+    validos = []
+    invalidos = []
+    vistos = set()
+    for valor in ids:
+        try:
+            id_normalizado = uuid.UUID(str(valor))
+        except (TypeError, ValueError, AttributeError):
+            invalidos.append(valor)
+            continue
+        if id_normalizado not in vistos:
+            vistos.add(id_normalizado)
+            validos.append(id_normalizado)
+    return validos, invalidos
+
+
+def queryset_meus_rachas(user_id):
+    """
+    Rachas em que o usuário é admin ou jogador, com total de jogadores ativos
+    e flag is_admin anotados (usado pela view síncrona e pela async)
+    """
+    # UNION dos ids (admin + membro) evita o JOIN duplo seguido de DISTINCT
+    ids_admin = Racha.administrador.through.objects.filter(
+        user_id=user_id
+    ).values('racha_id')
+    ids_membro = JogadoresRacha.objects.filter(
+        jogador_id=user_id
+    ).values('racha_id')
+    
+    # Contagem de ativos e flag de admin calculadas no mesmo SELECT
+    total_ativos = JogadoresRacha.objects.filter(
+        racha_id=OuterRef('pk'),
+        ativo=True
+    ).order_by().values('racha_id').annotate(total=Count('id')).values('total')
+    
+    return Racha.objects.filter(
+        pk__in=ids_admin.union(ids_membro)
+    ).annotate(
+        total_jogadores=Coalesce(Subquery(total_ativos), Value(0)),
+        is_admin=Exists(
+            Racha.administrador.through.objects.filter(
+                racha_id=OuterRef('pk'),
+                user_id=user_id
+            )
+        )
+    ).prefetch_related('administrador')
+
+
+def _solicitar_entrada(request, codigo):
+    """
+    Cria a solicitação pendente do usuário para o racha do código.
+    Retorna (solicitacao, None) ou (None, 'membro' | 'pendente'); levanta
+    Http404 se o código não existir.
+    """
+    racha = racha_para_solicitacao(codigo, request.user.id)
+    if racha is None:
+        raise Http404
+    if racha.membro:
+        return None, 'membro'
+    if racha.pendente:
+        return None, 'pendente'
+    solicitacao = criar_solicitacao_pendente(racha, request.user)
+    if solicitacao is None:
+        # Requisição simultânea do mesmo usuário criou a solicitação primeiro
+        return None, 'pendente'
+    return solicitacao, None
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -55,24 +142,17 @@ class UserViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def proxy_image(self, request):
-        """Proxy para imagens para evitar problemas de CORS"""
-        import requests
+        """Proxy para imagens para evitar problemas de CORS (com cache, ver proxy_imagens.py)"""
         url = request.query_params.get('url')
         if not url:
             return Response({'erro': 'URL obrigatória'}, status=status.HTTP_400_BAD_REQUEST)
-            
+        if not url.startswith(('http://', 'https://')):
+            return Response({'erro': 'URL inválida'}, status=status.HTTP_400_BAD_REQUEST)
+        
         try:
-            # Validar e buscar a imagem
-            response = requests.get(url, stream=True)
-            
-            if response.status_code == 200:
-                content_type = response.headers.get('Content-Type')
-                return HttpResponse(response.content, content_type=content_type)
-            else:
-                return Response({'erro': 'Falha ao buscar imagem'}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            print(f"Erro no proxy de imagem: {e}")
-            return Response({'erro': 'Erro interno'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return resposta_proxy(request, url)
+        except ImagemIndisponivel as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     @action(detail=False, methods=['get', 'put', 'patch'])
     def me(self, request):
@@ -87,33 +167,64 @@ class UserViewSet(viewsets.ModelViewSet):
         # Para PUT e PATCH
         data = request.data.copy() # Make mutable copy
         
-        # Processamento de remoção de fundo
-        if 'remove_bg' in data and data.get('remove_bg') == 'true' and 'imagem_perfil' in data:
-            try:
-                image_file = data['imagem_perfil']
-                if hasattr(image_file, 'read'): # Check if it's a file
-                    input_image = Image.open(image_file)
-                    
-                    # Remover fundo
-                    output_image = rembg.remove(input_image)
-                    
-                    # Salvar em buffer
-                    buffer = BytesIO()
-                    output_image.save(buffer, format='PNG')
-                    
-                    # Criar novo arquivo Django
-                    file_name = image_file.name.split('.')[0] + '_nobg.png'
-                    data['imagem_perfil'] = ContentFile(buffer.getvalue(), name=file_name)
-            except Exception as e:
-                print(f"Erro ao remover fundo: {e}")
-                # Continua sem remover fundo em caso de erro
+        # A remoção de fundo roda no worker: a imagem original é salva agora
+        # e trocada pela versão sem fundo quando o job terminar
+        # (imagem_perfil_status: PROCESSANDO -> CONCLUIDO/FALHOU)
+        remover_fundo = data.get('remove_bg') == 'true' and hasattr(data.get('imagem_perfil'), 'read')
 
         serializer = UserSerializer(user, data=data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                if 'imagem_perfil' in serializer.validated_data:
+                    # Descarta um upload direto ainda pendente (imagem_pendente)
+                    user = serializer.save(
+                        imagem_perfil_status='PROCESSANDO' if remover_fundo else '',
+                        imagem_pendente=''
+                    )
+                else:
+                    user = serializer.save()
+                if remover_fundo and user.imagem_perfil:
+                    enfileirar('imagens.remover_fundo_perfil', user_id=str(user.pk), nome=user.imagem_perfil.name)
+                    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def upload_imagem(self, request):
+        """URL assinada para enviar a imagem de perfil direto ao bucket (ver uploads.py)"""
+        try:
+            return Response(preparar_upload(
+                request.user, request.data.get('content_type'), request.data.get('tamanho')
+            ))
+        except UploadInvalido as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['post'])
+    def confirmar_imagem(self, request):
+        """
+        Confirma a imagem enviada pela URL assinada (aceita remove_bg). O
+        arquivo é conferido e associado ao usuário pelo worker (tarefa
+        imagens.armazenar_upload); até lá imagem_pendente fica true.
+        """
+        user = request.user
+        try:
+            chave, content_type = validar_upload(user, request.data.get('token'))
+        except UploadInvalido as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            user.imagem_pendente = chave
+            user.save(update_fields=['imagem_pendente'])
+            enfileirar(
+                'imagens.armazenar_upload',
+                modelo=User._meta.label,
+                pk=str(user.pk),
+                chave=chave,
+                content_type=content_type,
+                remover_fundo=str(request.data.get('remove_bg')).lower() == 'true'
+            )
+        return Response(UserSerializer(user).data, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def dashboard(self, request):
         """Retorna estatísticas para o dashboard do usuário"""
@@ -246,17 +357,27 @@ class RachaViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Cria racha e define o usuário como administrador"""
         racha = serializer.save()
-        racha.administrador.add(self.request.user)
         # Adiciona o criador como jogador
         JogadoresRacha.objects.create(racha=racha, jogador=self.request.user)
+        # Incluir o admin por último: o m2m_changed incrementa a versão de
+        # papéis uma única vez já cobrindo o vínculo de jogador
+        racha.administrador.add(self.request.user)
+        papeis_do_usuario(self.request).invalidar()
+    
+    def perform_update(self, serializer):
+        """Atualiza racha; a lista de administradores pode ter mudado"""
+        serializer.save()
+        papeis_do_usuario(self.request).invalidar()
     
     @action(detail=False, methods=['get'])
     def meus_rachas(self, request):
-        """Lista rachas do usuário autenticado"""
-        rachas = Racha.objects.filter(
-            Q(administrador__id=request.user.id) |
-            Q(jogadores_racha__jogador=request.user)
-        ).distinct()
+        """Lista rachas do usuário autenticado (paginado)"""
+        rachas = self.filter_queryset(queryset_meus_rachas(request.user.id))
+        page = self.paginate_queryset(rachas)
+        if page is not None:
+            serializer = RachaSerializer(page, many=True, context={'request': request})
+            return self.get_paginated_response(serializer.data)
+        
         serializer = RachaSerializer(rachas, many=True, context={'request': request})
         return Response(serializer.data)
     
@@ -271,23 +392,15 @@ class RachaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        racha = get_object_or_404(Racha, codigo_convite=codigo)
+        solicitacao, motivo = _solicitar_entrada(request, codigo)
         
-        # Verifica se já é membro
-        if JogadoresRacha.objects.filter(racha=racha, jogador=request.user).exists():
+        if motivo == 'membro':
             return Response(
                 {'erro': 'Você já é membro deste racha'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Cria solicitação
-        solicitacao, created = SolicitacaoRacha.objects.get_or_create(
-            racha=racha,
-            jogador=request.user,
-            defaults={'status': 'PENDENTE'}
-        )
-        
-        if not created:
+        if motivo == 'pendente':
             return Response(
                 {'mensagem': 'Você já tem uma solicitação pendente'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -305,12 +418,47 @@ class RachaViewSet(viewsets.ModelViewSet):
         serializer = JogadoresRachaSerializer(jogadores, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['post'])
+    def upload_imagem(self, request, pk=None):
+        """URL assinada para enviar a imagem do racha direto ao bucket (apenas admin)"""
+        racha = self.get_object()
+        try:
+            return Response(preparar_upload(
+                racha, request.data.get('content_type'), request.data.get('tamanho')
+            ))
+        except UploadInvalido as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=True, methods=['post'])
+    def confirmar_imagem(self, request, pk=None):
+        """Confirma a imagem do racha enviada pela URL assinada (apenas admin; ver UserViewSet)"""
+        racha = self.get_object()
+        try:
+            chave, content_type = validar_upload(racha, request.data.get('token'))
+        except UploadInvalido as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            racha.imagem_pendente = chave
+            racha.save(update_fields=['imagem_pendente'])
+            enfileirar(
+                'imagens.armazenar_upload',
+                modelo=Racha._meta.label,
+                pk=str(racha.pk),
+                chave=chave,
+                content_type=content_type
+            )
+        return Response(
+            RachaSerializer(racha, context={'request': request}).data,
+            status=status.HTTP_202_ACCEPTED
+        )
+    
     @action(detail=True, methods=['post'])
     def alterar_status_jogador(self, request, pk=None):
         """Altera o status ativo/inativo de um jogador"""
         racha = self.get_object()
         
-        if request.user not in racha.administrador.all():
+        if not papeis_do_usuario(request).is_admin(racha):
             return Response(
                 {'erro': 'Apenas administradores podem alterar status de jogadores'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -328,6 +476,7 @@ class RachaViewSet(viewsets.ModelViewSet):
         jogador_racha = get_object_or_404(JogadoresRacha, racha=racha, jogador_id=jogador_id)
         jogador_racha.ativo = novo_status
         jogador_racha.save()
+        incrementar_versao_papeis(jogador_racha.jogador_id)
         
         return Response({'mensagem': f'Status alterado para {novo_status}'})
     
@@ -351,6 +500,7 @@ class RachaViewSet(viewsets.ModelViewSet):
         )
         jogador_racha.ativo = False
         jogador_racha.save()
+        incrementar_versao_papeis(jogador_racha.jogador_id)
         
         return Response({'mensagem': 'Jogador removido com sucesso'})
     
@@ -474,6 +624,7 @@ class RachaViewSet(viewsets.ModelViewSet):
                 'jogador_nome': jogador.get_full_name(),
                 'jogador_username': jogador.username,
                 'jogador_imagem_perfil': get_image_url(jogador.imagem_perfil) or '',
+                'jogador_imagem_variantes': get_image_variantes(jogador),
                 'posicao': jogador.posicao,
                 'gols': gols,
                 'assistencias': assistencias,
@@ -511,9 +662,9 @@ class PremioViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Cria prêmio apenas se usuário é admin do racha"""
         racha_id = self.request.data.get('racha')
-        racha = get_object_or_404(Racha, id=racha_id)
         
-        if self.request.user not in racha.administrador.all():
+        if not papeis_do_usuario(self.request).is_admin(racha_id):
+            get_object_or_404(Racha, id=racha_id)
             raise PermissionError("Você não é administrador deste racha")
         
         serializer.save()
@@ -528,6 +679,8 @@ class PartidaViewSet(viewsets.ModelViewSet):
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ['criado_em', 'data_inicio']
     ordering = ['-criado_em']
+    # Limite de eventos aceitos por requisição em lote
+    MAX_EVENTOS_LOTE = 200
     
     def create(self, request, *args, **kwargs):
         """Cria nova partida"""
@@ -547,9 +700,9 @@ class PartidaViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """Cria partida apenas se usuário é admin do racha"""
         racha_id = self.request.data.get('racha')
-        racha = get_object_or_404(Racha, id=racha_id)
         
-        if self.request.user not in racha.administrador.all():
+        if not papeis_do_usuario(self.request).is_admin(racha_id):
+            get_object_or_404(Racha, id=racha_id)
             raise PermissionError("Você não é administrador deste racha")
         
         serializer.save()
@@ -563,6 +716,7 @@ class PartidaViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
     @action(detail=True, methods=['post'])
+    @idempotente
     def adicionar_jogador(self, request, pk=None):
         """Adiciona jogador à partida"""
         partida = self.get_object()
@@ -574,29 +728,12 @@ class PartidaViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            jogadores_adicionados = []
-            erros = []
-            
-            for j_id in jogadores_ids:
-                try:
-                    jogador = get_object_or_404(User, id=j_id)
-                    # Verifica se jogador pertence ao racha
-                    if not JogadoresRacha.objects.filter(racha=partida.racha, jogador=jogador, ativo=True).exists():
-                         erros.append(f"Jogador {jogador.get_full_name()} não pertence a este racha")
-                         continue
-
-                    jogador_partida, created = JogadorPartida.objects.update_or_create(
-                        partida=partida,
-                        jogador=jogador,
-                        defaults={'presente': True}
-                    )
-                    jogadores_adicionados.append(JogadorPartidaSerializer(jogador_partida).data)
-                except Exception as e:
-                    erros.append(str(e))
+            jogadores_adicionados, erros, resultados = self._registrar_presencas(partida, jogadores_ids)
             
             return Response({
                 'jogadores': jogadores_adicionados,
-                'erros': erros
+                'erros': erros,
+                'resultados': resultados
             })
 
         jogador_id = request.data.get('jogador_id')
@@ -622,10 +759,60 @@ class PartidaViewSet(viewsets.ModelViewSet):
             jogador=jogador,
             defaults={'presente': True}
         )
+        publicar_evento(partida.pk, 'presenca_alterada', {
+            'jogadores_ids': [str(jogador.id)], 'presente': True
+        })
         
         serializer = JogadorPartidaSerializer(jogador_partida)
         return Response(serializer.data)
 
+    def _registrar_presencas(self, partida, jogadores_ids):
+        """
+        Registra presença de vários jogadores em uma transação.
+        
+        Valida o vínculo com o racha de todos os ids em uma única consulta e
+        grava com um único INSERT ... ON CONFLICT DO UPDATE.
+        Retorna (presenças serializadas, erros, resultado por id).
+        """
+        ids_validos, ids_invalidos = _separar_ids(jogadores_ids)
+        
+        vinculos = JogadoresRacha.objects.filter(
+            racha_id=partida.racha_id,
+            jogador_id__in=ids_validos,
+            ativo=True
+        ).select_related('jogador')
+        jogadores = {v.jogador_id: v.jogador for v in vinculos}
+        
+        presencas = [
+            JogadorPartida(partida=partida, jogador=jogadores[j_id], presente=True)
+            for j_id in ids_validos if j_id in jogadores
+        ]
+        with transaction.atomic():
+            presencas = JogadorPartida.objects.bulk_create(
+                presencas,
+                update_conflicts=True,
+                unique_fields=['partida', 'jogador'],
+                update_fields=['presente']
+            )
+        if presencas:
+            publicar_evento(partida.pk, 'presenca_alterada', {
+                'jogadores_ids': [str(p.jogador_id) for p in presencas], 'presente': True
+            })
+        
+        jogadores_adicionados = JogadorPartidaSerializer(presencas, many=True).data
+        erros = []
+        resultados = []
+        for valor in ids_invalidos:
+            erros.append(f"Id de jogador inválido: {valor}")
+            resultados.append({'jogador_id': valor, 'status': 'erro', 'erro': erros[-1]})
+        for j_id in ids_validos:
+            if j_id in jogadores:
+                resultados.append({'jogador_id': str(j_id), 'status': 'adicionado'})
+            else:
+                erros.append(f"Jogador {j_id} não pertence a este racha")
+                resultados.append({'jogador_id': str(j_id), 'status': 'erro', 'erro': erros[-1]})
+        return jogadores_adicionados, erros, resultados
+
     @action(detail=True, methods=['post'])
     def registrar_presenca(self, request, pk=None):
         """Registra presença de jogador na partida"""
@@ -646,8 +833,15 @@ class PartidaViewSet(viewsets.ModelViewSet):
             jogador=jogador,
             defaults={'presente': presente}
         )
+        publicar_evento(partida.pk, 'presenca_alterada', {
+            'jogadores_ids': [str(jogador.id)], 'presente': presenca.presente
+        })
+        
+        serializer = JogadorPartidaSerializer(presenca)
+        return Response(serializer.data)
         
     @action(detail=True, methods=['post'])
+    @idempotente
     def registrar_gol(self, request, pk=None):
         """Registra gol e assistência na partida"""
         partida = self.get_object()
@@ -676,10 +870,93 @@ class PartidaViewSet(viewsets.ModelViewSet):
             jogador_gol=jogador_gol,
             jogador_assistencia=jogador_assistencia
         )
+        publicar_evento(partida.pk, 'gol_adicionado', registro_evento(registro))
         
         serializer = RegistroPartidaSerializer(registro)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=['post'])
+    @idempotente
+    def registrar_gols(self, request, pk=None):
+        """
+        Registra vários gols/assistências de uma vez (súmula da partida).
+        
+        Espera {'eventos': [{'jogador_gol_id': ..., 'jogador_assistencia_id': ...}, ...]}.
+        Todos os jogadores são validados contra o elenco do racha em uma única
+        consulta; se algum evento for inválido nada é gravado.
+        """
+        partida = self.get_object()
+        
+        if not papeis_do_usuario(request).is_admin(partida.racha_id):
+            return Response(
+                {'erro': 'Apenas o admin pode registrar a súmula da partida'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        eventos = request.data.get('eventos')
+        
+        if not isinstance(eventos, list) or not eventos:
+            return Response(
+                {'erro': 'eventos deve ser uma lista não vazia'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(eventos) > self.MAX_EVENTOS_LOTE:
+            return Response(
+                {'erro': f'Máximo de {self.MAX_EVENTOS_LOTE} eventos por requisição'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        referenciados = []
+        for evento in eventos:
+            if isinstance(evento, dict):
+                referenciados += [v for v in (evento.get('jogador_gol_id'), evento.get('jogador_assistencia_id')) if v]
+        ids_validos, _ = _separar_ids(referenciados)
+        elenco = {
+            v.jogador_id: v.jogador
+            for v in JogadoresRacha.objects.filter(
+                racha_id=partida.racha_id,
+                jogador_id__in=ids_validos,
+                ativo=True
+            ).select_related('jogador')
+        }
+        
+        registros = []
+        erros = []
+        for indice, evento in enumerate(eventos):
+            if not isinstance(evento, dict):
+                erros.append({'indice': indice, 'erro': 'Evento inválido'})
+                continue
+            gol_id = evento.get('jogador_gol_id')
+            assistencia_id = evento.get('jogador_assistencia_id')
+            if not gol_id and not assistencia_id:
+                erros.append({'indice': indice, 'erro': 'Informe pelo menos o autor do gol ou da assistência'})
+                continue
+            
+            jogadores = {}
+            for campo, valor in (('jogador_gol', gol_id), ('jogador_assistencia', assistencia_id)):
+                if not valor:
+                    jogadores[campo] = None
+                    continue
+                validos, _ = _separar_ids([valor])
+                jogador = elenco.get(validos[0]) if validos else None
+                if jogador is None:
+                    erros.append({'indice': indice, 'erro': f'Jogador {valor} não pertence a este racha'})
+                    break
+                jogadores[campo] = jogador
+            else:
+                registros.append(RegistroPartida(partida=partida, **jogadores))
+        
+        if erros:
+            return Response({'erros': erros}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            registros = RegistroPartida.objects.bulk_create(registros)
+            for registro in registros:
+                publicar_evento(partida.pk, 'gol_adicionado', registro_evento(registro))
+        
+        serializer = RegistroPartidaSerializer(registros, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['delete'])
     def remover_registro(self, request, pk=None):
         """Remove um registro de gol/assistência da partida"""
@@ -694,10 +971,12 @@ class PartidaViewSet(viewsets.ModelViewSet):
             
         registro = get_object_or_404(RegistroPartida, id=registro_id, partida=partida)
         registro.delete()
+        publicar_evento(partida.pk, 'gol_removido', {'id': str(registro_id)})
         
         return Response({'mensagem': 'Registro removido com sucesso'})
 
     @action(detail=True, methods=['post'])
+    @idempotente
     def associar_premio(self, request, pk=None):
         """Associa um prêmio a um jogador na partida"""
         partida = self.get_object()
@@ -726,6 +1005,9 @@ class PartidaViewSet(viewsets.ModelViewSet):
             jogador=jogador,
             premio=premio
         )
+        publicar_evento(partida.pk, 'premio_adicionado', {
+            'id': str(premio_partida.id), 'premio_id': str(premio.id), 'jogador_id': str(jogador.id)
+        })
 
         return Response({
             'mensagem': f'Prêmio {premio.nome} associado a {jogador.first_name}',
@@ -759,8 +1041,11 @@ class PartidaViewSet(viewsets.ModelViewSet):
                 registro.jogador_assistencia = None
                 
         registro.save()
+        publicar_evento(partida.pk, 'gol_editado', registro_evento(registro))
         serializer = RegistroPartidaSerializer(registro)
-        return Response(serializer.data) @action(detail=True, methods=['post'])
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
     def registrar_premio(self, request, pk=None):
         """Registra prêmio para jogador na partida"""
         partida = self.get_object()
@@ -776,21 +1061,55 @@ class PartidaViewSet(viewsets.ModelViewSet):
         premio = get_object_or_404(Premio, id=premio_id)
         jogador = get_object_or_404(User, id=jogador_id)
         
+        if premio.racha_id != partida.racha_id:
+            return Response(
+                {'erro': 'O prêmio não pertence ao racha desta partida'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
         premio_partida = PremioPartida.objects.create(
             partida=partida,
             premio=premio,
             jogador=jogador
         )
+        publicar_evento(partida.pk, 'premio_adicionado', {
+            'id': str(premio_partida.id), 'premio_id': str(premio.id), 'jogador_id': str(jogador.id)
+        })
         
         serializer = PremioPartidaSerializer(premio_partida)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=True, methods=['post'])
+    def sincronizar(self, request, pk=None):
+        """
+        Recebe o log offline completo da partida (presenças, gols/assistências,
+        prêmios e finalização) e mescla tudo em uma transação.
+        """
+        partida = self.get_object()
+        
+        if not papeis_do_usuario(request).is_admin(partida.racha_id):
+            return Response(
+                {'erro': 'Apenas o admin pode sincronizar a partida'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            resultado = mesclar_log_partida(partida, request.data)
+        except LogInvalido as e:
+            return Response({'erro': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Muitas alterações de uma vez: os clientes recarregam a partida
+        publicar_evento(partida.pk, 'partida_sincronizada')
+        if resultado['finalizada']:
+            publicar_evento(partida.pk, 'partida_finalizada', {'data_fim': partida.data_fim})
+        return Response(resultado)
+
     @action(detail=True, methods=['post'])
     def finalizar(self, request, pk=None):
         """Finaliza a partida"""
         partida = self.get_object()
         
-        if request.user not in partida.racha.administrador.all() :
+        if not papeis_do_usuario(request).is_admin(partida.racha_id):
             return Response(
                 {'erro': 'Apenas o admin pode finalizar a partida'},
                 status=status.HTTP_403_FORBIDDEN
@@ -799,6 +1118,7 @@ class PartidaViewSet(viewsets.ModelViewSet):
         partida.data_fim = timezone.now()
         partida.status = False
         partida.save()
+        publicar_evento(partida.pk, 'partida_finalizada', {'data_fim': partida.data_fim})
         
         serializer = PartidaDetailSerializer(partida)
         return Response(serializer.data)
@@ -812,6 +1132,8 @@ class SolicitacaoRachaViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.OrderingFilter]
     ordering = ['-criado_em']
+    # Limite de solicitações aprovadas/negadas por requisição em lote
+    MAX_SOLICITACOES_LOTE = 200
     
     def create(self, request, *args, **kwargs):
         """Cria nova solicitação de entrada em racha"""
@@ -823,31 +1145,34 @@ class SolicitacaoRachaViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        racha = get_object_or_404(Racha, codigo_convite=codigo_convite)
+        solicitacao, motivo = _solicitar_entrada(request, codigo_convite)
         
         # Verifica se já é membro
-        if JogadoresRacha.objects.filter(racha=racha, jogador=request.user).exists():
+        if motivo == 'membro':
             return Response(
                 {'erro': 'Você já é membro deste racha'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         # Verifica se já existe solicitação pendente
-        if SolicitacaoRacha.objects.filter(racha=racha, jogador=request.user, status='PENDENTE').exists():
+        if motivo == 'pendente':
             return Response(
                 {'erro': 'Você já tem uma solicitação pendente para este racha'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        solicitacao = SolicitacaoRacha.objects.create(
-            racha=racha,
-            jogador=request.user,
-            status='PENDENTE'
-        )
-        
         serializer = SolicitacaoRachaSerializer(solicitacao)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    def perform_update(self, serializer):
+        antes = (serializer.instance.racha_id, serializer.instance.status)
+        solicitacao = serializer.save()
+        ajustar_pendentes(delta_pendente(antes, (solicitacao.racha_id, solicitacao.status)))
+    
+    def perform_destroy(self, instance):
+        ajustar_pendentes(delta_pendente((instance.racha_id, instance.status), None))
+        instance.delete()
+    
     def get_queryset(self):
         tipo = self.request.query_params.get('tipo', 'recebidas')
         
@@ -863,7 +1188,7 @@ class SolicitacaoRachaViewSet(viewsets.ModelViewSet):
         """Aprova solicitação de entrada"""
         solicitacao = self.get_object()
         
-        if request.user not in solicitacao.racha.administrador.all() :
+        if not papeis_do_usuario(request).is_admin(solicitacao.racha_id):
             return Response(
                 {'erro': 'Apenas o admin pode aprovar solicitações'},
                 status=status.HTTP_403_FORBIDDEN
@@ -874,8 +1199,11 @@ class SolicitacaoRachaViewSet(viewsets.ModelViewSet):
             racha=solicitacao.racha,
             jogador=solicitacao.jogador
         )
+        incrementar_versao_papeis(solicitacao.jogador_id)
         
         # Atualiza status
+        if solicitacao.status == 'PENDENTE':
+            ajustar_pendentes({solicitacao.racha_id: -1})
         solicitacao.status = 'ACEITO'
         solicitacao.save()
         
@@ -887,14 +1215,122 @@ class SolicitacaoRachaViewSet(viewsets.ModelViewSet):
         """Nega solicitação de entrada"""
         solicitacao = self.get_object()
         
-        if request.user not in solicitacao.racha.administrador.all():
+        if not papeis_do_usuario(request).is_admin(solicitacao.racha_id):
             return Response(
                 {'erro': 'Apenas o admin pode negar solicitações'},
                 status=status.HTTP_403_FORBIDDEN
             )
         
+        if solicitacao.status == 'PENDENTE':
+            ajustar_pendentes({solicitacao.racha_id: -1})
         solicitacao.status = 'NEGADO'
         solicitacao.save()
         
         serializer = SolicitacaoRachaSerializer(solicitacao)
         return Response(serializer.data)
+    
+    def _decidir_lote(self, request, novo_status):
+        """
+        Aprova/nega em lote as solicitações de {'ids': [...]}.
+        Ids inexistentes, já decididos ou de rachas que o usuário não
+        administra voltam em 'ignoradas'.
+        """
+        ids = request.data.get('ids')
+        
+        if not isinstance(ids, list) or not ids:
+            return Response(
+                {'erro': 'ids deve ser uma lista não vazia'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > self.MAX_SOLICITACOES_LOTE:
+            return Response(
+                {'erro': f'Máximo de {self.MAX_SOLICITACOES_LOTE} solicitações por requisição'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        ids_validos, ids_invalidos = _separar_ids(ids)
+        decididas = decidir_em_lote(ids_validos, novo_status, papeis_do_usuario(request).admin_ids)
+        processadas = {id_ for id_, _, _ in decididas}
+        
+        return Response({
+            'status': novo_status,
+            'processadas': [str(id_) for id_ in ids_validos if id_ in processadas],
+            'ignoradas': [str(id_) for id_ in ids_validos if id_ not in processadas] + ids_invalidos,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def contagem(self, request):
+        """Total de solicitações pendentes recebidas (badge), lido do cache"""
+        return Response({'pendentes': contar_pendentes(request.user.id)})
+    
+    @action(detail=False, methods=['post'])
+    def aprovar_lote(self, request):
+        """Aprova várias solicitações de entrada de uma vez"""
+        return self._decidir_lote(request, 'ACEITO')
+    
+    @action(detail=False, methods=['post'])
+    def negar_lote(self, request):
+        """Nega várias solicitações de entrada de uma vez"""
+        return self._decidir_lote(request, 'NEGADO')
+
+
+# Intervalo (s) entre comentários de keep-alive no stream SSE
+SSE_KEEPALIVE = 15
+
+
+async def eventos_partida(request, pk):
+    """
+    Stream SSE (text/event-stream) com os deltas da partida: gol adicionado,
+    editado ou removido, presença alterada, prêmio, sincronização e
+    finalização.
+    
+    Requer o servidor ASGI (config/asgi.py). Como o EventSource do navegador
+    não envia headers, o access token pode vir em ?token=.
+    """
+    if not settings.RACHAS_ASGI:
+        # Sob WSGI o stream infinito prenderia um worker por assinante
+        # (e seria acumulado em memória): os clientes recarregam a partida
+        return JsonResponse(
+            {'erro': 'Eventos ao vivo exigem o servidor ASGI (RACHAS_ASGI)'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    try:
+        user = await ausuario_do_request(request, token_na_query=True)
+    except (InvalidToken, AuthenticationFailed):
+        return JsonResponse({'erro': 'Token inválido'}, status=status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return JsonResponse({'erro': 'Token obrigatório'}, status=status.HTTP_401_UNAUTHORIZED)
+    user_id = user.id
+    
+    racha_id = await Partida.objects.filter(pk=pk).values_list('racha_id', flat=True).afirst()
+    if racha_id is None:
+        return JsonResponse({'erro': 'Partida não encontrada'}, status=status.HTTP_404_NOT_FOUND)
+    
+    membro = await JogadoresRacha.objects.filter(
+        racha_id=racha_id, jogador_id=user_id, ativo=True
+    ).aexists()
+    if not membro and not await Racha.administrador.through.objects.filter(
+        racha_id=racha_id, user_id=user_id
+    ).aexists():
+        return JsonResponse({'erro': 'Sem acesso a esta partida'}, status=status.HTTP_403_FORBIDDEN)
+    
+    async def stream():
+        yield 'retry: 3000\n\n'
+        broker = get_broker()
+        inscricao = broker.inscrever(pk)
+        try:
+            while True:
+                try:
+                    evento = await asyncio.wait_for(inscricao.fila.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield formatar_sse(evento)
+        finally:
+            broker.cancelar(inscricao)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Desliga o buffer do nginx para o stream chegar em tempo real
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,253 @@
+"""
+Versões assíncronas das leituras mais acessadas: usuário atual, meus rachas,
+detalhe de partida e rankings.
+
+Usam o ORM async do Django e só são roteadas no modo ASGI
+(RACHAS_ASGI=True, ver config/asgi.py); sob WSGI cada view async rodaria em
+um event loop próprio e ficaria mais lenta que a versão síncrona. Métodos de
+escrita (PUT/PATCH/DELETE) continuam indo para os ViewSets síncronos.
+
+As respostas têm o mesmo formato das actions equivalentes dos ViewSets.
+"""
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db.models import Count, Sum, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import (
+    APIException, AuthenticationFailed, NotAuthenticated, NotFound, PermissionDenied
+)
+from rest_framework.request import Request
+
+from .models import User, Racha, JogadoresRacha, Partida, JogadorPartida, RegistroPartida, PremioPartida
+from .serializers import (
+    get_image_url, get_image_variantes, UserDetailSerializer, RachaSerializer, PartidaDetailSerializer,
+    RankingJogadorSerializer, RankingArtilhariaSerializer, RankingAssistenciasSerializer
+)
+from .authentication import ausuario_do_request
+from .roles import PapeisUsuario
+from .views import UserViewSet, RachaViewSet, PartidaViewSet, queryset_meus_rachas
+
+
+def _erro(excecao):
+    """Resposta no mesmo formato do exception_handler do DRF"""
+    dados = excecao.detail if isinstance(excecao.detail, (list, dict)) else {'detail': excecao.detail}
+    return JsonResponse(dados, status=excecao.status_code, safe=False)
+
+
+def _resposta(dados):
+    return JsonResponse(dados, safe=False)
+
+
+async def _autenticar(request):
+    """
+    Autentica pelo access token e carrega os papéis do usuário (uma consulta).
+    Deixa request.user e o cache de papéis prontos para os serializers.
+    """
+    user = await ausuario_do_request(request)
+    if user is None:
+        raise NotAuthenticated()
+    request.user = user
+    request._papeis_racha = await PapeisUsuario(user).acarregar()
+    return request._papeis_racha
+
+
+def leitura_async(view_async, view_sync):
+    """
+    Atende GET com a view async e repassa os demais métodos ao ViewSet
+    síncrono (que também responde 405 para métodos não suportados).
+    """
+    view_sync_async = sync_to_async(view_sync)
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return await view_sync_async(request, *args, **kwargs)
+        try:
+            return await view_async(request, *args, **kwargs)
+        except APIException as e:
+            return _erro(e)
+
+    view.__name__ = view_async.__name__
+    view.__doc__ = view_async.__doc__
+    return view
+
+
+async def _me(request):
+    """GET /usuarios/me/"""
+    papeis = await _autenticar(request)
+    user = await User.objects.filter(pk=papeis.user_id, is_active=True).afirst()
+    if user is None:
+        raise AuthenticationFailed()
+    return _resposta(UserDetailSerializer(user).data)
+
+
+async def _paginar(queryset, request, paginacao):
+    """
+    PageNumberPagination do DRF com a contagem e a página buscadas pelo ORM
+    async. Retorna (objetos, paginação) ou (objetos, None) sem paginação.
+    """
+    drf_request = Request(request)
+    page_size = paginacao.get_page_size(drf_request)
+    if not page_size:
+        return [obj async for obj in queryset], None
+
+    paginator = paginacao.django_paginator_class(queryset, page_size)
+    # Pré-define o cached_property para o Paginator não contar de forma síncrona
+    paginator.count = await queryset.acount()
+    page_number = paginacao.get_page_number(drf_request, paginator)
+    try:
+        paginacao.page = paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginacao.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginacao.request = drf_request
+    return [obj async for obj in paginacao.page.object_list], paginacao
+
+
+async def _meus_rachas(request):
+    """GET /rachas/meus_rachas/"""
+    papeis = await _autenticar(request)
+    view = RachaViewSet(request=Request(request), format_kwarg=None, action='meus_rachas')
+    rachas = view.filter_queryset(queryset_meus_rachas(papeis.user_id))
+
+    rachas, paginacao = await _paginar(rachas, request, view.paginator)
+    dados = RachaSerializer(rachas, many=True, context={'request': request}).data
+    if paginacao is None:
+        return _resposta(dados)
+    return _resposta({
+        'count': paginacao.page.paginator.count,
+        'next': paginacao.get_next_link(),
+        'previous': paginacao.get_previous_link(),
+        'results': dados,
+    })
+
+
+async def _partida_detalhe(request, pk):
+    """GET /partidas/<pk>/"""
+    papeis = await _autenticar(request)
+    # Mesmo filtro de PartidaViewSet.get_queryset, com os relacionados pré-carregados
+    partida = await Partida.objects.filter(
+        pk=pk,
+        racha__jogadores_racha__jogador_id=papeis.user_id
+    ).distinct().prefetch_related(
+        'jogadores_presenca__jogador',
+        'registros__jogador_gol',
+        'registros__jogador_assistencia',
+        'premios_partida__premio',
+        'premios_partida__jogador',
+    ).afirst()
+    if partida is None:
+        raise NotFound()
+    return _resposta(PartidaDetailSerializer(partida, context={'request': request}).data)
+
+
+async def _racha_visivel(request, pk):
+    """Racha para leitura: admin ou jogador ativo (IsAdminRachaOrReadOnly)"""
+    papeis = await _autenticar(request)
+    racha = await Racha.objects.filter(pk=pk).afirst()
+    if racha is None:
+        raise NotFound()
+    if not papeis.is_admin_ou_membro(racha):
+        raise PermissionDenied()
+    return racha
+
+
+def _total_por_jogador(modelo, campo_jogador, agregado, **filtros):
+    """Subconsulta correlacionada com o total do jogador (OuterRef) no racha"""
+    return Coalesce(
+        Subquery(
+            modelo.objects.filter(
+                partida__racha_id=OuterRef('racha_id'),
+                **{campo_jogador: OuterRef('jogador_id')},
+                **filtros
+            ).order_by().values(campo_jogador).annotate(total=agregado).values('total')
+        ),
+        Value(0)
+    )
+
+
+def _dados_jogador(jogador_racha):
+    jogador = jogador_racha.jogador
+    return {
+        'jogador_id': jogador.id,
+        'jogador_nome': jogador.get_full_name(),
+        'jogador_username': jogador.username,
+        'jogador_imagem_perfil': get_image_url(jogador.imagem_perfil) or '',
+        'jogador_imagem_variantes': get_image_variantes(jogador),
+    }
+
+
+async def _ranking(request, pk):
+    """GET /rachas/<pk>/ranking/ (uma consulta em vez de quatro por jogador)"""
+    racha = await _racha_visivel(request, pk)
+    jogadores = JogadoresRacha.objects.filter(
+        racha=racha,
+        ativo=True
+    ).select_related('jogador').annotate(
+        gols=_total_por_jogador(RegistroPartida, 'jogador_gol_id', Count('id')),
+        assistencias=_total_por_jogador(RegistroPartida, 'jogador_assistencia_id', Count('id')),
+        presencas=_total_por_jogador(JogadorPartida, 'jogador_id', Count('id'), presente=True),
+        premios_pontos=_total_por_jogador(PremioPartida, 'jogador_id', Sum('premio__valor_pontos')),
+    )
+
+    ranking = []
+    async for jogador_racha in jogadores:
+        ranking.append({
+            **_dados_jogador(jogador_racha),
+            'posicao': jogador_racha.jogador.posicao,
+            'gols': jogador_racha.gols,
+            'assistencias': jogador_racha.assistencias,
+            'presencas': jogador_racha.presencas,
+            'premios_pontos': jogador_racha.premios_pontos,
+            'pontuacao_total': (
+                jogador_racha.gols * racha.ponto_gol +
+                jogador_racha.assistencias * racha.ponto_assistencia +
+                jogador_racha.presencas * racha.ponto_presenca +
+                jogador_racha.premios_pontos
+            ),
+        })
+    ranking.sort(key=lambda x: x['pontuacao_total'], reverse=True)
+    return _resposta(RankingJogadorSerializer(ranking, many=True).data)
+
+
+async def _ranking_por_total(request, pk, campo_jogador, chave, serializer_class):
+    """Ranking de artilharia/assistências: jogadores ativos com total > 0"""
+    racha = await _racha_visivel(request, pk)
+    jogadores = JogadoresRacha.objects.filter(
+        racha=racha,
+        ativo=True
+    ).select_related('jogador').annotate(
+        total=_total_por_jogador(RegistroPartida, campo_jogador, Count('id'))
+    ).filter(total__gt=0).order_by('-total')
+
+    ranking = []
+    async for jogador_racha in jogadores:
+        ranking.append({
+            **_dados_jogador(jogador_racha),
+            chave: jogador_racha.total,
+            'posicao': len(ranking) + 1,
+        })
+    return _resposta(serializer_class(ranking, many=True).data)
+
+
+async def _ranking_artilheiros(request, pk):
+    """GET /rachas/<pk>/ranking_artilheiros/"""
+    return await _ranking_por_total(request, pk, 'jogador_gol_id', 'gols', RankingArtilhariaSerializer)
+
+
+async def _ranking_assistencias(request, pk):
+    """GET /rachas/<pk>/ranking_assistencias/"""
+    return await _ranking_por_total(
+        request, pk, 'jogador_assistencia_id', 'assistencias', RankingAssistenciasSerializer
+    )
+
+
+me = leitura_async(_me, UserViewSet.as_view({'get': 'me', 'put': 'me', 'patch': 'me'}))
+meus_rachas = leitura_async(_meus_rachas, RachaViewSet.as_view({'get': 'meus_rachas'}))
+partida_detalhe = leitura_async(_partida_detalhe, PartidaViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+}))
+ranking = leitura_async(_ranking, RachaViewSet.as_view({'get': 'ranking'}))
+ranking_artilheiros = leitura_async(_ranking_artilheiros, RachaViewSet.as_view({'get': 'ranking_artilheiros'}))
+ranking_assistencias = leitura_async(_ranking_assistencias, RachaViewSet.as_view({'get': 'ranking_assistencias'}))
@@ -41,8 +41,19 @@ export default function Home() {
   useEffect(() => {
     const fetchRachas = async () => {
       try {
-        const response = await api.get("/rachas/meus_rachas/");
-        setRachas(response.data);
+        // meus_rachas é paginado: segue `next` até a última página
+        const todos: Racha[] = [];
+        let url: string | null = "/rachas/meus_rachas/";
+        while (url) {
+          const response = await api.get(url);
+          if (!response.data.results) {
+            todos.push(...response.data);
+            break;
+          }
+          todos.push(...response.data.results);
+          url = response.data.next;
+        }
+        setRachas(todos);
       } catch (error) {
         console.error("Erro ao buscar rachas:", error);
       } finally {